@@ -13,53 +13,134 @@ import matplotlib.pyplot as plt # only used for the histogram at the end
 
 #plotly.tools.set_credentials_file(username='cecilartavion', api_key='ADD KEY HERE')
 
-#Use this distribution for when there are 10 precincts
-dist = [1,0,0,0,1,1,0,0,0,1] 
-
-##Use this distribution when there are 100 precincts.
-#dist = np.zeros(100)
-#precincts = [2,3,4,5,6,7,19,20,22,23,24,28,29,31,32,35,36,37,40,41,47,49,50,54,59,60,62,63,64,66,70,72,79,80,84,85,89,93,98,99]
-#for precinct in precincts:
-#    dist[precinct] = 1
-    
-num_yellow_seats=[]
-for i1 in range(len(dist)-1):
-    for i2 in range(i1+1,len(dist)-1):
-        for i3 in range(i2+1,len(dist)-1):
-            for i4 in range(i3+1,len(dist)-1):
-                temp_yellow_count=0
-                dist1 = dist[:i1+1]
-                dist2 = dist[i1+1:i2+1]
-                dist3 = dist[i2+1:i3+1]
-                dist4 = dist[i3+1:i4+1]
-                dist5 = dist[i4+1:]
-                if np.sum(dist1)>len(dist1)/2:
-                    temp_yellow_count += 1
-                if np.sum(dist1)==len(dist1)/2:
-                    temp_yellow_count += 0.5
-                if np.sum(dist2)>len(dist2)/2:
-                    temp_yellow_count += 1
-                if np.sum(dist2)==len(dist2)/2:
-                    temp_yellow_count += 0.5
-                if np.sum(dist3)>len(dist3)/2:
-                    temp_yellow_count += 1
-                if np.sum(dist3)==len(dist3)/2:
-                    temp_yellow_count += 0.5
-                if np.sum(dist4)>len(dist4)/2:
-                    temp_yellow_count += 1
-                if np.sum(dist4)==len(dist4)/2:
-                    temp_yellow_count += 0.5
-                if np.sum(dist5)>len(dist5)/2:
-                    temp_yellow_count += 1
-                if np.sum(dist5)==len(dist5)/2:
-                    temp_yellow_count += 0.5
-                num_yellow_seats.append(temp_yellow_count)
-                
-bins = np.arange(0,5,0.5)-.175
-width=0.7*(bins[1]-bins[0])
-print(len(num_yellow_seats))
-plt.hist(num_yellow_seats,bins=bins,width=width)
-plt.ylabel('Frequency')
-plt.xlabel('Number of districts (out of 5) for Yellow party')
-#plt.savefig('1d_hist_gy.eps', format='eps', dpi=1000)
-plt.show()
+
+def district_half_seats(yellow_votes, total_votes, ties='half'):
+    '''
+    district_half_seats, the seats won by Yellow in districts, counted in
+    half seats: 2 if Yellow has more than half of the votes, 0 if less, and
+    2, 0 or 1 for a tie depending on ties.
+
+    Arguments:
+    ----------
+    yellow_votes: numpy array instance
+        The Yellow votes in each district.
+    total_votes: numpy array instance
+        The total votes in each district.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green', or 'half' for half a
+        seat to each party.
+
+    RETURNS:
+    ----------
+    half_seats: numpy array instance
+        The half seats won by Yellow in each district.
+    '''
+    doubled = 2 * yellow_votes
+    tie = {'yellow': 2, 'green': 0, 'half': 1}[ties]
+    return np.where(doubled > total_votes, 2,
+                    np.where(doubled == total_votes, tie, 0))
+
+
+def seat_distribution_1d(dist, num_districts, min_length=1, max_length=None,
+                         populations=None, ties='half'):
+    '''
+    seat_distribution_1d, count the ways to cut a one-dimensional map into
+    num_districts districts of consecutive precincts by the number of seats
+    won by Yellow, without listing the ways.
+
+    The count is a dynamic program over the prefix sums of the votes: for
+    j = 1, ..., num_districts the table counts[i, s] holds the number of ways
+    to cut the first i precincts into j districts so that Yellow wins s half
+    seats. The j+1st district covers precincts a, ..., i-1, whose votes are
+    a difference of two prefix sums, so each table is built from the last
+    one in O(len(dist) * max_length) steps, one numpy operation per district
+    length.
+
+    Arguments:
+    ----------
+    dist: list or numpy array instance
+        The Yellow votes of the precincts, in order (1 for Yellow and 0 for
+        Green when every precinct has one vote).
+    num_districts: int instance
+        The number of districts.
+    min_length: int instance
+        The smallest number of precincts in a district, at least 1.
+    max_length: int instance
+        The largest number of precincts in a district, by default no bound.
+    populations: list or numpy array instance
+        The total votes of the precincts, by default 1 per precinct.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green', or 'half'.
+
+    RETURNS:
+    ----------
+    counts: numpy array instance
+        counts[s] is the number of ways in which Yellow wins s/2 seats. The
+        counts are exact: they are Python integers (an object array) when
+        they could overflow 64 bits.
+    '''
+    n = len(dist)
+    if populations is None:
+        populations = np.ones(n)
+    if max_length is None:
+        max_length = n
+    min_length = max(min_length, 1)
+    max_length = min(max_length, n)
+    num_half_seats = 2 * num_districts + 1
+    # prefix sums, so the votes of precincts a, ..., b-1 are Y[b] - Y[a]
+    Y = np.concatenate([[0], np.cumsum(dist)])
+    T = np.concatenate([[0], np.cumsum(populations)])
+    # the half seats of every district of every length, computed once
+    half_seats = {}
+    for length in range(min_length, max_length + 1):
+        half_seats[length] = district_half_seats(Y[length:] - Y[:n + 1 - length],
+                                                 T[length:] - T[:n + 1 - length],
+                                                 ties)
+    # the number of cuts is at most binomial(n-1, num_districts-1)
+    if math.comb(max(n - 1, 0), max(num_districts - 1, 0)) < 2**62:
+        dtype = np.int64
+    else:
+        dtype = object
+    counts = np.zeros((n + 1, num_half_seats), dtype=dtype)
+    counts[0, 0] = 1
+    for j in range(num_districts):
+        new_counts = np.zeros((n + 1, num_half_seats), dtype=dtype)
+        # j districts win at most 2*j half seats
+        width = 2 * j + 1
+        for length in range(min_length, max_length + 1):
+            # a district of this length from precinct a to a+length-1
+            for h in (0, 1, 2):
+                a = np.flatnonzero(half_seats[length] == h)
+                if len(a) == 0:
+                    continue
+                new_counts[a + length, h:h + width] += counts[a, :width]
+        counts = new_counts
+    return counts[n]
+
+
+if __name__ == '__main__':
+    #Use this distribution for when there are 10 precincts
+    dist = [1,0,0,0,1,1,0,0,0,1] 
+
+    ##Use this distribution when there are 100 precincts.
+    #dist = np.zeros(100)
+    #precincts = [2,3,4,5,6,7,19,20,22,23,24,28,29,31,32,35,36,37,40,41,47,49,50,54,59,60,62,63,64,66,70,72,79,80,84,85,89,93,98,99]
+    #for precinct in precincts:
+    #    dist[precinct] = 1
+
+    num_districts = 5
+    min_length = 1 # smallest number of precincts in a district
+    max_length = None # largest number of precincts in a district, None for no bound
+
+    # counts[s] is the number of ways for Yellow to win s/2 seats; ties give
+    # half a seat to each party.
+    counts = seat_distribution_1d(dist,num_districts,min_length,max_length)
+    seat_values = np.arange(len(counts))/2
+
+    width=0.7*0.5
+    print(sum(counts))
+    plt.bar(seat_values,counts.astype(float),width=width)
+    plt.ylabel('Frequency')
+    plt.xlabel('Number of districts (out of %d) for Yellow party' % num_districts)
+    #plt.savefig('1d_hist_gy.eps', format='eps', dpi=1000)
+    plt.show()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Load a real precinct map as the base graph of a chain.
+
+The adjacency can be given as
+    a JSON file, either in networkx node-link form
+        {"nodes": [{"id": ..., "population": ..., "district": ...}, ...],
+         "links": [{"source": ..., "target": ...}, ...]}
+    (the edges may also be called "edges"), or as a dictionary mapping every
+    precinct to the list of its neighbours;
+    a CSV file with one edge per row, in the columns source and target (or
+    the first two columns if there is no such header);
+    any other text file with one edge "u v" per line, # starts a comment.
+Precinct populations and an initial plan can come from the JSON nodes or
+from a separate CSV file with the columns id, population and district. The
+precinct populations are the number of people in each precinct, for the
+population balance of a plan; they are not the total votes that
+flip_walk.ChainState calls populations.
+
+Parsing a large map is slow compared to the walk itself, so the parsed arrays
+are saved in a .npz file named after the SHA-256 hash of the input files, the
+format they are read in and the nodes file argument. The next run with the
+same files and arguments loads that file instead.
+"""
+
+import csv
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from csr_graph import CSRGraph, create_csr_graph_from_edges
+
+AdjacencyData = namedtuple('AdjacencyData',
+                           ['graph', 'precinct_populations', 'districting',
+                            'node_ids'])
+
+CACHE_VERSION = 2
+
+
+def _read_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    node_ids = []
+    attributes = {}
+    edges = []
+    if 'nodes' in data:
+        for node in data['nodes']:
+            node_ids.append(str(node['id']))
+            attributes[str(node['id'])] = node
+        for link in data.get('links', data.get('edges', [])):
+            edges.append((str(link['source']), str(link['target'])))
+    else:
+        for (v, nbrs) in data.items():
+            node_ids.append(str(v))
+            for u in nbrs:
+                edges.append((str(v), str(u)))
+    return node_ids, edges, attributes
+
+
+def _read_csv_edges(path):
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    if len(rows) == 0:
+        return [], [], {}
+    header = [name.strip().lower() for name in rows[0]]
+    if 'source' in header and 'target' in header:
+        a = header.index('source')
+        b = header.index('target')
+        rows = rows[1:]
+    else:
+        a, b = 0, 1
+    edges = [(row[a].strip(), row[b].strip()) for row in rows if len(row) > 1]
+    return [], edges, {}
+
+
+def _read_text_edges(path):
+    edges = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if len(line) >= 2:
+                edges.append((line[0], line[1]))
+    return [], edges, {}
+
+
+def _read_nodes_csv(path):
+    attributes = {}
+    node_ids = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            row = {key.strip().lower(): value.strip()
+                   for (key, value) in row.items()}
+            node_ids.append(row['id'])
+            attributes[row['id']] = row
+    return node_ids, attributes
+
+
+def _adjacency_format(path):
+    # the parser is picked by the extension of the adjacency file
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        return 'json'
+    if extension == '.csv':
+        return 'csv'
+    return 'edge list'
+
+
+def _cache_key(path, nodes_path):
+    # the same bytes read as another format or with another nodes file are
+    # another map, so both are part of the key
+    h = hashlib.sha256(('adjacency-%d' % CACHE_VERSION).encode())
+    h.update(('\0format=%s\0nodes=%s\0' % (
+        _adjacency_format(path),
+        'none' if nodes_path is None else os.path.abspath(nodes_path))).encode())
+    for file_path in [path, nodes_path]:
+        h.update(b'\0')
+        if file_path is not None:
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def parse_adjacency(path, nodes_path=None):
+    '''
+    parse_adjacency, read a map file without using the cache.
+
+    Arguments:
+    ----------
+    path: str instance
+        The adjacency file (.json, .csv or an edge list).
+    nodes_path: str instance
+        An optional CSV file with the columns id, population and district.
+
+    RETURNS:
+    ----------
+    data: AdjacencyData instance
+        graph: CSRGraph of the map, vertex i is the precinct node_ids[i].
+        precinct_populations: the population of each precinct, 1 if none
+            were given.
+        districting: the district of each vertex numbered 0,...,k-1 (in
+            sorted order of the given district names), or None.
+        node_ids: numpy array of str, the precinct names.
+    '''
+    adjacency_format = _adjacency_format(path)
+    if adjacency_format == 'json':
+        node_ids, edges, attributes = _read_json(path)
+    elif adjacency_format == 'csv':
+        node_ids, edges, attributes = _read_csv_edges(path)
+    else:
+        node_ids, edges, attributes = _read_text_edges(path)
+    if nodes_path is not None:
+        more_ids, more_attributes = _read_nodes_csv(nodes_path)
+        node_ids = node_ids + more_ids
+        attributes.update(more_attributes)
+
+    # number the precincts in the order they first appear
+    position = {}
+    for v in node_ids:
+        position.setdefault(v, len(position))
+    for (a, b) in edges:
+        position.setdefault(a, len(position))
+        position.setdefault(b, len(position))
+    ids = sorted(position, key=position.get)
+    graph = create_csr_graph_from_edges(
+        len(ids), [(position[a], position[b]) for (a, b) in edges])
+
+    populations = np.ones(len(ids))
+    names = [None] * len(ids)
+    for (v, node) in attributes.items():
+        if node.get('population') not in (None, ''):
+            populations[position[v]] = float(node['population'])
+        if node.get('district') not in (None, ''):
+            names[position[v]] = str(node['district'])
+    if np.all(populations == np.round(populations)):
+        populations = populations.astype(np.int64)
+    districting = None
+    if any(name is not None for name in names):
+        if any(name is None for name in names):
+            raise ValueError('some precincts have no district')
+        labels = sorted(set(names))
+        number = {name: d for (d, name) in enumerate(labels)}
+        districting = np.array([number[name] for name in names],
+                               dtype=np.int32)
+    return AdjacencyData(graph=graph, precinct_populations=populations,
+                         districting=districting, node_ids=np.array(ids))
+
+
+def load_adjacency(path, nodes_path=None, cache_dir=None):
+    '''
+    load_adjacency, read a map file, or its cached arrays if the same files
+    were read before.
+
+    Arguments:
+    ----------
+    path: str instance
+        The adjacency file (.json, .csv or an edge list).
+    nodes_path: str instance
+        An optional CSV file with the columns id, population and district.
+    cache_dir: str instance
+        Where the .npz files are kept, by default a folder .adjacency_cache
+        next to the adjacency file. Use False to skip the cache.
+
+    RETURNS:
+    ----------
+    data: AdjacencyData instance
+        See parse_adjacency.
+    '''
+    if cache_dir is False:
+        return parse_adjacency(path, nodes_path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                 '.adjacency_cache')
+    cache_path = os.path.join(cache_dir,
+                              _cache_key(path, nodes_path) + '.npz')
+    if os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as arrays:
+            graph = CSRGraph(indptr=arrays['indptr'], indices=arrays['indices'],
+                             edge_ids=arrays['edge_ids'], edges=arrays['edges'])
+            districting = None
+            if arrays['has_districting']:
+                districting = arrays['districting']
+            return AdjacencyData(
+                graph=graph,
+                precinct_populations=arrays['precinct_populations'],
+                districting=districting,
+                node_ids=arrays['node_ids'])
+
+    data = parse_adjacency(path, nodes_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    districting = data.districting
+    if districting is None:
+        districting = np.zeros(0, dtype=np.int32)
+    # write to a temporary name first so an interrupted run leaves no
+    # half-written cache file behind
+    temporary = cache_path + '.%d.tmp.npz' % os.getpid()
+    np.savez(temporary, indptr=data.graph.indptr, indices=data.graph.indices,
+             edge_ids=data.graph.edge_ids, edges=data.graph.edges,
+             precinct_populations=data.precinct_populations,
+             districting=districting,
+             has_districting=np.array(data.districting is not None),
+             node_ids=data.node_ids)
+    os.replace(temporary, cache_path)
+    return data
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the flip-walk on n by n grids.
+
+Both walks of the chain scripts are timed ('swap' is the exact-size swap of
+graves-original-altered.py, 'flip' is the 9-11 style flip of
+no_diagonals_redistricting_10_by_10_columns.py) on grids of several sizes with
+fixed seeds. For every run we report the proposals per second, the accepted
+plans per second, the acceptance rate and the peak resident memory. Each run
+happens in a fresh process so the peak memory of one run does not leak into
+the next. The results are printed and written as JSON, so runs before and
+after a change to the hot loop can be compared.
+
+Usage:
+    python benchmark_flip_walk.py --sizes 10 20 50 100 --proposals 20000
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+from chain_runner import VARIANTS, load_chain_script, run_chain
+
+
+def benchmark_walk(variant, n, num_proposals, seed):
+    '''
+    benchmark_walk, run one chain and measure it. Meant to run in its own
+    process, see run_benchmarks.
+
+    The starting plan is create_initial_districting(n) of the variant's script
+    when it exists for n (the swap script only has a 10 by 10 plan), the
+    columns of the grid otherwise. The votes are create_party_assignment_n_10
+    for n=10 and a random 40% Yellow assignment drawn from seed otherwise.
+
+    Arguments:
+    ----------
+    variant: str instance
+        'swap' or 'flip'.
+    n: int instance
+        the dimensions of the n by n grid, also the number of districts.
+    num_proposals: int instance
+        The number of proposal steps.
+    seed: int instance
+        The seed of the chain.
+
+    RETURNS:
+    ----------
+    result: dict instance
+        The settings of the run and its measurements.
+    '''
+    script = load_chain_script(variant)
+    if n == 10:
+        districting = script.create_initial_districting(n)
+        party_assignment = script.create_party_assignment_n_10(n)
+    else:
+        districting = load_chain_script('flip').create_initial_districting(n)
+        rng = np.random.default_rng(seed)
+        party_assignment = (rng.random(n**2) < 0.4).astype(int)
+    start = time.perf_counter()
+    chain = run_chain(variant, n, num_proposals, seed, districting,
+                      party_assignment)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak / 1024.0
+    return {'variant': variant,
+            'n': n,
+            'num_vertices': n**2,
+            'seed': seed,
+            'num_proposals': num_proposals,
+            'num_accepted': chain['num_accepted'],
+            'seconds': seconds,
+            'proposals_per_second': num_proposals / seconds,
+            'accepted_per_second': chain['num_accepted'] / seconds,
+            'acceptance_rate': chain['num_accepted'] / num_proposals,
+            'peak_rss_mb': peak / 1024.0}
+
+
+def _benchmark_walk_from_args(args):
+    return benchmark_walk(*args)
+
+
+def run_benchmarks(sizes=(10, 20, 50, 100), variants=('swap', 'flip'),
+                   num_proposals=20000, seed=0):
+    '''
+    run_benchmarks, benchmark every variant on every grid size, each run in
+    a fresh process.
+
+    Arguments:
+    ----------
+    sizes: list of ints instance
+        The grid sizes n.
+    variants: list of str instance
+        The walks to time.
+    num_proposals: int instance
+        The number of proposal steps of each run.
+    seed: int instance
+        The seed of every run.
+
+    RETURNS:
+    ----------
+    results: list of dicts instance
+        The results of benchmark_walk, one per run.
+    '''
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for n in sizes:
+        for variant in variants:
+            pool = context.Pool(1)
+            try:
+                result = pool.apply(_benchmark_walk_from_args,
+                                    ((variant, n, num_proposals, seed),))
+            finally:
+                pool.close()
+                pool.join()
+            print('%-5s n=%-4d %10.0f proposals/s %10.0f accepted/s '
+                  'acceptance %.3f  peak RSS %7.1f MB'
+                  % (variant, n, result['proposals_per_second'],
+                     result['accepted_per_second'], result['acceptance_rate'],
+                     result['peak_rss_mb']))
+            results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 20, 50, 100])
+    parser.add_argument('--variants', nargs='+', default=sorted(VARIANTS),
+                        choices=sorted(VARIANTS))
+    parser.add_argument('--proposals', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_flip_walk.json')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.variants, args.proposals,
+                             args.seed)
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'machine': platform.machine(),
+                   'results': results}, f, indent=2)
+    print('Results written to', args.output)
@@ -10,7 +10,22 @@ import math
 import numpy as np
 import copy
 import random
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
 import matplotlib.pyplot as plt # only used for the histogram at the end
+from partitions import vertex_order, encode_partition, decode_partition
+from frontier_search import iter_connected_partitions
+from rrg_store import write_rrg_store, partition_table
+from grid_symmetry import grid_symmetries, quotient_rrg
+from result_cache import ResultCache
+from rrg_analytics import (adjacency_matrix, rrg_summary, print_rrg_summary,
+                           stationary_distribution)
+from seat_tally import exact_seat_distribution
 #from copy import deepcopy
 
 def create_base_graph_n_by_n(n):
@@ -53,12 +68,23 @@ def create_base_graph_n_by_n(n):
             G.add_edge(i,east)
     return G
 
-def create_all_subgraphs_from_graph(G,k):
+def create_all_subgraphs_from_graph(G,k,populations=None,min_size=None,
+                                    max_size=None):
     '''
     create_all_subgraphs_from_graph, build all of the subgraphs that are formed
     by partitioning the vertex set of G into k parts where the induced subgraph 
-    of each part is a connected graph. This part of the program is extremely
-    computationally intensive. 
+    of each part is a connected graph. The number of such partitions grows
+    very quickly with the size of G.
+
+    The partitions are listed by the frontier-based search of
+    frontier_search.py, which takes time proportional to the number of
+    partitions instead of the number of subsets of edges. To only count them
+    use frontier_search.count_connected_partitions.
+
+    With min_size or max_size only the balanced partitions are listed, the
+    ones where every part has a population between min_size and max_size.
+    The search drops a partial partition as soon as it can no longer be
+    balanced, so this is much faster than filtering afterwards.
 
     Arguments:
     ----------
@@ -66,55 +92,28 @@ def create_all_subgraphs_from_graph(G,k):
         This is the base graph we are going to partition into k parts.
     k: int instance
         This is the number of parts in the partition of G.
+    populations: dict or list instance
+        The population of every vertex, see frontier_search.population_array.
+        By default every vertex counts 1, so the bounds are part sizes.
+    min_size: number instance
+        The smallest population of a part, no bound by default.
+    max_size: number instance
+        The largest population of a part, no bound by default.
 
     RETURNS:
     ----------
-    induced_subgraphs_of_G: list of lists of tuples instance
-        Each list in induced_subgraphs_of_G contains tuples that represent the 
-        edges of an admissible subgraph of G which is a disconnected subgraph 
-        of G with k components.
+    induced_subgraphs_of_G: list of bytes instance
+        Each entry is an admissible subgraph of G, i.e. a partition of the
+        vertices of G into k parts that induce connected subgraphs, encoded
+        by partitions.encode_partition over the vertices in
+        partitions.vertex_order(G). Use partitions.partition_parts or
+        partitions.partition_edges to get the parts or the edges back.
     '''
-    temp_vertex_set = []
-    induced_subgraphs_of_G = []    
-    #create set of vertices we still have to add to rrg_graph
-    vert_left = [item for item in nx.nodes(G)] 
-    
     if not nx.is_connected(G):
         return print('Graph is not connected')
 
-    temp_induced_sub_G1 = []
-    temp_induced_sub_G2 = [[]]
-    #While we have not gone through all of the vertices, continue building subgraphs.
-    while len(vert_left)>0:
-        temp_vert = vert_left[0]
-        '''
-        This while loop will perform the following task. For each incident 
-        edge, take all of the subgraphs created so far and add the incident 
-        edge to each subgraph as long as the number of connected components 
-        is not less than k after adding the edge.
-        '''
-#        temp_induced_sub_G2 = [subg + [incident_edge] for incident_edge in G.subgraph(temp_vertex_set + [temp_vert]).edges(temp_vert) for subg in induced_subgraphs_of_G if nx.number_connected_components(nx.Graph(subg+incident_edge))<k+1]
-        for incident_edge in G.subgraph(temp_vertex_set + [temp_vert]).edges(temp_vert):
-            temp_induced_sub_G1 = temp_induced_sub_G2.copy()
-            for subg in temp_induced_sub_G1:
-                isolates_g1 = [val for val in G.nodes() if val not in (nx.Graph(subg + [incident_edge])).nodes()]
-                temp_graph = nx.Graph(subg+[incident_edge])
-                temp_graph.add_nodes_from(isolates_g1)
-                # If the number of components is large enough still, 
-                # continue to check if the number of components is exactly k.
-                if nx.number_connected_components(temp_graph)> k-1:
-                    temp_induced_sub_G2.append(subg + [incident_edge])
-                    # If the number of components is actually k,
-                    # add this subgraph to our list of subgraphs
-                    if nx.number_connected_components(temp_graph)==k:
-                        tmp_comps1 = list(nx.connected_components(temp_graph))
-                        temp_set1 = [list((G.subgraph(list(tmp_comps1[num_comp]))).edges()) for num_comp in range(len(tmp_comps1)) if len(list((G.subgraph(list(tmp_comps1[num_comp]))).edges()))!= 0 ]
-                        our_edge_set1 = [item for sublist in temp_set1 for item in sublist]
-                        induced_subgraphs_of_G.append(our_edge_set1)
-            if len(temp_induced_sub_G2)==0:
-                temp_induced_sub_G2.append([incident_edge])
-        vert_left.remove(temp_vert)
-        temp_vertex_set.append(temp_vert)
+    induced_subgraphs_of_G = sorted(iter_connected_partitions(
+        G, k, populations, min_size, max_size))
     return induced_subgraphs_of_G
    
 def create_rrg_from_graph(induced_subgraphs_of_G,G,k):
@@ -124,10 +123,11 @@ def create_rrg_from_graph(induced_subgraphs_of_G,G,k):
 
     Arguments:
     ----------
-    induced_subgraphs_of_G: list of lists of tuples instance
+    induced_subgraphs_of_G: list of bytes instance
         This is the list of all the subgraphs of G with k components such that
-        each component is an induced subgraph of G. The subgraph is given
-        by listing all of the edges in the graph. 
+        each component is an induced subgraph of G. Each subgraph is given
+        by its partition of the vertices, as made by
+        create_all_subgraphs_from_graph.
     G: networkx graph instance
         This is the base graph we are going to partition into k parts.
     k: int instance
@@ -137,100 +137,294 @@ def create_rrg_from_graph(induced_subgraphs_of_G,G,k):
     ----------
     rrg_edge_set: list of tuples
         Each tuple represents an edge in the graph. 
+
+    Two partitions are joined when one is made from the other by moving a
+    single vertex to another part. Instead of comparing every pair of
+    partitions, every such move of every partition is made and looked up in
+    a dictionary of the encodings, so the work is proportional to the number
+    of partitions times the number of edges of G between parts. If the
+    partitions are the balanced ones, the moves that break the balance are
+    not in the dictionary, so the RRG is the one of the balanced partitions.
     '''
+    nodes = vertex_order(G)
+    neighbors = _graph_neighbors(G, nodes)
+    # Look up the partitions by their encodings instead of comparing every
+    # pair of them.
+    index = {partition: vi for (vi, partition)
+             in enumerate(induced_subgraphs_of_G)}
     rrg_edge_set = []
-    vi = 0
-    for one_induced_subg_edges in induced_subgraphs_of_G:
-        #Make graph representing one of the vertices in RRG
-        G1=nx.Graph(one_induced_subg_edges)
-        #Make set of all isolated vertices
-        isolates_g1 = [set([val]) for val in G.nodes() if val not in G1.nodes()]
-        if len(isolates_g1)>0:
-            #make component list if there are isolated vertices
-            comp_all_g1 = list(nx.connected_components(G1)) + isolates_g1
-        else:
-            comp_all_g1 = list(nx.connected_components(G1))
-         
-        vj = 0
-        # Build the edge set of G
-        for one_induced_subg_edges2 in induced_subgraphs_of_G:
-            #check the two connected_components against each other to see if they differ by 1.
-            if one_induced_subg_edges2 != one_induced_subg_edges:
-                G2 = nx.Graph(one_induced_subg_edges2)
-                isolates_g2 = [set([val]) for val in G.nodes() if val not in G2.nodes()]
-                if len(isolates_g1)>0:
-                    #make component list if there are isolated vertices
-                    comp_all_g2 = list(nx.connected_components(G2)) + isolates_g2
-                else:
-                    comp_all_g2 = list(nx.connected_components(G2))
-                xor_g1_g2 = xor_lofl(comp_all_g1,comp_all_g2)
-                g1_comp = intersect_lofl(comp_all_g1,xor_g1_g2)
-                g2_comp = intersect_lofl(comp_all_g2,xor_g1_g2)
-                if (len(xor_g1_g2)==4) and (len(g1_comp)==2 and len(g2_comp)==2):
-                    # Check if the two components differ in exactly one vertex.
-                    if (len(set(g1_comp[0])^set(g2_comp[0]))==1) and len(set(g1_comp[1])^set(g2_comp[1]))==1:
-                        # test if the difference between the two components is the same number
-                        # and whether there is an edge there.
-                        neighbors_of_x = set(G.neighbors(list(set(g1_comp[0])^set(g2_comp[0]))[0]))
-                        if (set(g1_comp[0])^set(g2_comp[0])) == (set(g1_comp[1])^set(g2_comp[1])) and (len(neighbors_of_x & set(g1_comp[0]))>0) and (len(neighbors_of_x & set(g1_comp[1]))>0):
-                            #put an edge in edge set of rrg
-                            rrg_edge_set.append((vi,vj))
-                    elif (len(set(g1_comp[0])^set(g2_comp[1]))==1) and len(set(g1_comp[1])^set(g2_comp[0]))==1:
-                        # test if the difference between the two components is the same number
-                        # and whether there is an edge there.
-                        neighbors_of_x = set(G.neighbors(list(set(g1_comp[0])^set(g2_comp[1]))[0]))
-                        if (set(g1_comp[0])^set(g2_comp[1])) == (set(g1_comp[1])^set(g2_comp[0])) and (len(neighbors_of_x & set(g1_comp[0]))>0) and (len(neighbors_of_x & set(g1_comp[1]))>0):
-                            #put an edge in edge set of rrg
-                            rrg_edge_set.append((vi,vj))
-#                            print(comp_all_g1)
-#                            print(comp_all_g2)
-#                            print('')
-            vj += 1
-        vi += 1        
+    for (vi, partition) in enumerate(induced_subgraphs_of_G):
+        adjacent = _rrg_neighbors(partition, index, neighbors)
+        rrg_edge_set.extend((vi, vj) for vj in adjacent)
     return rrg_edge_set
 
+def _graph_neighbors(G, nodes):
+    position = {v: i for (i, v) in enumerate(nodes)}
+    return [[position[u] for u in G.neighbors(v)] for v in nodes]
+
+def _rrg_neighbors(partition, index, neighbors):
+    num_vertices = len(neighbors)
+    labels = decode_partition(partition, num_vertices)
+    # The moves are a vertex x going to the part of one of its neighbors.
+    # Only the moves that keep k connected parts give a partition in the
+    # index, and those are exactly the neighbors of partition in the RRG.
+    moves = set((x, labels[y]) for x in range(num_vertices)
+                for y in neighbors[x] if labels[y] != labels[x])
+    adjacent = set()
+    for (x, part) in moves:
+        moved = labels.copy()
+        moved[x] = part
+        vj = index.get(encode_partition(moved))
+        if vj is not None:
+            adjacent.add(vj)
+    return sorted(adjacent)
+
+# The partitions and their index, set once in every worker process by
+# _init_rrg_worker so they are not sent again with every shard.
+_rrg_worker = {}
+
+def _init_rrg_worker(induced_subgraphs_of_G, neighbors):
+    _rrg_worker['partitions'] = induced_subgraphs_of_G
+    _rrg_worker['neighbors'] = neighbors
+    _rrg_worker['index'] = {partition: vi for (vi, partition)
+                            in enumerate(induced_subgraphs_of_G)}
+
+def _build_rrg_shard(args):
+    (shard, start, stop, shard_path) = args
+    partitions = _rrg_worker['partitions']
+    edges = []
+    for vi in range(start, stop):
+        adjacent = _rrg_neighbors(partitions[vi], _rrg_worker['index'],
+                                  _rrg_worker['neighbors'])
+        # every edge is found from both ends, keep it only from the smaller
+        edges.extend((vi, vj) for vj in adjacent if vj > vi)
+    edges = np.array(edges, dtype=np.int32).reshape(-1, 2)
+    # write to a temporary name first so an interrupted run never leaves a
+    # half-written shard that looks finished
+    temporary = shard_path + '.%d.tmp.npy' % os.getpid()
+    np.save(temporary, edges)
+    os.replace(temporary, shard_path)
+    return (shard, stop - start, len(edges))
+
+def _rrg_digest(induced_subgraphs_of_G, neighbors, shard_size):
+    h = hashlib.sha256(('rrg-shards-%d' % shard_size).encode())
+    for nbrs in neighbors:
+        h.update(np.array(nbrs, dtype=np.int64).tobytes() + b';')
+    for partition in induced_subgraphs_of_G:
+        h.update(partition)
+    return h.hexdigest()
+
+def create_rrg_from_graph_parallel(induced_subgraphs_of_G,G,k,processes=None,
+                                   shard_size=10000,shard_dir=None,
+                                   progress=True):
+    '''
+    create_rrg_from_graph_parallel, build the reconfiguration redistricting
+    graph like create_rrg_from_graph, with the partitions split into shards
+    that are handled by a pool of worker processes.
+
+    Every shard is saved to shard_dir as soon as it is done. If the run is
+    interrupted, calling this again with the same partitions and the same
+    shard_dir only builds the shards that are missing.
+
+    Arguments:
+    ----------
+    induced_subgraphs_of_G: list of bytes instance
+        The partitions made by create_all_subgraphs_from_graph.
+    G: networkx graph instance
+        This is the base graph we are going to partition into k parts.
+    k: int instance
+        This is the number of parts in the partition of G.
+    processes: int instance
+        The number of worker processes, by default the number of CPUs. With
+        processes=1 the shards are built in this process.
+    shard_size: int instance
+        The number of partitions in a shard.
+    shard_dir: str instance
+        The folder for the shards. By default a temporary folder is used and
+        removed at the end, so the run can not be resumed.
+    progress: bool instance
+        Print a line after every shard.
+
+    RETURNS:
+    ----------
+    rrg_edges: numpy array instance
+        The edges (vi, vj) of the RRG with vi < vj, one row per edge, sorted.
+        vi and vj are positions in induced_subgraphs_of_G.
+    '''
+    nodes = vertex_order(G)
+    neighbors = _graph_neighbors(G, nodes)
+    num_partitions = len(induced_subgraphs_of_G)
+    remove_shard_dir = shard_dir is None
+    if shard_dir is None:
+        shard_dir = tempfile.mkdtemp(prefix='rrg_shards_')
+    elif not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+
+    # the shards of a different graph or partition list must not be mixed in
+    meta = {'digest': _rrg_digest(induced_subgraphs_of_G, neighbors,
+                                  shard_size),
+            'num_partitions': num_partitions,
+            'shard_size': shard_size}
+    meta_path = os.path.join(shard_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) != meta:
+                raise ValueError('%s holds the shards of another RRG'
+                                 % shard_dir)
+    else:
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    shards = []
+    for (shard, start) in enumerate(range(0, num_partitions, shard_size)):
+        stop = min(start + shard_size, num_partitions)
+        shards.append((shard, start, stop,
+                       os.path.join(shard_dir, 'shard_%05d.npy' % shard)))
+    todo = [args for args in shards if not os.path.exists(args[3])]
+    done = num_partitions - sum(stop - start for (_, start, stop, _) in todo)
+    if progress and len(todo) < len(shards):
+        print('Resuming: %d of %d shards already built'
+              % (len(shards) - len(todo), len(shards)))
+
+    start_time = time.time()
+    if processes == 1:
+        _init_rrg_worker(induced_subgraphs_of_G, neighbors)
+        results = map(_build_rrg_shard, todo)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _init_rrg_worker,
+                                    (induced_subgraphs_of_G, neighbors))
+        results = pool.imap_unordered(_build_rrg_shard, todo)
+    try:
+        for (shard, size, num_edges) in results:
+            done += size
+            if progress:
+                print('shard %d of %d: %d edges, %d of %d partitions done '
+                      '(%.1f s)' % (shard + 1, len(shards), num_edges, done,
+                                    num_partitions, time.time() - start_time))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # merge the shards, dropping any edge that was written twice
+    rrg_edges = [np.load(args[3]) for args in shards]
+    if len(rrg_edges) == 0:
+        rrg_edges = np.zeros((0, 2), dtype=np.int32)
+    else:
+        rrg_edges = np.unique(np.concatenate(rrg_edges), axis=0)
+    if remove_shard_dir:
+        shutil.rmtree(shard_dir)
+    return rrg_edges
+
 # In[]:
     
-#if __name__ == '__main__':
-n=2 # length/width of grid
-k = 2 #number of components in the graph.
-G=create_base_graph_n_by_n(n)
-#G = nx.complete_graph(5)
-
-# Define the intersection between to lists.
-def intersect(a, b):
-    return list(set(a) & set(b))
-
-#define the intersection between two lists of lists.
-def intersect_lofl(a,b):
-    temp_lst1 = set(tuple(x) for x in a)
-    temp_lst2 = set(tuple(x) for x in b)
-    temp_inter = temp_lst1 & temp_lst2
-    return [list(x) for x in temp_inter]
-
-# Define the xor between two lists of lists. 
-def xor_lofl(a,b):
-    temp_lst1 = set(tuple(x) for x in a)
-    temp_lst2 = set(tuple(x) for x in b)
-    temp_xor = temp_lst1 ^ temp_lst2
-    return [list(x) for x in temp_xor]
-
-# Create the list of all subgraphs of G of the required type.
-indu_sub = create_all_subgraphs_from_graph(G,k)
-
-# Build the reconfiguration redistricting graph from the the list of all 
-# subgraphs of G of the required type.
-G1 = nx.Graph(create_rrg_from_graph(indu_sub,G,k))
-print('Number of vertices:',len(G1.nodes()))
-print('Number of edges:',len(G1.edges()))
+if __name__ == '__main__':
+    n=2 # length/width of grid
+    k = 2 #number of components in the graph.
+    # Which build runs: quotient wins over store_path, which wins
+    # over use_cache; with none of them the RRG is built in memory.
+    # parallel, processes and shard_dir apply to all builds but the quotient.
+    quotient = False # only enumerate and store one subgraph per symmetry class of the grid
+    store_path = None # or a folder to write the RRG to with rrg_store.py
+    use_cache = True # reuse the RRGs of earlier runs, see result_cache.py
+    parallel = False # build the RRG edges with a pool of worker processes
+    processes = None # the number of worker processes, by default the number of CPUs
+    shard_dir = None # or a folder for the shards of a parallel build, so it can be resumed
+    min_size = None # smallest number of vertices in a part, e.g. n-1
+    max_size = None # largest number of vertices in a part, e.g. n+1
+    max_draw = 500 # only draw RRGs with at most this many vertices
+    analyze = True # print degrees, diameter and spectral gap, see rrg_analytics.py
+    party_assignment = None # Yellow votes per vertex, e.g. np.arange(n*n)%2, for the exact seat distribution
+    G=create_base_graph_n_by_n(n)
+    #G = nx.complete_graph(5)
 
+    rrg_edges = None # the edges of the full RRG, when it is built
+    rrg_plans = None # and the labels of its vertices
+    if quotient:
+        # The RRG up to the 8 symmetries of the grid, see grid_symmetry.py.
+        # Its edges are ordered pairs of representatives and can be loops.
+        # The search lists one subgraph per symmetry class and skips the
+        # branches that only lead to the other members of a class.
+        symmetries = grid_symmetries(n)
+        rrg_quotient = quotient_rrg(G,k,symmetries,
+            partitions=iter_connected_partitions(G,k,None,min_size,max_size,
+                                                 symmetries=symmetries))
+        print('Number of vertices:',rrg_quotient.orbit_sizes.sum())
+        print('Number of symmetry classes:',len(rrg_quotient.representatives))
+        G1 = nx.Graph()
+        G1.add_nodes_from(range(len(rrg_quotient.representatives)))
+        G1.add_edges_from(rrg_quotient.edges.tolist())
+        print('Number of edges of the quotient:',len(G1.edges()))
+    elif store_path is not None:
+        # Stream the subgraphs and the edges of the RRG to disk, see
+        # rrg_store.py, instead of keeping them as lists.
+        store = write_rrg_store(store_path,G,k,progress=True,
+                                min_size=min_size,max_size=max_size,
+                                parallel=parallel,processes=processes,
+                                shard_dir=shard_dir)
+        print('Number of vertices:',len(store))
+        print('Number of edges:',store.num_edges)
+        (rrg_edges,num_rrg_vertices) = (store.edges,len(store))
+        rrg_plans = store.partitions
+        G1 = store.to_networkx() if len(store) <= max_draw else None
+    elif use_cache:
+        # The RRG is only built the first time (in parallel if parallel is
+        # set), later runs with the same G and k open the cached store.
+        store = ResultCache().rrg(G,k,progress=True,
+                                 min_size=min_size,max_size=max_size,
+                                 parallel=parallel,processes=processes,
+                                 shard_dir=shard_dir)
+        print('Number of vertices:',len(store))
+        print('Number of edges:',store.num_edges)
+        (rrg_edges,num_rrg_vertices) = (store.edges,len(store))
+        rrg_plans = store.partitions
+        G1 = store.to_networkx() if len(store) <= max_draw else None
+    else:
+        # Create the list of all subgraphs of G of the required type.
+        indu_sub = create_all_subgraphs_from_graph(G,k,None,min_size,max_size)
 
-# In[]:
+        # Build the reconfiguration redistricting graph from the the list of 
+        # all subgraphs of G of the required type.
+        if parallel:
+            rrg_edges = create_rrg_from_graph_parallel(indu_sub,G,k,processes,
+                                                       shard_dir=shard_dir)
+            G1 = nx.Graph()
+            G1.add_edges_from(rrg_edges.tolist())
+        else:
+            rrg_edges = create_rrg_from_graph(indu_sub,G,k)
+            G1 = nx.Graph(rrg_edges)
+        num_rrg_vertices = len(indu_sub)
+        rrg_plans = partition_table(indu_sub,len(G))
+        print('Number of vertices:',len(G1.nodes()))
+        print('Number of edges:',len(G1.edges()))
+
+
+    # In[]:
+
+    # Display some parameters of the RRG, computed on a sparse matrix so it
+    # also works for RRGs that are far too large for networkx.
+    if rrg_edges is not None:
+        A = adjacency_matrix(rrg_edges,num_rrg_vertices)
+        if analyze:
+            print_rrg_summary(rrg_summary(A))
+
+        # The exact distribution of the Yellow seats over all the subgraphs,
+        # to check the histograms of the chain scripts against.
+        if party_assignment is not None:
+            for (name,weights) in [('uniform',None),
+                                   ('flip-walk',stationary_distribution(A))]:
+                seat_distribution = exact_seat_distribution(
+                    rrg_plans,party_assignment,k,weights,ties='half')
+                print('Yellow seats, %s weights:' % name)
+                for s in np.flatnonzero(seat_distribution):
+                    print('  %4.1f: %.6f' % (s/2,seat_distribution[s]))
 
-#Display the graph.
-nx.draw(G1,pos=nx.spring_layout(G1,dim=2,iterations=100),
-        with_labels=True,node_size=10)
-plt.show()
+    #Display the graph. The spring layout is only usable for small graphs.
+    if G1 is not None and len(G1) <= max_draw:
+        nx.draw(G1,pos=nx.spring_layout(G1,dim=2,iterations=100),
+                with_labels=True,node_size=10)
+        plt.show()
 # In[]:
 
 ## Display some parameters of the RRG.
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Run many independent flip-walk chains at once and merge their results.
+
+Every chain runs in its own process with its own random number generator, so
+an ensemble of N chains uses N cores instead of one. The seeds of the chains
+are spawned from one master seed with numpy.random.SeedSequence, so a run is
+reproducible and the streams of the chains do not overlap.
+
+The two walks of the chain scripts are available as variants:
+    'swap': graves-original-altered.py, grid with diagonals, two vertices trade
+            districts and every district keeps exactly n vertices.
+    'flip': no_diagonals_redistricting_10_by_10_columns.py, grid without
+            diagonals, one vertex changes district and every district keeps
+            n-1, n or n+1 vertices.
+The starting plan and the votes are taken from create_initial_districting and
+create_party_assignment_n_10 of the corresponding script.
+
+With adjacency_path the chains walk on a precinct map read by
+adjacency_loader.load_adjacency instead of the grid. The starting plan is then
+the plan of the map unless one is given, the votes must be given, and the
+district sizes may move from the smallest and largest district of the
+starting plan by the size slack of the variant.
+"""
+
+import importlib.util
+import multiprocessing
+import os
+import random
+
+import numpy as np
+
+from adjacency_loader import load_adjacency
+from csr_graph import create_csr_graph_n_by_n
+from flip_walk import ChainState
+from streaming_stats import WalkSummary
+
+VARIANTS = {
+    'swap': {'script': 'graves-original-altered.py',
+             'diagonals': True,
+             'swap': True,
+             'size_slack': 0},
+    'flip': {'script': 'no_diagonals_redistricting_10_by_10_columns.py',
+             'diagonals': False,
+             'swap': False,
+             'size_slack': 1},
+}
+
+_scripts = {}
+
+
+def load_chain_script(variant):
+    '''
+    load_chain_script, import the chain script behind a variant. The script
+    names are not valid module names, so they are loaded from their path.
+    Only the functions are defined, the __main__ block does not run.
+
+    Arguments:
+    ----------
+    variant: str instance
+        'swap' or 'flip'.
+
+    RETURNS:
+    ----------
+    module: module instance
+        The chain script as a module.
+    '''
+    if variant not in _scripts:
+        script = VARIANTS[variant]['script']
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+        spec = importlib.util.spec_from_file_location(
+            os.path.splitext(script)[0].replace('-', '_'), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _scripts[variant] = module
+    return _scripts[variant]
+
+
+def run_chain(variant, n, num_proposals, seed, districting=None,
+              party_assignment=None, ties='green', adjacency_path=None,
+              nodes_path=None, total_votes=None):
+    '''
+    run_chain, run one flip-walk chain and count the Yellow seats of every
+    plan it visits (the starting plan and every accepted plan, as in the
+    chain scripts).
+
+    Arguments:
+    ----------
+    variant: str instance
+        'swap' or 'flip', see VARIANTS.
+    n: int instance
+        the dimensions of the n by n grid, also the number of districts. On
+        a map only the number of districts.
+    num_proposals: int instance
+        The number of proposal steps to try.
+    seed: int instance
+        The seed of the random number generator of this chain.
+    districting: numpy array instance
+        The starting plan. By default create_initial_districting(n) of the
+        variant's script, or the plan of the map.
+    party_assignment: numpy array instance
+        The vote of each vertex (1 for Yellow, 0 for Green), or the Yellow
+        votes of each precinct. By default create_party_assignment_n_10() of
+        the variant's script; required on a map.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green' (as in the chain
+        scripts) or 'half'.
+    adjacency_path: str instance
+        A map file for load_adjacency to walk on instead of the grid.
+    nodes_path: str instance
+        The nodes CSV file of the map, see load_adjacency.
+    total_votes: numpy array instance
+        The total votes of each vertex, passed to ChainState as its
+        populations; by default 1 per vertex. The precinct populations of
+        the map are not votes and are not used here.
+
+    RETURNS:
+    ----------
+    result: dict instance
+        'variant', 'seed', 'num_proposals', 'num_accepted',
+        'seat_histogram', where seat_histogram[s] is the number of visited
+        plans in which Yellow wins s/2 of the n districts (half seats are
+        only possible with ties='half'), and 'summary', the WalkSummary of
+        the visited plans.
+    '''
+    spec = VARIANTS[variant]
+    rng = random.Random(seed)
+    if adjacency_path is not None:
+        data = load_adjacency(adjacency_path, nodes_path)
+        graph = data.graph
+        if districting is None:
+            districting = data.districting
+        if districting is None or party_assignment is None:
+            raise ValueError('a chain on a map needs a starting plan and '
+                             'the votes of every precinct')
+        districting = np.array(districting)
+        sizes = np.bincount(districting, minlength=n)
+        min_size = int(sizes.min()) - spec['size_slack']
+        max_size = int(sizes.max()) + spec['size_slack']
+    else:
+        graph = create_csr_graph_n_by_n(n, diagonals=spec['diagonals'])
+        if districting is None:
+            districting = load_chain_script(variant).create_initial_districting(n)
+        if party_assignment is None:
+            party_assignment = load_chain_script(variant).create_party_assignment_n_10(n)
+        districting = np.array(districting)
+        min_size = n - spec['size_slack']
+        max_size = n + spec['size_slack']
+
+    state = ChainState(graph, districting, n, party_assignment,
+                       populations=total_votes, ties=ties)
+    summary = WalkSummary(n)
+    summary.update(state)
+    num_accepted = 0
+    for k in range(num_proposals):
+        moves = state.propose(spec['swap'], rng)
+        if state.is_valid(moves, min_size, max_size):
+            state.apply(moves)
+            num_accepted += 1
+            summary.update(state)
+    return {'variant': variant,
+            'seed': seed,
+            'num_proposals': num_proposals,
+            'num_accepted': num_accepted,
+            'seat_histogram': summary.seat_histogram,
+            'summary': summary}
+
+
+def _run_chain_from_args(args):
+    return run_chain(*args)
+
+
+def spawn_seeds(seed, num_chains):
+    '''
+    spawn_seeds, derive one independent seed per chain from a master seed.
+
+    Arguments:
+    ----------
+    seed: int instance or None
+        The master seed. None draws fresh entropy from the OS.
+    num_chains: int instance
+        The number of seeds to make.
+
+    RETURNS:
+    ----------
+    seeds: list of ints instance
+        The seed of each chain.
+    '''
+    children = np.random.SeedSequence(seed).spawn(num_chains)
+    return [int.from_bytes(child.generate_state(4).tobytes(), 'little')
+            for child in children]
+
+
+def run_chains(num_chains, num_proposals, n=10, variant='flip', seed=None,
+               processes=None, districtings=None, party_assignment=None,
+               ties='green', adjacency_path=None, nodes_path=None,
+               total_votes=None):
+    '''
+    run_chains, run num_chains independent chains in a process pool and
+    merge their seat histograms and acceptance counts.
+
+    Arguments:
+    ----------
+    num_chains: int instance
+        The number of chains.
+    num_proposals: int instance
+        The number of proposal steps each chain tries.
+    n: int instance
+        the dimensions of the n by n grid, also the number of districts. On
+        a map only the number of districts.
+    variant: str or list of str instance
+        'swap' or 'flip' for every chain, or one variant per chain. The
+        variant fixes the size bounds of the chain.
+    seed: int instance
+        The master seed, the seed of every chain is spawned from it.
+    processes: int instance
+        The number of worker processes, by default the number of cores.
+    districtings: list of numpy arrays instance
+        One starting plan per chain. By default every chain starts from
+        create_initial_districting(n) of its variant's script, or from the
+        plan of the map.
+    party_assignment: numpy array instance
+        The vote of each vertex, by default create_party_assignment_n_10().
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green' or 'half'.
+    adjacency_path, nodes_path, total_votes:
+        See run_chain.
+
+    RETURNS:
+    ----------
+    merged: dict instance
+        'seat_histogram' (summed over the chains), 'summary' (the merged
+        WalkSummary of the chains), 'num_proposals' and
+        'num_accepted' (totals), 'acceptance_rate', and 'chains', the list of
+        the results of run_chain for each chain.
+    '''
+    if isinstance(variant, str):
+        variant = [variant] * num_chains
+    if districtings is None:
+        districtings = [None] * num_chains
+    if adjacency_path is not None:
+        # parse the map once here, the workers then read the cached arrays
+        load_adjacency(adjacency_path, nodes_path)
+    seeds = spawn_seeds(seed, num_chains)
+    args = [(variant[i], n, num_proposals, seeds[i], districtings[i],
+             party_assignment, ties, adjacency_path, nodes_path, total_votes)
+            for i in range(num_chains)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        chains = pool.map(_run_chain_from_args, args)
+    finally:
+        pool.close()
+        pool.join()
+
+    summary = WalkSummary(n)
+    for chain in chains:
+        summary.merge(chain['summary'])
+    total_proposals = sum(chain['num_proposals'] for chain in chains)
+    total_accepted = sum(chain['num_accepted'] for chain in chains)
+    return {'seat_histogram': summary.seat_histogram,
+            'summary': summary,
+            'num_proposals': total_proposals,
+            'num_accepted': total_accepted,
+            'acceptance_rate': total_accepted / max(total_proposals, 1),
+            'chains': chains}
+
+
+if __name__ == '__main__':
+    merged = run_chains(num_chains=8, num_proposals=10000, n=10,
+                        variant='flip', seed=2018)
+    for chain in merged['chains']:
+        print(chain['seed'], chain['num_accepted'], chain['seat_histogram'])
+    print('Accepted', merged['num_accepted'], 'of', merged['num_proposals'],
+          'proposals')
+    print('Yellow seats:', merged['seat_histogram'][::2])
+    print('Yellow seats: mean', merged['summary'].seats.mean, 'variance',
+          merged['summary'].seats.variance)
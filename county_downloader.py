@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent download of the county results of a Clarity election site.
+
+elections_2016GA_final.py needs, for every county, the current version of the
+results (current_ver.txt) and then the zip file reports/detailxls.zip of that
+version. Here the counties are fetched by a bounded pool of threads:
+    every thread keeps one open (keep-alive) connection per host, so the
+    requests of a thread reuse the same connection,
+    the requests to one host, from all threads together, are spaced by a
+    rate limit, so the site is not flooded,
+    a request that fails with a connection error, a timeout, 429 or a 5xx
+    status is retried with exponential backoff,
+    a county that still fails is recorded as a DownloadError (county, url,
+    stage, error, attempts) instead of stopping the run, and the errors can
+    be written to a file as JSON lines.
+With a scrape_cache.ScrapeCache, a county whose version did not change is
+not downloaded again.
+The prefix of the site is an argument, so the downloader can be pointed at a
+local HTTP server that serves fixture files.
+"""
+
+import http.client
+import io
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+from zipfile import BadZipFile, ZipFile
+
+PREFIX = 'https://results.enr.clarityelections.com/GA/'
+
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+DownloadError = namedtuple('DownloadError', ['county', 'url', 'stage',
+                                             'error', 'attempts'])
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    '''
+    FetchError, a request that failed for good, with the url, the last
+    status (None for a connection error) and the number of attempts.
+    '''
+
+    def __init__(self, url, status, attempts, message):
+        Exception.__init__(self, '%s: %s' % (url, message))
+        self.url = url
+        self.message = message
+        self.status = status
+        self.attempts = attempts
+
+
+def county_url_name(county_name):
+    '''
+    county_url_name, the name of a county as it appears in the urls of the
+    site, with underscores for spaces, e.g. 'Jeff Davis' -> 'Jeff_Davis'.
+    '''
+    return '_'.join(county_name.split())
+
+
+class HostRateLimiter(object):
+    '''
+    HostRateLimiter, space the requests to each host by at least
+    1 / requests_per_second seconds, over all threads.
+
+    Arguments:
+    ----------
+    requests_per_second: float instance
+        The largest number of requests per second to one host. None for no
+        limit.
+    '''
+
+    def __init__(self, requests_per_second=None):
+        self.interval = 0.0 if not requests_per_second else 1.0 / requests_per_second
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        '''
+        wait, sleep until the next request to host may start.
+        '''
+        if self.interval == 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class HTTPClient(object):
+    '''
+    HTTPClient, GET requests over keep-alive connections, one connection per
+    thread and host, with a rate limit per host and retries with
+    exponential backoff.
+
+    Arguments:
+    ----------
+    timeout: float instance
+        The timeout of a connection, in seconds.
+    requests_per_second: float instance
+        The rate limit per host, see HostRateLimiter.
+    retries: int instance
+        The number of retries of a failed request.
+    backoff: float instance
+        The wait before the first retry, in seconds; it doubles with every
+        retry and gets a random extra of up to 50%.
+    headers: dict instance
+        Headers sent with every request.
+    '''
+
+    def __init__(self, timeout=30, requests_per_second=5.0, retries=3,
+                 backoff=0.5, headers=None):
+        self.timeout = timeout
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+        self.headers = {'User-Agent': 'Mozilla/5.0', 'Connection': 'keep-alive'}
+        self.headers.update(headers or {})
+        self._local = threading.local()
+        # the connections of every thread, so those of finished worker
+        # threads can be closed, see close_threads
+        self._threads = {}
+        self._threads_lock = threading.Lock()
+
+    def _connection(self, scheme, host):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get((scheme, host))
+        if connection is None:
+            with self._threads_lock:
+                self._threads[threading.get_ident()] = connections
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(host, timeout=self.timeout)
+            connections[(scheme, host)] = connection
+        return connection
+
+    def _drop_connection(self, scheme, host):
+        connection = self._local.connections.pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def _request(self, url, headers):
+        # one GET without retries; follows redirects
+        for _ in range(5):
+            parts = urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            self.rate_limiter.wait(parts.netloc)
+            connection = self._connection(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                # a stale keep-alive connection or a network error
+                self._drop_connection(parts.scheme, parts.netloc)
+                raise
+            if response.will_close:
+                self._drop_connection(parts.scheme, parts.netloc)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            headers_of_response = dict((name.lower(), value) for (name, value)
+                                       in response.getheaders())
+            return Response(response.status, headers_of_response, body)
+        raise FetchError(url, response.status, 1, 'too many redirects')
+
+    def get(self, url, headers=None):
+        '''
+        get, fetch url.
+
+        Arguments:
+        ----------
+        url: str instance
+            The url, http or https.
+        headers: dict instance
+            Extra headers of this request, e.g. If-None-Match.
+
+        RETURNS:
+        ----------
+        response: Response instance
+            (status, headers, body) of a 2xx or 304 response. The names of
+            the headers are in lower case.
+
+        Raises FetchError when the request still fails after the retries,
+        or at once for a status that is not worth retrying, such as 404.
+        '''
+        all_headers = dict(self.headers)
+        all_headers.update(headers or {})
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2**attempt * (1 + 0.5 * random.random())
+            try:
+                response = self._request(url, all_headers)
+            except (OSError, http.client.HTTPException) as error:
+                if attempt == self.retries:
+                    raise FetchError(url, None, attempt + 1, repr(error))
+                time.sleep(wait)
+                continue
+            if response.status < 300 or response.status == 304:
+                return response
+            if response.status not in RETRY_STATUSES or attempt == self.retries:
+                raise FetchError(url, response.status, attempt + 1,
+                                 'HTTP status %d' % response.status)
+            retry_after = response.headers.get('retry-after', '')
+            if retry_after.isdigit():
+                wait = max(wait, int(retry_after))
+            time.sleep(wait)
+
+    def close(self):
+        '''
+        close, close the connections of the calling thread.
+        '''
+        self.close_threads([threading.get_ident()])
+
+    def close_threads(self, thread_ids):
+        '''
+        close_threads, close the connections of the given threads, e.g. of
+        the workers of a thread pool that has finished.
+
+        Arguments:
+        ----------
+        thread_ids: list of int instance
+            The threading.get_ident() of the threads.
+        '''
+        for thread_id in thread_ids:
+            with self._threads_lock:
+                connections = self._threads.pop(thread_id, {})
+            for connection in list(connections.values()):
+                connection.close()
+            connections.clear()
+
+
+class CountyDownloader(object):
+    '''
+    CountyDownloader, download and unpack the detail results of many
+    counties at once, see the module docstring.
+
+    Arguments:
+    ----------
+    out_dir: str instance
+        The folder the results are written to.
+    prefix: str instance
+        The url of the state on the site, ending with '/'.
+    filename_pattern: str instance
+        The name of the file of a county in out_dir, with %s for the county.
+    max_workers: int instance
+        The number of counties downloaded at the same time.
+    client: HTTPClient instance
+        The client to use, by default HTTPClient(**client_options).
+    cache: scrape_cache.ScrapeCache instance
+        A cache of the versions and zip files, so that a county whose
+        version did not change is not downloaded again. None for no cache.
+    client_options: keyword arguments
+        Passed on to HTTPClient, e.g. requests_per_second or retries.
+    '''
+
+    def __init__(self, out_dir, prefix=PREFIX,
+                 filename_pattern='%s_precinct_data.xls', max_workers=8,
+                 client=None, cache=None, **client_options):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.filename_pattern = filename_pattern
+        self.max_workers = max_workers
+        self.client = client if client is not None else HTTPClient(**client_options)
+        self.cache = cache
+
+    def version_url(self, county_name, eid_num):
+        '''
+        version_url, the url of current_ver.txt of a county.
+        '''
+        return '%s%s/%s/current_ver.txt' % (self.prefix,
+                                            county_url_name(county_name), eid_num)
+
+    def archive_url(self, county_name, eid_num, version):
+        '''
+        archive_url, the url of the detail zip file of a version.
+        '''
+        return '%s%s/%s/%s/reports/detailxls.zip' % (
+            self.prefix, county_url_name(county_name), eid_num, version)
+
+    def current_version(self, county_name, eid_num):
+        '''
+        current_version, the current version of the results of a county,
+        the first line of current_ver.txt.
+        '''
+        url = self.version_url(county_name, eid_num)
+        if self.cache is None:
+            body = self.client.get(url).body.decode('UTF-8')
+        else:
+            body = self.cache.version(self.client, url,
+                                      county_url_name(county_name), eid_num)
+        return body.splitlines()[0].strip()
+
+    def extract_detail(self, archive, county_name):
+        '''
+        extract_detail, write detail.xls from the bytes of a detailxls.zip
+        to the file of the county in out_dir.
+
+        RETURNS:
+        ----------
+        path: str instance
+            The path of the file written.
+        '''
+        path = os.path.join(self.out_dir,
+                            self.filename_pattern % county_url_name(county_name))
+        # the zip is read from memory, so threads never share a temporary
+        # file, and the file appears whole or not at all
+        with ZipFile(io.BytesIO(archive)) as zf:
+            data = zf.read('detail.xls')
+        temporary = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+        return path
+
+    def download_county(self, county_name, eid_num):
+        '''
+        download_county, download the detail results of one county.
+
+        RETURNS:
+        ----------
+        path: str instance
+            The path of the file written, see extract_detail, or None.
+        error: DownloadError instance
+            What went wrong, or None.
+        '''
+        stage = 'version'
+        url = self.version_url(county_name, eid_num)
+        try:
+            version = self.current_version(county_name, eid_num)
+            stage = 'archive'
+            url = self.archive_url(county_name, eid_num, version)
+            if self.cache is None:
+                archive = self.client.get(url).body
+            else:
+                archive = self.cache.file(self.client, url,
+                                          county_url_name(county_name),
+                                          eid_num, version)
+            stage = 'extract'
+            return self.extract_detail(archive, county_name), None
+        except FetchError as error:
+            return None, DownloadError(county_name, error.url, stage,
+                                       error.message, error.attempts)
+        except (BadZipFile, KeyError, OSError, UnicodeDecodeError,
+                IndexError) as error:
+            return None, DownloadError(county_name, url, stage, repr(error), 1)
+
+    def download_counties(self, county_names, eid_nums, errors_path=None):
+        '''
+        download_counties, download the detail results of many counties with
+        a pool of max_workers threads.
+
+        Arguments:
+        ----------
+        county_names: list of str instance
+            The counties.
+        eid_nums: list of str instance
+            The election id of each county.
+        errors_path: str instance
+            A file the errors are appended to, one JSON object per line.
+
+        RETURNS:
+        ----------
+        paths: dict instance
+            The path of the file written for each county that worked.
+        errors: list of DownloadError instance
+            A record for each county that failed.
+        '''
+        os.makedirs(self.out_dir, exist_ok=True)
+        jobs = list(zip(county_names, eid_nums))
+        workers = set()
+
+        def download(job):
+            workers.add(threading.get_ident())
+            return self.download_county(*job)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(download, jobs))
+        # the workers are done, their keep-alive connections are not needed
+        self.client.close_threads(workers)
+        paths = {}
+        errors = []
+        for ((county_name, _), (path, error)) in zip(jobs, results):
+            if error is None:
+                paths[county_name] = path
+            else:
+                errors.append(error)
+        if errors_path is not None and len(errors) > 0:
+            write_errors(errors, errors_path)
+        return paths, errors
+
+
+def write_errors(errors, path):
+    '''
+    write_errors, append DownloadError records to a file, one JSON object
+    per line.
+    '''
+    with open(path, 'a') as f:
+        for error in errors:
+            f.write(json.dumps(error._asdict()) + '\n')
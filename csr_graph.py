@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Array-backed base graphs for the chain scripts.
+
+A CSRGraph stores the neighbours of vertex v in
+indices[indptr[v]:indptr[v+1]] (compressed sparse row format), the id of the
+edge behind each of those entries in edge_ids, and the edges themselves as an
+(m,2) array with edges[e,0] < edges[e,1]. All arrays are int32, so a grid with
+a million precincts takes a few tens of megabytes instead of the gigabytes a
+networkx graph needs, and a neighbour scan reads one contiguous slice.
+"""
+
+from collections import namedtuple
+
+import networkx as nx
+import numpy as np
+
+CSRGraph = namedtuple('CSRGraph', ['indptr', 'indices', 'edge_ids', 'edges'])
+
+
+def create_csr_graph_from_edges(num_vertices, edges):
+    '''
+    create_csr_graph_from_edges, build a CSRGraph on the vertices
+    0,...,num_vertices-1 from a list of edges. Loops are dropped and repeated
+    edges are only kept once.
+
+    Arguments:
+    ----------
+    num_vertices: int instance
+        The number of vertices of the graph.
+    edges: (m,2) array or list of tuples instance
+        The edges of the graph.
+
+    RETURNS:
+    ----------
+    graph: CSRGraph instance
+        The graph in compressed sparse row format.
+    '''
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = np.sort(edges, axis=1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    edges = np.unique(edges, axis=0).astype(np.int32)
+    m = len(edges)
+    # every edge shows up once in the row of each of its endpoints
+    tails = np.concatenate([edges[:, 0], edges[:, 1]])
+    heads = np.concatenate([edges[:, 1], edges[:, 0]])
+    ids = np.concatenate([np.arange(m), np.arange(m)])
+    order = np.lexsort((heads, tails))
+    indptr = np.zeros(num_vertices + 1, dtype=np.int32)
+    np.cumsum(np.bincount(tails, minlength=num_vertices), out=indptr[1:])
+    return CSRGraph(indptr=indptr,
+                    indices=heads[order].astype(np.int32),
+                    edge_ids=ids[order].astype(np.int32),
+                    edges=edges)
+
+
+def create_csr_graph_n_by_n(n, diagonals=False):
+    '''
+    create_csr_graph_n_by_n, build the n by n grid as a CSRGraph. The
+    vertices are indexed by row first, as in create_graph_n_by_n. Without
+    diagonals this is the rook adjacency (the Cartesian product of two paths
+    of length n), with diagonals it is the queen adjacency (the strong
+    product of two paths of length n).
+
+    Arguments:
+    ----------
+    n: int instance
+        the dimensions of the n by n grid. There are n**2 vertices.
+    diagonals: bool instance
+        If True, also join the vertices that touch at a corner.
+
+    RETURNS:
+    ----------
+    graph: CSRGraph instance
+        graph of the n by n grid.
+    '''
+    index = np.arange(n**2).reshape(n, n)
+    pairs = [(index[:, :-1], index[:, 1:]),   # east
+             (index[:-1, :], index[1:, :])]   # south
+    if diagonals:
+        pairs.append((index[:-1, :-1], index[1:, 1:]))   # southeast
+        pairs.append((index[:-1, 1:], index[1:, :-1]))   # southwest
+    edges = np.concatenate([np.stack([a.ravel(), b.ravel()], axis=1)
+                            for (a, b) in pairs])
+    return create_csr_graph_from_edges(n**2, edges)
+
+
+def neighbors(graph, v):
+    '''
+    neighbors, the neighbours of the vertex v in graph.
+
+    Arguments:
+    ----------
+    graph: CSRGraph instance
+        The graph.
+    v: int instance
+        A vertex of graph.
+
+    RETURNS:
+    ----------
+    neighbors_of_v: numpy array instance
+        A view of the neighbours of v.
+    '''
+    return graph.indices[graph.indptr[v]:graph.indptr[v + 1]]
+
+
+def csr_graph_from_networkx(G):
+    '''
+    csr_graph_from_networkx, convert a networkx graph to a CSRGraph. The
+    vertex i of the CSRGraph is the i-th vertex of sorted(G.nodes()), so a
+    grid made by create_graph_n_by_n keeps its vertex numbers.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The graph to convert.
+
+    RETURNS:
+    ----------
+    graph: CSRGraph instance
+        The graph in compressed sparse row format.
+    nodes: list instance
+        nodes[i] is the vertex of G that became vertex i.
+    '''
+    nodes = sorted(G.nodes())
+    position = {v: i for (i, v) in enumerate(nodes)}
+    edges = [(position[a], position[b]) for (a, b) in G.edges()]
+    return create_csr_graph_from_edges(len(nodes), edges), nodes
+
+
+def csr_graph_to_networkx(graph):
+    '''
+    csr_graph_to_networkx, convert a CSRGraph to a networkx graph, e.g. for
+    plotting.
+
+    Arguments:
+    ----------
+    graph: CSRGraph instance
+        The graph to convert.
+
+    RETURNS:
+    ----------
+    G: networkx graph instance
+        The same graph as a networkx graph on the vertices 0,...,|V|-1.
+    '''
+    G = nx.Graph()
+    G.add_nodes_from(range(len(graph.indptr) - 1))
+    G.add_edges_from(graph.edges.tolist())
+    return G
@@ -1,18 +1,36 @@
-import urllib.request
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium import webdriver
-import pandas as pd
+import atexit
 import json
 import time
 import random
-from urllib.request import urlopen
-from zipfile import ZipFile
 import os
-from shutil import copyfile
+from county_downloader import CountyDownloader, county_url_name
+from scrape_cache import ScrapeCache
+from precinct_scraper import BrowserPool, PrecinctScraper
 
 prefix = 'https://results.enr.clarityelections.com/GA/'
+data_dir = 'C:\\Users\\jasplund\\Dropbox\\research\\gerry\\voting_data\\data\\2016'
+
+# Fetches the counties with a pool of threads over keep-alive connections,
+# at most 5 requests per second to the site, retrying failed requests. Point
+# prefix at a local server to test the scraper without the real site.
+# The versions and zip files are cached in .scrape_cache, so a county whose
+# version did not change is not downloaded again. max_age=0 is on purpose:
+# while the counts can still change, every run asks the site once per county
+# whether current_ver.txt changed. That is a conditional request, answered
+# with an empty 304 when nothing changed, so it costs one small round trip
+# per county and never a download. Once the results are certified, set
+# max_age=None to trust the cached versions and make no requests at all.
+cache = ScrapeCache(max_age=0)
+downloader = CountyDownloader(data_dir, prefix=prefix,
+                              filename_pattern='%s_precinct_data_2012.xls',
+                              max_workers=8, requests_per_second=5.0,
+                              cache=cache)
+# One pool of at most 4 headless browsers serves every page of the run. The
+# browsers are started when a page first needs one, kept for the next pages
+# and quit when the script exits.
+browser_pool = BrowserPool(size=4)
+atexit.register(browser_pool.close)
+precinct_scraper = PrecinctScraper(downloader, browser_pool)
 
 def getPrecinctRequestStringFromCounty(county_name,eid_num):
    request_str = prefix + county_name + "/" + eid_num + "/current_ver.txt"
@@ -28,9 +46,11 @@ def getPrecinctCurrentVersionFromCounty(county_name, eid_num):
    # In the case that we are being blocked by the website, put a mandatory delay
    # on our webfile retrieval.
 #   time.sleep(10)
-   webfile = urllib.request.urlopen(url_request_str)
-   lines = webfile.readlines()
-   current_precinct_num = lines[0].decode("UTF-8")
+   # The downloader spaces the requests to the site and retries them, and
+   # the cache looks the version up at most once per run.
+   body = cache.version(downloader.client, url_request_str,
+                        county_url_name(county_name), eid_num)
+   current_precinct_num = body.splitlines()[0].strip()
    return current_precinct_num
 
 ## Test that we are getting the right information.
@@ -46,28 +66,18 @@ def getPrecinctURLFromCounty(county_name, eid_num, cid_num):
 ## Test that we are getting the right information.
 #print(getPrecinctURLFromCounty("Bryan","42293","15"))
 
-def scrapePrecinctURLToDataFrame(precinct_URL,count):
-    #create a webdriver that lets us wait out the Javascript
-    #as it procedurally generates the HTML, then get
-    #the HTML
-    wd = webdriver.PhantomJS()
-    wd.set_window_size(1120,550)
-    WebDriverWait(wd,30)
+def scrapePrecinctURLToDataFrame(precinct_URL,count,scraper=None):
+    #read the JSON behind the page, or else use a headless browser of the
+    #pool that lets us wait out the Javascript as it procedurally generates
+    #the HTML, then get the HTML. The browser stays in the pool for the next
+    #page; pass scraper to use a PrecinctScraper with another pool.
 #    time.sleep(random.random()*30)
-    wd.get(precinct_URL)
-    html_page = wd.page_source
-    wd.quit()
-    #use pandas built-in functionality to scrape all tables
-    all_tables = pd.read_html(html_page)
-    #in all the examples I looked at, the relevant table was the last one
-    relevant_table = all_tables[-1]
-    relevant_table.drop(relevant_table.columns[[0]], axis=1, inplace=True)
-    relevant_table.drop(relevant_table.index[0], inplace = True)
-#    relevant_table.drop(relevant_table.index[-1],inplace=True)
-    relevant_table = relevant_table[~relevant_table[1].str.contains('Total:')]
-#    if count!=0:
-#        relevant_table = relevant_table[~relevant_table[1].str.contains('Precinct')]
-    relevant_table = relevant_table[~relevant_table[1].str.contains('Precinct')]
+    if scraper is None:
+        scraper = precinct_scraper
+    relevant_table, error = scraper.scrape_url(precinct_URL)
+    if error is not None:
+        print(error)
+    #the last table of the page, without the 'Total:' and 'Precinct' rows
     return relevant_table
 
 #table_to_scrape = scrapePrecinctURLToDataFrame('https://results.enr.clarityelections.com/GA/Appling/63993/112231/en/md_data.html?cid=1',0)
@@ -75,20 +85,17 @@ def scrapePrecinctURLToDataFrame(precinct_URL,count):
 #print(str(table_to_scrape))
 
 def getAllPrecinctDataFrames(county_name_list, eid_num_list, cid_num_list):
-
-   data_frames = []
-   for i in range(len(county_name_list)):
-       try:
-           precinct_URL = getPrecinctURLFromCounty(county_name_list[i],
-                                             eid_num_list[i],
-                                             cid_num_list[i])
-           precinct_data_frame = scrapePrecinctURLToDataFrame(precinct_URL,i)
-           print(precinct_data_frame)
-           data_frames.append(precinct_data_frame)
-       except:
-           print('oops') #in the future, print where the errors were located.
-           with open("errors.txt","a+") as f:
-               f.write(precinct_URL + '\n')
+   # The counties are scraped in parallel by the long-lived headless
+   # browsers of browser_pool; a page is not rendered at all when the JSON
+   # behind it is there. The counties that fail are listed in errors.jsonl.
+   data_frames, errors = precinct_scraper.scrape_all(county_name_list,
+                                                     eid_num_list,
+                                                     cid_num_list,
+                                                     errors_path="errors.jsonl")
+   for precinct_data_frame in data_frames:
+       print(precinct_data_frame)
+   for error in errors:
+       print(error)
    return data_frames
 
 f1 = open('sum2016.json','r')
@@ -110,35 +117,18 @@ our_cid_num_list = our_contest['Cid']
 #print(our_county_name_list)
 #print(our_eid_num_list)
 
-suffix = 'reports/detailxls.zip'
 for x in range(len(our_county_name_list)):
     if len(str.split(our_county_name_list[x]))>1:
         our_county_name_list[x] = '_'.join(str.split(our_county_name_list[x]))
 
-    precinct_num = getPrecinctCurrentVersionFromCounty(our_county_name_list[x],our_eid_num_list[x])
-    html_site = prefix + our_county_name_list[x] + '/' + our_eid_num_list[x] + '/' + precinct_num + '/' + suffix
-    print(html_site)
-
-    zipurl = html_site
-    # Download the file from the URL
-    zipresp = urlopen(zipurl)
-    # Create a new file on the hard drive
-    tempzip = open("/tmp/tempfile.zip", "wb")
-    # Write the contents of the downloaded file into the new file
-    tempzip.write(zipresp.read())
-    # Close the newly-created file
-    tempzip.close()
-    # Re-open the newly-created file with ZipFile()
-    zf = ZipFile("/tmp/tempfile.zip")
-    # Extract its contents into destination folder
-    # note that extractall will automatically create the path
-    zf.extractall(path = 'C:\\Users\\jasplund\\Dropbox\\research\\gerry\\voting_data\\data\\2016')
-    # close the ZipFile instance
-    zf.close()
-
-#    path =  'C:\\Users\\jasplund\\Dropbox\\research\\gerry\\voting_data\\data'
-#    filenames = os.listdir(path)
-    
-    copyfile('C:\\Users\\jasplund\\Dropbox\\research\\gerry\\voting_data\\data\\2016\\'+'detail.xls', 
-             'C:\\Users\\jasplund\\Dropbox\\research\\gerry\\voting_data\\data\\2016\\'+our_county_name_list[x]+'_precinct_data_2012.xls')
-
+# Download the detail results of every county, a few at a time. Each county's
+# detail.xls is written to data_dir as <county>_precinct_data_2012.xls, and
+# the counties that failed are listed in errors.jsonl.
+paths, errors = downloader.download_counties(our_county_name_list,
+                                             our_eid_num_list,
+                                             errors_path='errors.jsonl')
+print('Downloaded %d of %d counties' % (len(paths), len(our_county_name_list)))
+for error in errors:
+    print('%s failed at %s: %s (%s)' % (error.county, error.stage, error.error,
+                                        error.url))
+print(cache.stats)
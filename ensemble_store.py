@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk store for the plans visited by a flip-walk.
+
+Consecutive plans of a chain differ in one or two vertices, so instead of
+keeping a full copy of every plan the store records each accepted step as its
+moves (vertex, old district, new district) and keeps a full snapshot of every
+snapshot_interval-th plan. Plan i is rebuilt from the snapshot before it by
+replaying at most snapshot_interval steps. Everything lives in fixed size
+chunk files that are memory-mapped, so the memory use does not grow with the
+length of the chain.
+
+A store is a directory with
+    meta.json            sizes and settings
+    deltas_XXXXX.dat     int32 rows (vertex, old, new), one row per move
+    ends_XXXXX.dat       int64, ends[i] is the number of moves up to plan i
+    snapshots_XXXXX.dat  int32 rows, the full plans 0, interval, 2*interval, ...
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+class _ChunkedArray(object):
+    '''
+    _ChunkedArray, an append-only array of rows stored in memory-mapped chunk
+    files of chunk_rows rows each.
+    '''
+
+    def __init__(self, prefix, dtype, row_shape, chunk_rows, length=0,
+                 writable=True):
+        self.prefix = prefix
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.chunk_rows = chunk_rows
+        self.length = length
+        self.writable = writable
+        self.chunks = []
+
+    def _chunk(self, c):
+        while len(self.chunks) <= c:
+            i = len(self.chunks)
+            path = '%s_%05d.dat' % (self.prefix, i)
+            shape = (self.chunk_rows,) + self.row_shape
+            if os.path.exists(path):
+                mode = 'r+' if self.writable else 'r'
+            else:
+                mode = 'w+'
+            self.chunks.append(np.memmap(path, dtype=self.dtype, mode=mode,
+                                         shape=shape))
+        return self.chunks[c]
+
+    def __len__(self):
+        return self.length
+
+    def append(self, row):
+        c, r = divmod(self.length, self.chunk_rows)
+        self._chunk(c)[r] = row
+        self.length += 1
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        done = 0
+        while done < len(rows):
+            c, r = divmod(self.length, self.chunk_rows)
+            count = min(self.chunk_rows - r, len(rows) - done)
+            self._chunk(c)[r:r + count] = rows[done:done + count]
+            self.length += count
+            done += count
+
+    def __getitem__(self, i):
+        c, r = divmod(i, self.chunk_rows)
+        return self._chunk(c)[r]
+
+    def rows(self, start, stop):
+        '''rows start,...,stop-1 as one array'''
+        parts = []
+        while start < stop:
+            c, r = divmod(start, self.chunk_rows)
+            count = min(self.chunk_rows - r, stop - start)
+            parts.append(self._chunk(c)[r:r + count])
+            start += count
+        if len(parts) == 0:
+            return np.zeros((0,) + self.row_shape, dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def flush(self):
+        for chunk in self.chunks:
+            if chunk.mode != 'r':
+                chunk.flush()
+
+
+class EnsembleStore(object):
+    '''
+    EnsembleStore, the plans visited by a chain, stored as moves plus
+    periodic snapshots. Use create_ensemble_store or open_ensemble_store
+    rather than calling the constructor.
+
+    len(store) is the number of plans, store[i] rebuilds plan i, append adds
+    the plan obtained by applying moves to the last plan, and iter_plans and
+    iter_chunks replay the plans in order for post-processing.
+    '''
+
+    def __init__(self, path, meta, writable=True):
+        self.path = path
+        self.num_vertices = meta['num_vertices']
+        self.snapshot_interval = meta['snapshot_interval']
+        self.chunk_rows = meta['chunk_rows']
+        self.writable = writable
+        join = os.path.join
+        self.deltas = _ChunkedArray(join(path, 'deltas'), np.int32, (3,),
+                                    self.chunk_rows, meta['num_deltas'],
+                                    writable)
+        self.ends = _ChunkedArray(join(path, 'ends'), np.int64, (),
+                                  self.chunk_rows, meta['num_plans'], writable)
+        snapshot_rows = max(1, self.chunk_rows // max(self.num_vertices, 1))
+        self.snapshots = _ChunkedArray(join(path, 'snapshots'), np.int32,
+                                       (self.num_vertices,), snapshot_rows,
+                                       meta['num_snapshots'], writable)
+        self.current = None
+        if writable and len(self) > 0:
+            self.current = self[len(self) - 1]
+
+    def __len__(self):
+        return len(self.ends)
+
+    def _meta(self):
+        return {'num_vertices': self.num_vertices,
+                'snapshot_interval': self.snapshot_interval,
+                'chunk_rows': self.chunk_rows,
+                'num_plans': len(self.ends),
+                'num_deltas': len(self.deltas),
+                'num_snapshots': len(self.snapshots)}
+
+    def append(self, moves):
+        '''
+        append, record the plan obtained by applying moves to the last plan
+        of the store.
+
+        Arguments:
+        ----------
+        moves: list of tuples instance
+            Each tuple (v, old, new) moves vertex v from district old to new.
+
+        RETURNS:
+        ----------
+        None
+        '''
+        self.deltas.extend(moves)
+        for (v, old, new) in moves:
+            self.current[v] = new
+        self.ends.append(len(self.deltas))
+        if (len(self) - 1) % self.snapshot_interval == 0:
+            self.snapshots.append(self.current)
+
+    def _apply(self, plan, start, stop):
+        # apply the moves start,...,stop-1; when a vertex moves more than
+        # once only its last move counts
+        deltas = self.deltas.rows(start, stop)
+        if len(deltas) == 0:
+            return plan
+        vertices = deltas[::-1, 0]
+        last_moves = np.unique(vertices, return_index=True)[1]
+        plan[vertices[last_moves]] = deltas[::-1, 2][last_moves]
+        return plan
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('plan index out of range')
+        s = i // self.snapshot_interval
+        plan = np.array(self.snapshots[s])
+        return self._apply(plan, int(self.ends[s * self.snapshot_interval]),
+                           int(self.ends[i]))
+
+    def iter_plans(self, start=0, stop=None):
+        '''
+        iter_plans, replay the plans start,...,stop-1 in order. The same
+        array is updated and yielded at every step, so copy it to keep it.
+
+        Arguments:
+        ----------
+        start: int instance
+            The first plan.
+        stop: int instance
+            One past the last plan, by default len(store).
+
+        RETURNS:
+        ----------
+        plans: iterator of numpy arrays instance
+            The plans.
+        '''
+        if stop is None:
+            stop = len(self)
+        if start >= stop:
+            return
+        plan = self[start]
+        yield plan
+        for i in range(start + 1, stop):
+            begin = int(self.ends[i - 1])
+            end = int(self.ends[i])
+            deltas = self.deltas.rows(begin, end)
+            for (v, old, new) in deltas:
+                plan[v] = new
+            yield plan
+
+    def iter_chunks(self, chunk_size=10000):
+        '''
+        iter_chunks, replay the plans in order as stacked arrays of at most
+        chunk_size plans, for vectorized post-processing.
+
+        Arguments:
+        ----------
+        chunk_size: int instance
+            The number of plans in a chunk.
+
+        RETURNS:
+        ----------
+        chunks: iterator of numpy arrays instance
+            Arrays of shape (plans in the chunk, number of vertices).
+        '''
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            chunk = np.empty((stop - start, self.num_vertices), dtype=np.int32)
+            for (row, plan) in enumerate(self.iter_plans(start, stop)):
+                chunk[row] = plan
+            yield chunk
+
+    def flush(self):
+        '''
+        flush, write the chunk files and meta.json to disk.
+        '''
+        self.deltas.flush()
+        self.ends.flush()
+        self.snapshots.flush()
+        if self.writable:
+            with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+                json.dump(self._meta(), f)
+
+    def close(self):
+        self.flush()
+
+
+def create_ensemble_store(path, districting, snapshot_interval=1000,
+                          chunk_rows=2**20):
+    '''
+    create_ensemble_store, make a new store in the directory path whose first
+    plan is districting.
+
+    Arguments:
+    ----------
+    path: str instance
+        The directory of the store. It is created if needed; an existing store
+        in it is overwritten.
+    districting: numpy array instance
+        The first plan of the chain.
+    snapshot_interval: int instance
+        A full copy of every snapshot_interval-th plan is kept, so rebuilding
+        a plan replays at most snapshot_interval steps.
+    chunk_rows: int instance
+        The number of rows in each chunk file.
+
+    RETURNS:
+    ----------
+    store: EnsembleStore instance
+        The new store, holding one plan.
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name in os.listdir(path):
+        if name.endswith('.dat') or name == 'meta.json':
+            os.remove(os.path.join(path, name))
+    meta = {'num_vertices': len(districting),
+            'snapshot_interval': snapshot_interval,
+            'chunk_rows': chunk_rows,
+            'num_plans': 0,
+            'num_deltas': 0,
+            'num_snapshots': 0}
+    store = EnsembleStore(path, meta)
+    store.current = np.array(districting, dtype=np.int32)
+    store.ends.append(0)
+    store.snapshots.append(store.current)
+    store.flush()
+    return store
+
+
+def open_ensemble_store(path, writable=False):
+    '''
+    open_ensemble_store, open a store made by create_ensemble_store.
+
+    Arguments:
+    ----------
+    path: str instance
+        The directory of the store.
+    writable: bool instance
+        If True more plans can be appended.
+
+    RETURNS:
+    ----------
+    store: EnsembleStore instance
+        The store.
+    '''
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return EnsembleStore(path, meta, writable)
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+Validity checks for the flip-walk used by the chain scripts.
+
+A proposal is a list of moves (vertex, old district, new district). Only the
+districts named in the moves can change, so instead of copying the base graph
+and recomputing every connected component we look at the touched districts
+only: their sizes are read from a maintained size array and their connectivity
+is checked with a BFS that stops as soon as the vertices next to the change
+have been reached. The conflicted (cut) edges are kept in a CutEdgeIndex so a
+proposal can draw one directly instead of drawing edges until it finds one.
+
+ChainState bundles the current plan with everything that is kept up to date
+along the walk: district sizes, conflicted edges and, when votes are given,
+the votes and the Yellow seats of every district.
+"""
+
+import random
+
+import numpy as np
+
+from csr_graph import neighbors
+from seat_tally import district_seat, tally_district_votes
+
+
+def create_district_sizes(districting, num_districts):
+    '''
+    create_district_sizes, count the number of vertices in each district of
+    a districting plan. The walk keeps this array up to date with
+    apply_moves instead of recounting after each step.
+
+    Arguments:
+    ----------
+    districting: numpy array instance
+        districting[v] is the district of vertex v.
+    num_districts: int instance
+        The number of districts in the plan.
+
+    RETURNS:
+    ----------
+    district_sizes: numpy array instance
+        district_sizes[d] is the number of vertices in district d.
+    '''
+    return np.bincount(districting, minlength=num_districts)
+
+
+def moved_district_is_connected(graph, districting, moves, district):
+    '''
+    moved_district_is_connected, decide whether district is still connected
+    after the moves are applied to districting. The district is assumed to be
+    connected before the moves.
+
+    Every vertex left in the district can reach, inside the old district, a
+    vertex next to one of the removed vertices. So the new district is
+    connected exactly when the vertices around the change (the added vertices
+    and the remaining neighbours of the removed ones) reach each other. The
+    BFS stops as soon as they all have been found, which is usually after a
+    handful of vertices.
+
+    Arguments:
+    ----------
+    graph: CSRGraph instance
+        The base graph.
+    districting: numpy array instance
+        The current districting plan, districting[v] is the district of v.
+    moves: list of tuples instance
+        Each tuple (v, old, new) moves vertex v from district old to new.
+    district: int instance
+        The district to check.
+
+    RETURNS:
+    ----------
+    connected: bool instance
+        True if the district is connected after the moves.
+    '''
+    moved = {v: new for (v, old, new) in moves}
+    removed = [v for (v, old, new) in moves if old == district]
+    added = [v for (v, old, new) in moves if new == district]
+
+    def label(u):
+        return moved.get(u, districting[u])
+
+    targets = set(added)
+    for v in removed:
+        for u in neighbors(graph, v):
+            if label(u) == district:
+                targets.add(u)
+    if len(removed) == 0:
+        # Nothing was taken away, so the old district is still connected and
+        # the added vertices only need to touch it.
+        anchor = None
+        for v in added:
+            for u in neighbors(graph, v):
+                if u not in moved and districting[u] == district:
+                    anchor = u
+                    break
+            if anchor is not None:
+                break
+        if anchor is None:
+            return False
+        targets.add(anchor)
+    if len(targets) <= 1:
+        return True
+
+    start = next(iter(targets))
+    left = len(targets) - 1
+    seen = set([start])
+    queue = [start]
+    while queue:
+        v = queue.pop()
+        for u in neighbors(graph, v):
+            if u not in seen and label(u) == district:
+                seen.add(u)
+                if u in targets:
+                    left -= 1
+                    if left == 0:
+                        return True
+                queue.append(u)
+    return False
+
+
+def proposal_is_valid(graph, districting, district_sizes, moves, min_size, max_size):
+    '''
+    proposal_is_valid, check that applying the moves to districting gives a
+    plan where every district has between min_size and max_size vertices and
+    the induced subgraph on every district is connected. Only the districts
+    touched by the moves are examined.
+
+    Arguments:
+    ----------
+    graph: CSRGraph instance
+        The base graph.
+    districting: numpy array instance
+        The current (valid) districting plan.
+    district_sizes: numpy array instance
+        The number of vertices in each district of districting.
+    moves: list of tuples instance
+        Each tuple (v, old, new) moves vertex v from district old to new.
+    min_size: int instance
+        The smallest number of vertices allowed in a district.
+    max_size: int instance
+        The largest number of vertices allowed in a district.
+
+    RETURNS:
+    ----------
+    valid: bool instance
+        True if the proposed districting plan is valid.
+    '''
+    change = {}
+    for (v, old, new) in moves:
+        change[old] = change.get(old, 0) - 1
+        change[new] = change.get(new, 0) + 1
+    for district in change:
+        size = district_sizes[district] + change[district]
+        if size < min_size or size > max_size:
+            return False
+    for district in change:
+        if not moved_district_is_connected(graph, districting, moves,
+                                           district):
+            return False
+    return True
+
+
+def apply_moves(districting, district_sizes, moves):
+    '''
+    apply_moves, apply the moves to districting and district_sizes in place.
+
+    Arguments:
+    ----------
+    districting: numpy array instance
+        The current districting plan.
+    district_sizes: numpy array instance
+        The number of vertices in each district of districting.
+    moves: list of tuples instance
+        Each tuple (v, old, new) moves vertex v from district old to new.
+
+    RETURNS:
+    ----------
+    None
+    '''
+    for (v, old, new) in moves:
+        districting[v] = new
+        district_sizes[old] -= 1
+        district_sizes[new] += 1
+
+
+class CutEdgeIndex(object):
+    '''
+    CutEdgeIndex, the set of conflicted edges of a districting plan, i.e. the
+    edges whose endpoints are in different districts. The edge ids are kept
+    packed at the front of cut_edges and position[e] is the slot of edge e
+    (or -1 if e is not conflicted), so edges are added and removed in O(1)
+    (a removed edge is overwritten by the last one) and a uniformly random
+    conflicted edge is drawn in O(1).
+
+    Arguments:
+    ----------
+    graph: CSRGraph instance
+        The base graph.
+    districting: numpy array instance
+        The districting plan.
+    '''
+
+    def __init__(self, graph, districting):
+        m = len(graph.edges)
+        conflicted = np.flatnonzero(districting[graph.edges[:, 0]]
+                                    != districting[graph.edges[:, 1]])
+        self.cut_edges = np.empty(m, dtype=np.int32)
+        self.position = np.full(m, -1, dtype=np.int32)
+        self.size = len(conflicted)
+        self.cut_edges[:self.size] = conflicted
+        self.position[conflicted] = np.arange(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, e):
+        self.cut_edges[self.size] = e
+        self.position[e] = self.size
+        self.size += 1
+
+    def remove(self, e):
+        slot = self.position[e]
+        last = self.cut_edges[self.size - 1]
+        self.cut_edges[slot] = last
+        self.position[last] = slot
+        self.position[e] = -1
+        self.size -= 1
+
+    def sample(self, rng=random):
+        '''
+        sample, draw a conflicted edge uniformly at random. This has the same
+        distribution as drawing edges of the graph until a conflicted one is
+        found.
+
+        Arguments:
+        ----------
+        rng: random.Random instance
+            The random number generator, the random module by default.
+
+        RETURNS:
+        ----------
+        e: int instance
+            The id of the edge, i.e. its row in graph.edges.
+        '''
+        return self.cut_edges[rng.randint(0, self.size - 1)]
+
+    def update(self, graph, districting, moves):
+        '''
+        update, bring the index up to date after the moves have been applied
+        to districting. Only the edges at the moved vertices can change.
+
+        Arguments:
+        ----------
+        graph: CSRGraph instance
+            The base graph.
+        districting: numpy array instance
+            The districting plan after the moves.
+        moves: list of tuples instance
+            Each tuple (v, old, new) moved vertex v from district old to new.
+
+        RETURNS:
+        ----------
+        None
+        '''
+        for (v, old, new) in moves:
+            start = graph.indptr[v]
+            end = graph.indptr[v + 1]
+            for (u, e) in zip(graph.indices[start:end],
+                              graph.edge_ids[start:end]):
+                conflicted = districting[u] != new
+                if conflicted and self.position[e] < 0:
+                    self.add(e)
+                elif not conflicted and self.position[e] >= 0:
+                    self.remove(e)
+
+
+def propose_moves(graph, districting, cut_edges, swap, rng=random):
+    '''
+    propose_moves, pick a random conflicted edge and build the proposal the
+    chain scripts make from it. With swap=True the two endpoints trade
+    districts (graves-original-altered.py, district sizes never change),
+    otherwise one of the two endpoints, chosen at random, moves into the
+    district of the other (no_diagonals_redistricting_10_by_10_columns.py).
+
+    Arguments:
+    ----------
+    graph: CSRGraph instance
+        The base graph.
+    districting: numpy array instance
+        The current districting plan.
+    cut_edges: CutEdgeIndex instance
+        The conflicted edges of districting.
+    swap: bool instance
+        If True swap the endpoints, otherwise move one of them.
+    rng: random.Random instance
+        The random number generator, the random module by default.
+
+    RETURNS:
+    ----------
+    moves: list of tuples instance
+        Each tuple (v, old, new) moves vertex v from district old to new.
+    '''
+    edge = graph.edges[cut_edges.sample(rng)]
+    r_a = edge[0]
+    r_b = edge[1]
+    if swap:
+        return [(r_a, districting[r_a], districting[r_b]),
+                (r_b, districting[r_b], districting[r_a])]
+    if rng.randint(0, 1) == 0:
+        return [(r_a, districting[r_a], districting[r_b])]
+    return [(r_b, districting[r_b], districting[r_a])]
+
+
+class ChainState(object):
+    '''
+    ChainState, the state of a flip-walk: the current plan, the number of
+    vertices in each district, the conflicted edges and, if party_assignment
+    is given, the Yellow votes, the total votes and the Yellow seat share of
+    each district together with the total number of Yellow seats. All of
+    these are adjusted in O(1) per moved vertex by apply, so the seats of the
+    current plan are known at every step without rescanning the plan.
+
+    Arguments:
+    ----------
+    graph: CSRGraph instance
+        The base graph.
+    districting: numpy array instance
+        The starting plan. The state updates this array in place.
+    num_districts: int instance
+        The number of districts.
+    party_assignment: numpy array instance
+        The Yellow votes of each vertex, or None to skip the vote tallies.
+    populations: numpy array instance
+        The total votes of each vertex, by default 1 per vertex.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green' or 'half'.
+    '''
+
+    def __init__(self, graph, districting, num_districts,
+                 party_assignment=None, populations=None, ties='yellow'):
+        self.graph = graph
+        self.districting = districting
+        self.num_districts = num_districts
+        self.district_sizes = create_district_sizes(districting, num_districts)
+        self.cut_edges = CutEdgeIndex(graph, districting)
+        self.party_assignment = party_assignment
+        self.ties = ties
+        if party_assignment is None:
+            return
+        if populations is None:
+            populations = np.ones(len(districting), dtype=np.int64)
+        self.populations = populations
+        yellow_votes, total_votes = tally_district_votes(
+            districting, party_assignment, num_districts, populations)
+        self.district_votes = yellow_votes[0]
+        self.district_populations = total_votes[0]
+        self.district_seats = np.array(
+            [district_seat(self.district_votes[d], self.district_populations[d],
+                           ties) for d in range(num_districts)],
+            dtype=float if ties == 'half' else np.int64)
+        self.yellow_seats = self.district_seats.sum()
+
+    def propose(self, swap, rng=random):
+        '''
+        propose, make a proposal from the current plan, see propose_moves.
+        '''
+        return propose_moves(self.graph, self.districting, self.cut_edges,
+                             swap, rng)
+
+    def is_valid(self, moves, min_size, max_size):
+        '''
+        is_valid, check a proposal against the current plan, see
+        proposal_is_valid.
+        '''
+        return proposal_is_valid(self.graph, self.districting,
+                                 self.district_sizes, moves, min_size,
+                                 max_size)
+
+    def apply(self, moves):
+        '''
+        apply, apply an accepted proposal and update the district sizes, the
+        conflicted edges and the vote tallies.
+
+        Arguments:
+        ----------
+        moves: list of tuples instance
+            Each tuple (v, old, new) moves vertex v from district old to new.
+
+        RETURNS:
+        ----------
+        None
+        '''
+        apply_moves(self.districting, self.district_sizes, moves)
+        self.cut_edges.update(self.graph, self.districting, moves)
+        if self.party_assignment is None:
+            return
+        touched = set()
+        for (v, old, new) in moves:
+            self.district_votes[old] -= self.party_assignment[v]
+            self.district_votes[new] += self.party_assignment[v]
+            self.district_populations[old] -= self.populations[v]
+            self.district_populations[new] += self.populations[v]
+            touched.add(old)
+            touched.add(new)
+        for d in touched:
+            seat = district_seat(self.district_votes[d],
+                                 self.district_populations[d], self.ties)
+            self.yellow_seats += seat - self.district_seats[d]
+            self.district_seats[d] = seat
+
+
+def create_districting_graph(G, districting):
+    '''
+    create_districting_graph, copy G and delete every conflicted edge, so
+    the connected components of the result are the districts. This is only
+    needed for plotting.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    districting: numpy array instance
+        The districting plan.
+
+    RETURNS:
+    ----------
+    G2: networkx graph instance
+        G without the edges joining two different districts.
+    '''
+    G2 = G.copy()
+    G2.remove_edges_from([(a, b) for (a, b) in G.edges()
+                          if districting[a] != districting[b]])
+    return G2
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+Frontier-based search for the partitions of a graph into k connected parts.
+
+A partition of the vertices of G into parts that induce connected subgraphs
+is the same thing as the set of edges of G that have both ends in the same
+part. We go through the edges of G one at a time and decide for each edge if
+it is inside a part (the 1-branch) or between two parts (the 0-branch). Only
+the vertices that have edges on both sides of the current edge (the frontier)
+matter for the rest of the decisions, so the state after each edge is
+    the parts of the frontier vertices, as restricted growth labels,
+    the pairs of frontier parts that have a 0-branch edge between them and so
+    must stay different parts,
+    the number of parts that have no frontier vertex left (closed parts).
+Equal states are merged, which gives a decision diagram with one layer per
+edge. A path from the root to the accepting node is exactly one partition
+into k connected parts.
+
+With populations and bounds [min_size, max_size] on the population of a
+part, the state also holds the population of every frontier part. A state is
+dropped as soon as a closed part is outside the bounds, an open part is over
+max_size, or the population that is left can not fill the parts still to come
+within the bounds, so only balanced partitions are ever built.
+
+Counting the partitions is a sum over the diagram and never lists them.
+While listing, the nodes that can not reach the accepting node are skipped,
+so every branch of the listing ends in a partition and the time to list is
+proportional to the number of partitions times the number of edges. The size
+of the diagram depends on the frontier, which for an n by n grid with the
+vertices in sorted order has about n vertices.
+
+Given symmetries of G (permutations of the vertices that map edges to
+edges, such as grid_symmetry.grid_symmetries), the listing can give one
+partition of every orbit instead of all of them. A partition is its 0/1
+vector of decisions, one per edge in the order they are decided, and a
+symmetry permutes the entries of that vector. Only the orbit member whose
+vector is the smallest (lexicographically) is listed: while a branch is
+followed, the decided entries are compared with those of every symmetric
+copy, and the branch is cut as soon as some copy is already known to be
+smaller, so the other members of the orbit are never built.
+"""
+
+import sys
+
+import networkx as nx
+import numpy as np
+
+from partitions import vertex_order, encode_partition
+
+
+def _edge_order(G, nodes):
+    position = {v: i for (i, v) in enumerate(nodes)}
+    return sorted(set((min(position[a], position[b]),
+                       max(position[a], position[b]))
+                      for (a, b) in G.edges() if a != b))
+
+
+def _canonical_state(labels, weights, forbidden, closed):
+    rename = {}
+    for x in labels:
+        if x not in rename:
+            rename[x] = len(rename)
+    labels = tuple(rename[x] for x in labels)
+    if weights is not None:
+        weights = tuple(weights[x] for x in sorted(rename, key=rename.get))
+    forbidden = tuple(sorted((min(rename[a], rename[b]),
+                              max(rename[a], rename[b]))
+                             for (a, b) in forbidden))
+    return (labels, weights, forbidden, closed)
+
+
+def population_array(G, populations=None):
+    '''
+    population_array, the populations of the vertices of G in the order of
+    partitions.vertex_order(G).
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    populations: dict or list instance
+        Either a dictionary from the vertices to their populations, or the
+        populations listed in the order of vertex_order(G). By default every
+        vertex has population 1, so the population of a part is its size.
+
+    RETURNS:
+    ----------
+    populations: numpy array instance
+        The populations.
+    '''
+    nodes = vertex_order(G)
+    if populations is None:
+        return np.ones(len(nodes), dtype=np.int64)
+    if isinstance(populations, dict):
+        populations = [populations[v] for v in nodes]
+    populations = np.asarray(populations)
+    if len(populations) != len(nodes):
+        raise ValueError('%d populations for %d vertices'
+                         % (len(populations), len(nodes)))
+    return populations
+
+
+class PartitionDiagram(object):
+    '''
+    PartitionDiagram, the decision diagram of the partitions of G into k
+    parts that induce connected subgraphs, see the module docstring.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    k: int instance
+        The number of parts.
+    populations: dict or list instance
+        The populations of the vertices, see population_array. Only used
+        with min_size or max_size.
+    min_size: number instance
+        The smallest population of a part, no bound by default.
+    max_size: number instance
+        The largest population of a part, no bound by default.
+
+    Attributes:
+    ----------
+    nodes: list instance
+        The vertices of G in the order of the encodings, see
+        partitions.vertex_order.
+    edges: list of tuples instance
+        The edges of G as pairs of positions in nodes, in the order they are
+        decided.
+    children: list of lists instance
+        children[i][j] = (lo, hi) are the nodes of layer i+1 reached from node
+        j of layer i by the 0-branch and the 1-branch of edges[i], None if the
+        branch can not give a partition into k connected parts. Layer 0 has
+        the root as node 0, layer len(edges) only has the accepting node.
+    counts: list of lists instance
+        counts[i][j] is the number of paths from node j of layer i to the
+        accepting node.
+    '''
+
+    def __init__(self, G, k, populations=None, min_size=None, max_size=None):
+        self.k = k
+        self.nodes = vertex_order(G)
+        self.edges = _edge_order(G, self.nodes)
+        # with bounds the state also holds the population of every frontier
+        # part; without them it is left out so that more states are equal
+        self.balanced = min_size is not None or max_size is not None
+        self.populations = population_array(G, populations)
+        self.min_size = -np.inf if min_size is None else min_size
+        self.max_size = np.inf if max_size is None else max_size
+        self.children = []
+        self.counts = []
+        self._build()
+        self._count()
+
+    def _build(self):
+        k = self.k
+        num_vertices = len(self.nodes)
+        num_edges = len(self.edges)
+        first = {}
+        last = {}
+        for (i, edge) in enumerate(self.edges):
+            for v in edge:
+                first.setdefault(v, i)
+                last[v] = i
+        # vertices without edges are parts of their own
+        isolated = [w for w in range(num_vertices) if w not in first]
+        populations = self.populations.tolist()
+        if self.balanced:
+            weights = ()
+            feasible = all(self.min_size <= populations[w] <= self.max_size
+                           for w in isolated)
+        else:
+            weights = None
+            feasible = True
+        feasible = feasible and len(isolated) <= k
+        if num_edges == 0:
+            feasible = feasible and len(isolated) == k
+        # the population of the vertices that have not entered the frontier
+        unseen_population = sum(populations[w] for w in first)
+
+        frontier = []
+        layer = {}
+        if feasible:
+            layer[((), weights, (), len(isolated))] = 0
+        for (i, (u, v)) in enumerate(self.edges):
+            entering = [w for w in (u, v) if first[w] == i]
+            frontier_in = frontier + entering
+            position = {w: p for (p, w) in enumerate(frontier_in)}
+            leaving = [p for (p, w) in enumerate(frontier_in) if last[w] == i]
+            keep = [p for (p, w) in enumerate(frontier_in) if last[w] != i]
+            frontier = [frontier_in[p] for p in keep]
+            # the vertices that have not entered the frontier yet
+            unseen = sum(1 for w in first if first[w] > i)
+            unseen_population -= sum(populations[w] for w in entering)
+            bounds = (unseen, unseen_population, i == num_edges - 1)
+
+            next_layer = {}
+            children = []
+            for state in sorted(layer, key=layer.get):
+                (labels, weights, forbidden, closed) = state
+                fresh = len(set(labels))
+                labels = list(labels) + list(range(fresh,
+                                                   fresh + len(entering)))
+                if weights is not None:
+                    weights = list(weights) + [populations[w]
+                                               for w in entering]
+                pair = []
+                for arc in (0, 1):
+                    child = self._step(labels, weights, forbidden, closed,
+                                       arc, position[u], position[v],
+                                       leaving, keep, bounds)
+                    if child is None:
+                        pair.append(None)
+                    else:
+                        pair.append(next_layer.setdefault(child,
+                                                          len(next_layer)))
+                children.append(tuple(pair))
+            self.children.append(children)
+            layer = next_layer
+        self._num_final = len(layer)
+
+    def _step(self, labels, weights, forbidden, closed, arc, pu, pv, leaving,
+              keep, bounds):
+        k = self.k
+        (unseen, unseen_population, is_last) = bounds
+        cu = labels[pu]
+        cv = labels[pv]
+        forbidden = set(forbidden)
+        if arc == 1:
+            if cu != cv:
+                if (min(cu, cv), max(cu, cv)) in forbidden:
+                    return None
+                labels = [cu if x == cv else x for x in labels]
+                forbidden = set((min(a, b), max(a, b)) for (a, b) in
+                                ((cu if a == cv else a, cu if b == cv else b)
+                                 for (a, b) in forbidden))
+                if weights is not None:
+                    weights = list(weights)
+                    weights[cu] += weights[cv]
+        else:
+            # an edge inside a part must be in the induced subgraph
+            if cu == cv:
+                return None
+            forbidden.add((min(cu, cv), max(cu, cv)))
+
+        kept = [labels[p] for p in keep]
+        closing = set(labels[p] for p in leaving) - set(kept)
+        closed += len(closing)
+        forbidden = [(a, b) for (a, b) in forbidden
+                     if a not in closing and b not in closing]
+        open_parts = len(set(kept))
+        # at least one more part is coming if anything is left, and at most
+        # every open part and every unseen vertex becomes a part of its own
+        if closed + (1 if open_parts + unseen > 0 else 0) > k:
+            return None
+        if closed + open_parts + unseen < k:
+            return None
+        if is_last and closed != k:
+            return None
+        if weights is not None:
+            # a closed part is finished, an open part can only grow, and the
+            # population that is left has to fill the parts still to come
+            if any(not self.min_size <= weights[x] <= self.max_size
+                   for x in closing):
+                return None
+            if any(weights[x] > self.max_size for x in set(kept)):
+                return None
+            left = sum(weights[x] for x in set(kept)) + unseen_population
+            parts_left = k - closed
+            if parts_left > 0 and not (parts_left * self.min_size <= left
+                                       <= parts_left * self.max_size):
+                return None
+        return _canonical_state(kept, weights, forbidden, closed)
+
+    def _count(self):
+        num_edges = len(self.edges)
+        counts = [None] * (num_edges + 1)
+        counts[num_edges] = [1] * self._num_final
+        if num_edges == 0:
+            # only the root, which is also the accepting node if it exists
+            self.counts = counts
+            return
+        for i in range(num_edges - 1, -1, -1):
+            below = counts[i + 1]
+            counts[i] = [(0 if lo is None else below[lo]) +
+                         (0 if hi is None else below[hi])
+                         for (lo, hi) in self.children[i]]
+        self.counts = counts
+
+    def count(self):
+        '''
+        count, the number of partitions of G into k connected parts.
+        '''
+        if len(self.counts[0]) == 0:
+            return 0
+        return self.counts[0][0]
+
+    def __iter__(self):
+        '''
+        Iterate over the partitions, each as the encoding of
+        partitions.encode_partition.
+        '''
+        return self.iter_partitions()
+
+    def edge_permutations(self, symmetries):
+        '''
+        edge_permutations, the symmetries of G as permutations of the edges.
+
+        Arguments:
+        ----------
+        symmetries: numpy array instance
+            Permutations of the positions in nodes: vertex i moves to
+            position symmetries[s, i]. They must map the edges of G onto the
+            edges of G, and each vertex to one of the same population.
+
+        RETURNS:
+        ----------
+        permutations: list of lists instance
+            permutations[s][e] is the edge that edges[e] is moved to, for
+            every symmetry of the group made by symmetries except the
+            identity.
+        '''
+        index = dict((edge, e) for (e, edge) in enumerate(self.edges))
+        generators = []
+        for permutation in np.asarray(symmetries):
+            if len(permutation) != len(self.nodes):
+                raise ValueError('the symmetries are for %d vertices, G has %d'
+                                 % (len(permutation), len(self.nodes)))
+            if (self.balanced and
+                    np.any(self.populations[permutation] != self.populations)):
+                raise ValueError('a permutation does not keep the populations')
+            moved = [index.get((min(permutation[a], permutation[b]),
+                                max(permutation[a], permutation[b])))
+                     for (a, b) in self.edges]
+            if None in moved:
+                raise ValueError('a permutation is not a symmetry of G')
+            generators.append(tuple(moved))
+        # every composition of the symmetries is one too; the listing needs
+        # all of them to keep exactly one partition of every orbit
+        identity = tuple(range(len(self.edges)))
+        group = set([identity])
+        todo = [identity]
+        while todo:
+            element = todo.pop()
+            for moved in generators:
+                product = tuple(moved[e] for e in element)
+                if product not in group:
+                    group.add(product)
+                    todo.append(product)
+        group.discard(identity)
+        return [list(element) for element in sorted(group)]
+
+    def iter_partitions(self, symmetries=None):
+        '''
+        iter_partitions, the partitions, each as the encoding of
+        partitions.encode_partition.
+
+        Arguments:
+        ----------
+        symmetries: numpy array instance
+            Symmetries of G, see edge_permutations. If given, only one
+            partition of every orbit is listed, see the module docstring.
+
+        RETURNS:
+        ----------
+        partitions: generator instance
+            The encoded partitions.
+        '''
+        if self.count() == 0:
+            return
+        num_vertices = len(self.nodes)
+        num_edges = len(self.edges)
+        counts = self.counts
+        permutations = []
+        if symmetries is not None:
+            permutations = self.edge_permutations(symmetries)
+        # decided[e] is the decision on edge e of the current branch
+        decided = [0] * num_edges
+        # depth first over the branches that lead to the accepting node; the
+        # 1-branch edges of a path are kept as a linked list (edge, rest) so
+        # that a branch does not copy the edges of its parent. pending holds
+        # (s, p) for every symmetry s whose copy is not known to be larger
+        # yet: the branch and the copy agree on the first p entries.
+        stack = [(0, 0, None, 0, tuple((s, 0)
+                                       for s in range(len(permutations))))]
+        while stack:
+            (i, j, chosen, arc, pending) = stack.pop()
+            if i > 0:
+                decided[i - 1] = arc
+            if len(pending) > 0:
+                pending = _compare_copies(decided, i, permutations, pending)
+                if pending is None:
+                    continue
+            if i == num_edges:
+                yield _labels_from_edges(num_vertices, chosen)
+                continue
+            (lo, hi) = self.children[i][j]
+            if hi is not None and counts[i + 1][hi] > 0:
+                stack.append((i + 1, hi, (self.edges[i], chosen), 1, pending))
+            if lo is not None and counts[i + 1][lo] > 0:
+                stack.append((i + 1, lo, chosen, 0, pending))
+
+
+def _compare_copies(decided, i, permutations, pending):
+    # Compare the first i decisions of a branch with those of its symmetric
+    # copies. The copy under the inverse of s has at entry p the decision on
+    # the edge that s moves edges[p] to, which is only known once that edge
+    # is decided. Returns the symmetries still undecided, or None if a copy
+    # is smaller.
+    still = []
+    for (s, p) in pending:
+        moved = permutations[s]
+        while p < i and moved[p] < i:
+            if decided[p] != decided[moved[p]]:
+                break
+            p += 1
+        else:
+            still.append((s, p))
+            continue
+        if decided[p] > decided[moved[p]]:
+            return None
+    return tuple(still)
+
+
+def _labels_from_edges(num_vertices, chosen):
+    parent = list(range(num_vertices))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    while chosen is not None:
+        ((u, v), chosen) = chosen
+        parent[find(u)] = find(v)
+    return encode_partition([find(x) for x in range(num_vertices)])
+
+
+def count_connected_partitions(G, k, populations=None, min_size=None,
+                               max_size=None):
+    '''
+    count_connected_partitions, the number of partitions of the vertices of G
+    into k parts that induce connected subgraphs, without listing them.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    k: int instance
+        The number of parts.
+    populations, min_size, max_size:
+        Only count the partitions whose parts have populations between
+        min_size and max_size, see PartitionDiagram.
+
+    RETURNS:
+    ----------
+    count: int instance
+        The number of partitions.
+    '''
+    return PartitionDiagram(G, k, populations, min_size, max_size).count()
+
+
+def iter_connected_partitions(G, k, populations=None, min_size=None,
+                              max_size=None, symmetries=None):
+    '''
+    iter_connected_partitions, list the partitions of the vertices of G into
+    k parts that induce connected subgraphs one at a time.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    k: int instance
+        The number of parts.
+    populations, min_size, max_size:
+        Only list the partitions whose parts have populations between
+        min_size and max_size, see PartitionDiagram.
+    symmetries: numpy array instance
+        Symmetries of G, e.g. grid_symmetry.grid_symmetries(n). If given,
+        only one partition of every orbit is listed, and the others are not
+        built at all, see the module docstring.
+
+    RETURNS:
+    ----------
+    partitions: generator instance
+        The partitions, each encoded by partitions.encode_partition over the
+        vertices in partitions.vertex_order(G).
+    '''
+    diagram = PartitionDiagram(G, k, populations, min_size, max_size)
+    return diagram.iter_partitions(symmetries)
+
+
+if __name__ == '__main__':
+    # python frontier_search.py n k [min_size max_size] prints the number of
+    # partitions of the n by n grid into k connected parts
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else n
+    min_size = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    max_size = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    G = nx.grid_2d_graph(n, n)
+    print('%d by %d grid, %d parts:' % (n, n, k),
+          count_connected_partitions(G, k, None, min_size, max_size))
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+The RRG of an n by n grid up to the symmetries of the square.
+
+The n by n grid (create_base_graph_n_by_n in build_graphs.py, or
+networkx.grid_2d_graph) is unchanged by the 8 rotations and reflections of
+the square. A symmetry maps every partition into k connected parts to another
+one and every edge of the RRG to another edge, so it is enough to keep one
+partition of every orbit, the representative, which is the orbit member with
+the smallest encoding. The quotient RRG has the representatives as vertices;
+representatives r and s are joined with multiplicity m when m of the single
+vertex moves of r give a partition in the orbit of s. That loses nothing:
+    every vertex of the full RRG is a symmetric copy of a representative,
+    and its neighbors are the same copies of the representative's neighbors,
+so the full RRG can be rebuilt from the quotient with expand_partitions and
+rrg_store.iter_rrg_edges. Since most orbits have 8 members, the quotient
+takes close to 8 times less storage.
+
+By default the partitions come from frontier_search.iter_connected_partitions
+with the symmetries, which lists one partition of every orbit and cuts the
+branches of the search that can only lead to the other members, so the
+enumeration is shorter as well. orbit_representatives then maps every listed
+partition to the representative of its orbit. A stream of whole orbits, e.g.
+the partitions listed without symmetries, works too.
+
+The vertices of the grid are numbered in sorted order, which for both
+labellings of the grid is row by row.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from partitions import vertex_order, label_dtype
+from rrg_store import (base_edges, canonical_rows, partition_table,
+                       single_vertex_moves, table_keys)
+
+QuotientRRG = namedtuple('QuotientRRG', ['representatives', 'orbit_sizes',
+                                         'edges', 'multiplicities'])
+
+
+def grid_symmetries(n):
+    '''
+    grid_symmetries, the 8 symmetries of the n by n grid as permutations of
+    the vertex positions.
+
+    Arguments:
+    ----------
+    n: int instance
+        the dimensions of the n by n grid.
+
+    RETURNS:
+    ----------
+    symmetries: numpy array instance
+        Shape (8, n**2). The symmetry s moves the vertex in position i to
+        position symmetries[s, i]. symmetries[0] is the identity.
+    '''
+    (r, c) = np.divmod(np.arange(n * n), n)
+    m = n - 1
+    images = [(r, c), (c, m - r), (m - r, m - c), (m - c, r),
+              (r, m - c), (m - r, c), (c, r), (m - c, m - r)]
+    return np.array([row * n + column for (row, column) in images])
+
+
+def check_symmetries(G, symmetries):
+    '''
+    check_symmetries, raise ValueError unless every permutation in
+    symmetries maps the edges of G onto the edges of G.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    symmetries: numpy array instance
+        The permutations of the positions, see grid_symmetries.
+
+    RETURNS:
+    ----------
+    None
+    '''
+    nodes = vertex_order(G)
+    edges = base_edges(G)
+    if symmetries.shape[1] != len(nodes):
+        raise ValueError('the symmetries are for %d vertices, G has %d'
+                         % (symmetries.shape[1], len(nodes)))
+    keys = set(map(tuple, edges.tolist()))
+    for permutation in symmetries:
+        images = np.sort(permutation[edges], axis=1)
+        if set(map(tuple, images.tolist())) != keys:
+            raise ValueError('a permutation is not a symmetry of G')
+
+
+def _images(labels, symmetries, k):
+    # The canonical labels of every symmetric copy of every row, shape
+    # (number of symmetries, rows, vertices). Vertex i moves to position
+    # symmetries[s, i], so the copy has at position j the label of the
+    # vertex that moved there.
+    inverses = np.argsort(symmetries, axis=1)
+    return np.stack([canonical_rows(labels[:, inverse], k)
+                     for inverse in inverses])
+
+
+def _smallest(keys):
+    # the smallest key in every column; numpy has no minimum for byte strings
+    smallest = keys[0]
+    for other in keys[1:]:
+        smallest = np.where(other < smallest, other, smallest)
+    return smallest
+
+
+def partition_orbit(partition, symmetries):
+    '''
+    partition_orbit, all the symmetric copies of an encoded partition.
+
+    Arguments:
+    ----------
+    partition: bytes instance
+        The encoding.
+    symmetries: numpy array instance
+        The permutations of the positions, see grid_symmetries.
+
+    RETURNS:
+    ----------
+    orbit: list of bytes instance
+        The distinct encodings of the copies, sorted; orbit[0] is the
+        representative.
+    '''
+    num_vertices = symmetries.shape[1]
+    labels = np.frombuffer(partition, dtype=label_dtype(num_vertices))
+    labels = labels.astype(np.int64).reshape(1, -1)
+    images = _images(labels, symmetries, int(labels.max()) + 1)
+    images = images[:, 0].astype(label_dtype(num_vertices))
+    return sorted(set(row.tobytes() for row in images))
+
+
+def orbit_representatives(partitions, symmetries, batch_size=4096):
+    '''
+    orbit_representatives, the representative of the orbit of every
+    partition of a stream.
+
+    Arguments:
+    ----------
+    partitions: iterable of bytes instance
+        The encoded partitions.
+    symmetries: numpy array instance
+        The permutations of the positions, see grid_symmetries.
+    batch_size: int instance
+        The number of partitions handled at once.
+
+    RETURNS:
+    ----------
+    representatives: iterator of tuples instance
+        (partition, representative, orbit size) for every partition, in the
+        order of the stream.
+    '''
+    num_vertices = symmetries.shape[1]
+    dtype = label_dtype(num_vertices)
+    batch = []
+    for partition in partitions:
+        batch.append(partition)
+        if len(batch) == batch_size:
+            for result in _batch_representatives(batch, symmetries, dtype):
+                yield result
+            batch = []
+    for result in _batch_representatives(batch, symmetries, dtype):
+        yield result
+
+
+def filter_orbit_representatives(partitions, symmetries, batch_size=4096):
+    '''
+    filter_orbit_representatives, keep only the representative of every
+    orbit from a stream of partitions that contains whole orbits, e.g.
+    frontier_search.iter_connected_partitions without symmetries.
+
+    RETURNS:
+    ----------
+    representatives: iterator of tuples instance
+        (representative, orbit size) for every orbit.
+    '''
+    for (partition, representative, orbit_size) in orbit_representatives(
+            partitions, symmetries, batch_size):
+        if partition == representative:
+            yield (representative, orbit_size)
+
+
+def _batch_representatives(batch, symmetries, dtype):
+    if len(batch) == 0:
+        return
+    num_vertices = symmetries.shape[1]
+    labels = np.frombuffer(b''.join(batch), dtype=dtype)
+    labels = labels.reshape(-1, num_vertices).astype(np.int64)
+    k = int(labels[0].max()) + 1
+    images = _images(labels, symmetries, k).astype(dtype)
+    keys = np.stack([table_keys(image) for image in images])
+    # the representative is the copy with the smallest key
+    smallest = _smallest(keys)
+    which = np.argmax(keys == smallest, axis=0)
+    for row in range(len(batch)):
+        orbit_size = len(set(keys[:, row].tolist()))
+        yield (batch[row], images[which[row], row].tobytes(), orbit_size)
+
+
+def quotient_rrg(G, k, symmetries, partitions=None, batch_size=1024):
+    '''
+    quotient_rrg, the RRG of the partitions of G into k connected parts up to
+    the symmetries of G, stored with one vertex per orbit and enumerated
+    one partition per orbit, see the module docstring.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    k: int instance
+        The number of parts.
+    symmetries: numpy array instance
+        The permutations of the positions, see grid_symmetries. Checked with
+        check_symmetries.
+    partitions: iterable of bytes instance
+        The encoded partitions, at least one of every orbit, by default
+        frontier_search.iter_connected_partitions(G, k,
+        symmetries=symmetries).
+    batch_size: int instance
+        The number of partitions handled at once.
+
+    RETURNS:
+    ----------
+    quotient: QuotientRRG instance
+        representatives: the table of labels of the representatives, sorted
+            by encoding, see rrg_store.partition_table.
+        orbit_sizes: the size of the orbit of each representative.
+        edges: int32 rows (ri, rj), ordered pairs of representatives, which
+            can be equal.
+        multiplicities: the number of single vertex moves of ri that give a
+            partition in the orbit of rj. They add up to the degree of ri in
+            the full RRG.
+    '''
+    check_symmetries(G, symmetries)
+    if partitions is None:
+        from frontier_search import iter_connected_partitions
+        partitions = iter_connected_partitions(G, k, symmetries=symmetries)
+    num_vertices = symmetries.shape[1]
+    dtype = label_dtype(num_vertices)
+    sizes = {}
+    for (_, representative, orbit_size) in orbit_representatives(partitions,
+                                                                 symmetries):
+        sizes[representative] = orbit_size
+    representatives = partition_table(list(sizes), num_vertices)
+    orbit_sizes = np.array([sizes[row.tobytes()] for row in representatives],
+                           dtype=np.int64)
+    keys = table_keys(representatives)
+
+    edges_of_G = base_edges(G)
+    edges = []
+    multiplicities = []
+    for start in range(0, len(representatives), batch_size):
+        (rows, moved) = single_vertex_moves(
+            representatives[start:start + batch_size], edges_of_G, k)
+        # a move that keeps k parts gives a member of some orbit; look up
+        # the representative of that orbit
+        valid = moved.max(axis=1) == k - 1
+        (rows, moved) = (rows[valid], moved[valid])
+        images = _images(moved, symmetries, k).astype(dtype)
+        image_keys = np.stack([table_keys(image) for image in images])
+        smallest = _smallest(image_keys)
+        position = np.searchsorted(keys, smallest)
+        position[position == len(keys)] = 0
+        hit = keys[position] == smallest
+        pairs = np.stack([rows[hit] + start, position[hit]], axis=1)
+        (pairs, counts) = np.unique(pairs, axis=0, return_counts=True)
+        edges.append(pairs)
+        multiplicities.append(counts)
+    if len(edges) == 0:
+        edges = np.zeros((0, 2), dtype=np.int32)
+        multiplicities = np.zeros(0, dtype=np.int64)
+    else:
+        edges = np.concatenate(edges).astype(np.int32)
+        multiplicities = np.concatenate(multiplicities).astype(np.int64)
+    return QuotientRRG(representatives=representatives,
+                       orbit_sizes=orbit_sizes, edges=edges,
+                       multiplicities=multiplicities)
+
+
+def expand_partitions(quotient, symmetries):
+    '''
+    expand_partitions, all the partitions of the full RRG, rebuilt from the
+    representatives of a quotient.
+
+    Arguments:
+    ----------
+    quotient: QuotientRRG instance
+        The quotient made by quotient_rrg.
+    symmetries: numpy array instance
+        The same symmetries.
+
+    RETURNS:
+    ----------
+    partitions: iterator of bytes instance
+        The encodings of the members of every orbit. Use
+        rrg_store.partition_table and rrg_store.iter_rrg_edges, or
+        rrg_store.write_rrg_store with partitions=..., for the full RRG.
+    '''
+    for row in quotient.representatives:
+        for partition in partition_orbit(row.tobytes(), symmetries):
+            yield partition
@@ -13,9 +13,14 @@ Note: it might be a good idea to use 9 or 11 instead of 10 so there are no ties.
 import networkx as nx
 import math
 import numpy as np
-import copy
 import random
+import tempfile
 import matplotlib.pyplot as plt # only used for the histogram at the end
+from csr_graph import create_csr_graph_n_by_n, csr_graph_to_networkx
+from ensemble_store import create_ensemble_store
+from flip_walk import ChainState, create_districting_graph
+from streaming_stats import WalkSummary
+from seat_tally import tally_scenarios, uniform_swing_scenarios
 
 def create_graph_n_by_n(n):
     '''
@@ -70,13 +75,13 @@ def create_initial_districting(n):
     districting: list of lists instance
         Each sub-list represents the vertices in a district
     '''
-    districting=np.zeros(n**2,dtype=np.int)
+    districting=np.zeros(n**2,dtype=int)
     for i in range(n**2):
         my_column=i%n
         districting[i]=my_column
     return districting
     
-def create_party_assignment_n_10():
+def create_party_assignment_n_10(n=10):
     '''
     create_party_assignment_n_10, each vertex in the base graph represents
     a precinct in our map. Each vertex has voted for either the Yellow party (1)
@@ -84,6 +89,8 @@ def create_party_assignment_n_10():
 
     Arguments:
     ----------
+    n: int instance
+        the dimensions of the n by n grid. The votes are only given for n=10.
     
     RETURNS:
     ----------
@@ -91,7 +98,7 @@ def create_party_assignment_n_10():
         This n**2 list represents the vote for each vertex in the n by n grid.
         In the future, this should be randomized with a fixed seed.
     '''
-    party_assignment=np.zeros(n**2,dtype=np.int)
+    party_assignment=np.zeros(n**2,dtype=int)
     yellow_list=[2,3,4,5,6,7,19,20,22,23,24,28,29,31,32,35,36,37,40,41,47,49,50,54,59,60,62,63,64,66,70,72,79,80,84,85,89,93,98,99]
     for i in range(len(yellow_list)):
         party_assignment[yellow_list[i]]=1
@@ -101,94 +108,104 @@ def create_party_assignment_n_10():
 if __name__ == '__main__':
     num_proposals=10000 # number of proposal steps to try
     n=10 # length/width of grid
-    G=create_graph_n_by_n(n)
-    all_edges=list(G.edges())
+    streaming=False # if True, keep only the current plan and the summary statistics, not the plans
+    store_dir=None # folder the plans are stored in; None uses a temporary folder that is removed at the end
+    # the walk runs on the array-backed graph, G is only used for plotting
+    graph=create_csr_graph_n_by_n(n,diagonals=False)
+    G=csr_graph_to_networkx(graph)
+    all_edges=graph.edges
     m=len(all_edges) # number of edges
 
-    districtings=[] # array where each row is a districting plan
     districting=create_initial_districting(n) # gets an initial districting plan
-    districtings.append(districting)
+    # 'districtings' holds every plan of the walk. Each accepted step is saved
+    # on disk as the moves it made, plus a full copy of every 1000th plan, so
+    # memory use does not grow with the number of steps.
+    if(not streaming):
+        if(store_dir is None):
+            temporary_store=tempfile.TemporaryDirectory()
+            districtings=create_ensemble_store(temporary_store.name,districting)
+        else:
+            districtings=create_ensemble_store(store_dir,districting)
     
 
+    # 'state' keeps the district sizes, the conflicted edges and the votes and
+    # seats of every district up to date as the walk moves, so the Yellow
+    # seats of the current plan are known at every step. A district is won by
+    # the party with more than half of its vertices, ties go to the Green
+    # party (use ties='yellow' or ties='half' to change that).
+    party_assignment=create_party_assignment_n_10()
+    state=ChainState(graph,districting,n,party_assignment,ties='green')
+    cut_edges=state.cut_edges # the conflicted edges
+    # 'summary' holds the seat histogram and running statistics of the plans
+    # visited so far, it is updated after every accepted step.
+    summary=WalkSummary(n)
+    summary.update(state)
+
     for k in range(num_proposals):
         # 'districting' is the current districting plan
-        proposed_districting=copy.deepcopy(districting)
         # propose a change to the current districting
-        # What I am doing here is choosing a random edge until I find a
-        # conflicted edge, then I swap the districts of the 2 nodes.
-        conflicted_edge_not_found=True
-        while(conflicted_edge_not_found):
-            r=random.randint(0,m-1)
-            r2=random.randint(0,1)
-            edge=all_edges[r]
-            r_a=edge[0]
-            r_b=edge[1]
-            if(districting[r_a]!=districting[r_b]):
-                conflicted_edge_not_found=False
+        # What I am doing here is choosing a random conflicted edge, then I
+        # move one of the 2 nodes into the district of the other one.
+        # cut_edges holds exactly the conflicted edges, so this is the same
+        # as drawing random edges until a conflicted one comes up, without
+        # the wasted draws.
+        edge=all_edges[cut_edges.sample(random)]
+        r2=random.randint(0,1)
+        r_a=edge[0]
+        r_b=edge[1]
         if r2==0:
-            proposed_districting[r_a]=districting[r_b]
+            moves=[(r_a,districting[r_a],districting[r_b])]
         else:
-            proposed_districting[r_b]=districting[r_a]            
+            moves=[(r_b,districting[r_b],districting[r_a])]
         
         
-        # What I am doing here is for each proposed districting plan, I make a
-        # copy of the full adjacency graph G and I delete the conflicted edges.
-        # Then I ask networkx to find the connected components of this new
-        # graph, G2. If each of the connected components has n members, the
-        # plan is valid, so then it is added to the array 'districtings', and
-        # then my current 'districting' is overwritten by this valid 
-        # 'proposed_districting'. Making a copy of G is extremely inefficient,
-        # but easier than keeping track of which edges change whether they are
-        # conflicted or not.
-        G2=G.copy()
-        G2_edges=list(G2.edges())
-        for edge in G2_edges:
-            a=edge[0]
-            b=edge[1]
-            if proposed_districting[a]!=proposed_districting[b]:
-                G2.remove_edge(edge[0],edge[1])
-        proposed_districts=list(nx.connected_components(G2))
-        proposed_plan_valid=True
-        # This will print the last 4 graphs representing the redistrictings.
-        for district in proposed_districts:
-            if(len(district)<n-1 or len(district)>n+1):
-                proposed_plan_valid=False
+        # Only the donor and the receiving district can change. The receiver
+        # stays connected since the moved vertex is adjacent to it, and the
+        # donor is checked by proposal_is_valid with a local BFS around the
+        # moved vertex, so we never copy G or recompute all of the connected
+        # components. The sizes of the two districts are read from
+        # district_sizes, which is updated when a plan is accepted.
+        proposed_plan_valid=state.is_valid(moves,n-1,n+1)
         if(proposed_plan_valid):
+            state.apply(moves)
             # When we are near the end of this for loop, plot the last few
             # districtings for examination purposes.
             if(k>num_proposals-5):
                 plt.figure(k)
+                G2=create_districting_graph(G,districting)
                 nx.draw(G2,pos=nx.spring_layout(G,dim=2,iterations=100),with_labels=True,node_size=10)
-            districting=proposed_districting
-            districtings.append(districting)
+            if(not streaming):
+                districtings.append(moves)
+            summary.update(state)
 ##    If we want to print the graphs we found, run the following line of code.
 #    plt.savefig('redistricting_graph.svg', format='svg', dpi=1000)
     plt.show()
             
     if(n==10):
-        num_plans=len(districtings)
-        # party_counts gives the number of yellow nodes in each districting
-        # for each plan in the ensemble 'districtings'
-        party_counts=np.zeros((num_plans,n),dtype=np.int)
-        party_assignment=create_party_assignment_n_10()
-        num_yellow_seats=np.zeros(num_plans,dtype=np.int)
-        for k in range(num_plans):
-            for i in range(n**2):
-                my_party=party_assignment[i]
-                my_district=districtings[k][i]
-                party_counts[k,my_district]+=my_party
-            for j in range(n):
-                if party_counts[k,j]>n/2: #if n=10, ties go to the yellow, (make an example with n=9 or 11?)
-                    num_yellow_seats[k]+=1
 #        Print the number of districtings that we found that worked.
-        print(len(num_yellow_seats))
+        print(summary.num_plans)
+        print('Yellow seats: mean',summary.seats.mean,'variance',summary.seats.variance)
 #        plt.ylim(ymin=0, ymax =3)
         bins = np.arange(0,5,0.5)-.175
         width=0.7*(bins[1]-bins[0])
         plt.ylabel('Frequency')
         plt.xlabel('Number of districts (out of 10) for Yellow party')
 #        plt.yticks(range(0,3))
-        plt.hist(num_yellow_seats,bins=bins,width=width) # the histogram it makes is ugly, but you get the idea
+        seat_values,seat_counts=summary.seat_values()
+        plt.hist(seat_values,bins=bins,weights=seat_counts,width=width) # the histogram it makes is ugly, but you get the idea
 ##        If we want to print the histogram, run the following line of code.
 #        plt.savefig('redistricting_graph_hist1.png', format='png', dpi=1000)
-        plt.show()
\ No newline at end of file
+        plt.show()
+        # Score the stored plans against uniform swings of the vote: 'seats'
+        # has one row per plan and one column per swing, all computed with
+        # one sparse product per chunk of plans.
+        if(not streaming):
+            swings=np.linspace(-0.2,0.2,9)
+            scenarios=uniform_swing_scenarios(party_assignment,swings)
+            seats=tally_scenarios(districtings,scenarios,n,ties='green')
+            for swing,column in zip(swings,seats.T):
+                print('Yellow swing %+.2f: mean seats %.3f' % (swing,column.mean()))
+    if(not streaming):
+        districtings.close()
+        if(store_dir is None):
+            temporary_store.cleanup()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Compact canonical encoding of vertex partitions of a base graph.
+
+The vertices of the base graph G are numbered by their position in
+sorted(G.nodes()). A partition is stored as its label array in restricted
+growth form: vertex 0 is in part 0, and every other vertex is either in a part
+that already appeared before it or in the next new part. Every partition has
+exactly one such label array, so two partitions are equal exactly when their
+encodings are equal, and the encodings can be used as dictionary keys. The
+label array is packed into a bytes object, one byte per vertex (two bytes per
+vertex when G has more than 256 vertices).
+"""
+
+import numpy as np
+
+
+def vertex_order(G):
+    '''
+    vertex_order, the vertices of G in the order used by the encodings.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+
+    RETURNS:
+    ----------
+    nodes: list instance
+        sorted(G.nodes()).
+    '''
+    return sorted(G.nodes())
+
+
+def label_dtype(num_vertices):
+    '''
+    label_dtype, the numpy type of the labels in the encodings of the
+    partitions of a graph with num_vertices vertices.
+    '''
+    return np.uint8 if num_vertices <= 256 else np.uint16
+
+
+def canonical_labels(labels):
+    '''
+    canonical_labels, renumber the parts of a label array in order of first
+    appearance (restricted growth form).
+
+    Arguments:
+    ----------
+    labels: array-like instance
+        labels[i] is the part of the i-th vertex, any hashable part names.
+
+    RETURNS:
+    ----------
+    canonical: numpy array instance
+        The renumbered labels.
+    '''
+    labels = np.asarray(labels)
+    uniques, first, inverse = np.unique(labels, return_index=True,
+                                        return_inverse=True)
+    rank = np.empty(len(uniques), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(uniques))
+    return rank[inverse.ravel()]
+
+
+def encode_partition(labels):
+    '''
+    encode_partition, the canonical bytes encoding of a partition.
+
+    Arguments:
+    ----------
+    labels: array-like instance
+        labels[i] is the part of the i-th vertex.
+
+    RETURNS:
+    ----------
+    partition: bytes instance
+        The encoding.
+    '''
+    labels = canonical_labels(labels)
+    return labels.astype(label_dtype(len(labels))).tobytes()
+
+
+def decode_partition(partition, num_vertices):
+    '''
+    decode_partition, the label array of an encoded partition.
+
+    Arguments:
+    ----------
+    partition: bytes instance
+        The encoding made by encode_partition.
+    num_vertices: int instance
+        The number of vertices of the base graph.
+
+    RETURNS:
+    ----------
+    labels: numpy array instance
+        labels[i] is the part of the i-th vertex, a read-only view.
+    '''
+    return np.frombuffer(partition, dtype=label_dtype(num_vertices))
+
+
+def partition_parts(partition, nodes):
+    '''
+    partition_parts, the parts of an encoded partition as sets of vertices.
+
+    Arguments:
+    ----------
+    partition: bytes instance
+        The encoding.
+    nodes: list instance
+        The vertices of the base graph in encoding order, see vertex_order.
+
+    RETURNS:
+    ----------
+    parts: list of sets instance
+        parts[j] is the set of vertices in part j.
+    '''
+    labels = decode_partition(partition, len(nodes))
+    parts = [set() for j in range(int(labels.max()) + 1)]
+    for (i, label) in enumerate(labels):
+        parts[label].add(nodes[i])
+    return parts
+
+
+def partition_edges(partition, G, nodes):
+    '''
+    partition_edges, the edges of G inside the parts of a partition, i.e. the
+    subgraph of G with one induced component per part.
+
+    Arguments:
+    ----------
+    partition: bytes instance
+        The encoding.
+    G: networkx graph instance
+        The base graph.
+    nodes: list instance
+        The vertices of G in encoding order, see vertex_order.
+
+    RETURNS:
+    ----------
+    edges: list of tuples instance
+        The edges of G whose endpoints are in the same part.
+    '''
+    labels = decode_partition(partition, len(nodes))
+    position = {v: i for (i, v) in enumerate(nodes)}
+    return [(a, b) for (a, b) in G.edges()
+            if labels[position[a]] == labels[position[b]]]
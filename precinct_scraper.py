@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Precinct results of the counties of a Clarity election site, in parallel.
+
+The precinct page md_data.html of a county is filled in by Javascript, so
+elections_2016GA_final.py used to start a new headless browser for every
+page. Here
+    a BrowserPool keeps at most size browsers alive and lends them out, so a
+    browser is started once and renders many pages, and a browser that
+    fails is quit and replaced by a new one,
+    the page is not rendered at all when the JSON file the page is built
+    from (json/details.json of the version of the county) is there: the
+    precinct table is then built from the JSON directly, and the page is
+    only rendered when the file is missing (404) or does not have the
+    contest,
+    PrecinctScraper.scrape_all scrapes many counties at once with a pool of
+    threads, as many as there are browsers, and records the counties that
+    fail as county_downloader.DownloadError.
+The browsers are made by a factory function, by default default_browser, so
+the pool can be tested with stand-in browsers and a local page server.
+
+Both ways give the same precinct table: the columns are labelled 1, 2, ...
+as pandas.read_html labels the table of the page once its first column is
+dropped, column 1 is the name of the precinct, the next columns are the
+votes of every choice in the order of the page and the last column is the
+total of the precinct. The votes are integers and the rows are numbered
+from 0.
+"""
+
+import io
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from county_downloader import (DownloadError, FetchError, county_url_name,
+                               write_errors)
+
+
+def default_browser():
+    '''
+    default_browser, a new headless browser: PhantomJS as before when the
+    installed selenium still has it, otherwise headless Chrome.
+    '''
+    from selenium import webdriver
+    if hasattr(webdriver, 'PhantomJS'):
+        wd = webdriver.PhantomJS()
+    else:
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless')
+        wd = webdriver.Chrome(options=options)
+    wd.set_window_size(1120, 550)
+    wd.set_page_load_timeout(30)
+    return wd
+
+
+class BrowserPool(object):
+    '''
+    BrowserPool, a bounded pool of long-lived browsers.
+
+    Arguments:
+    ----------
+    size: int instance
+        The largest number of browsers alive at the same time.
+    factory: function instance
+        Makes a new browser, an object with get(url), page_source and
+        quit(), e.g. a selenium webdriver. By default default_browser.
+    '''
+
+    def __init__(self, size=4, factory=None):
+        self.size = size
+        self.factory = factory if factory is not None else default_browser
+        self._idle = queue.LifoQueue()
+        # a slot for every browser that may be in use
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _discard(self, wd):
+        try:
+            wd.quit()
+        except Exception:
+            pass
+
+    def render(self, url):
+        '''
+        render, load url in a browser of the pool and return the HTML after
+        the Javascript ran. A browser that raises is quit and replaced by a
+        new one the next time a browser is needed.
+        '''
+        with self._slots:
+            try:
+                wd = self._idle.get_nowait()
+            except queue.Empty:
+                wd = self.factory()
+            try:
+                wd.get(url)
+                html_page = wd.page_source
+            except Exception:
+                self._discard(wd)
+                raise
+            self._idle.put(wd)
+        return html_page
+
+    def close(self):
+        '''
+        close, quit the idle browsers.
+        '''
+        while True:
+            try:
+                wd = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(wd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MissingContest(KeyError):
+    '''
+    MissingContest, the contest is not in the details.json of a county.
+    '''
+
+
+def _precinct_frame(rows):
+    # the common form of the precinct tables, see the module docstring
+    table = pd.DataFrame(rows)
+    table.columns = range(1, table.shape[1] + 1)
+    table[1] = table[1].astype(str)
+    for column in table.columns[1:]:
+        table[column] = pd.to_numeric(
+            table[column].astype(str).str.replace(',', '')).astype('int64')
+    return table
+
+
+def html_to_precinct_table(html_page):
+    '''
+    html_to_precinct_table, the precinct table of a rendered md_data.html.
+
+    Arguments:
+    ----------
+    html_page: str instance
+        The HTML of the page.
+
+    RETURNS:
+    ----------
+    relevant_table: pandas DataFrame instance
+        The last table of the page without its first column, its header row
+        and the 'Total:' and 'Precinct' rows, in the form of the module
+        docstring.
+    '''
+    #use pandas built-in functionality to scrape all tables
+    all_tables = pd.read_html(io.StringIO(html_page))
+    #in all the examples I looked at, the relevant table was the last one
+    relevant_table = all_tables[-1]
+    relevant_table = relevant_table.drop(relevant_table.columns[[0]], axis=1)
+    relevant_table = relevant_table.drop(relevant_table.index[0])
+    relevant_table = relevant_table[~relevant_table[1].str.contains('Total:')]
+    relevant_table = relevant_table[~relevant_table[1].str.contains('Precinct')]
+    return _precinct_frame(relevant_table.values.tolist())
+
+
+def details_json_to_precinct_table(details, cid_num):
+    '''
+    details_json_to_precinct_table, the precinct table of a contest from
+    the details.json of a county.
+
+    Arguments:
+    ----------
+    details: dict instance
+        The parsed details.json; its 'Contests' have the contest key 'K',
+        the precincts 'P', the choices 'CH' and the votes 'V', a list of
+        votes per choice for every precinct.
+    cid_num: str instance
+        The contest, as in the cid of md_data.html.
+
+    RETURNS:
+    ----------
+    table: pandas DataFrame instance
+        One row per precinct: the precinct, the votes of every choice and
+        the total, in the form of the module docstring, the same as
+        html_to_precinct_table gives for the page of the contest. Raises
+        MissingContest if the contest is not in details.
+    '''
+    for contest in details['Contests']:
+        if str(contest.get('K', contest.get('Cid'))) == str(cid_num):
+            break
+    else:
+        raise MissingContest('contest %s is not in the details' % cid_num)
+    rows = [[precinct] + list(votes) + [sum(votes)]
+            for (precinct, votes) in zip(contest['P'], contest['V'])]
+    return _precinct_frame(rows)
+
+
+class PrecinctScraper(object):
+    '''
+    PrecinctScraper, the precinct tables of many counties, see the module
+    docstring.
+
+    Arguments:
+    ----------
+    downloader: county_downloader.CountyDownloader instance
+        Gives the prefix of the site, the HTTP client and the cache for the
+        versions and the JSON files.
+    pool: BrowserPool instance
+        The browsers for the pages without usable JSON, by default a pool of
+        4 browsers of default_browser.
+    use_json: bool instance
+        Read json/details.json when it is there instead of rendering.
+    '''
+
+    def __init__(self, downloader, pool=None, use_json=True):
+        self.downloader = downloader
+        self.pool = pool if pool is not None else BrowserPool()
+        self.use_json = use_json
+
+    def page_url(self, county_name, eid_num, version, cid_num):
+        '''
+        page_url, the url of md_data.html of a contest.
+        '''
+        return '%s%s/%s/%s/en/md_data.html?cid=%s' % (
+            self.downloader.prefix, county_url_name(county_name), eid_num,
+            version, cid_num)
+
+    def json_url(self, county_name, eid_num, version):
+        '''
+        json_url, the url of details.json of a version.
+        '''
+        return '%s%s/%s/%s/json/details.json' % (
+            self.downloader.prefix, county_url_name(county_name), eid_num,
+            version)
+
+    def _details(self, county_name, eid_num, version):
+        url = self.json_url(county_name, eid_num, version)
+        cache = self.downloader.cache
+        if cache is None:
+            data = self.downloader.client.get(url).body
+        else:
+            data = cache.file(self.downloader.client, url,
+                              county_url_name(county_name), eid_num, version)
+        return json.loads(data.decode('UTF-8'))
+
+    def scrape(self, county_name, eid_num, cid_num):
+        '''
+        scrape, the precinct table of one contest of the current version of
+        one county, from the JSON if possible, otherwise from the rendered
+        page.
+
+        RETURNS:
+        ----------
+        table: pandas DataFrame instance
+            The table, or None.
+        error: DownloadError instance
+            What went wrong, or None.
+        '''
+        try:
+            version = self.downloader.current_version(county_name, eid_num)
+        except FetchError as error:
+            return None, DownloadError(county_name, error.url, 'version',
+                                       error.message, error.attempts)
+        except Exception as error:
+            url = self.downloader.version_url(county_name, eid_num)
+            return None, DownloadError(county_name, url, 'version',
+                                       repr(error), 1)
+        return self._scrape_version(county_name, eid_num, version, cid_num)
+
+    def scrape_url(self, precinct_URL):
+        '''
+        scrape_url, the precinct table of the page precinct_URL, a
+        md_data.html url as made by page_url, in the same way as scrape.
+
+        RETURNS:
+        ----------
+        table: pandas DataFrame instance
+            The table, or None.
+        error: DownloadError instance
+            What went wrong, or None.
+        '''
+        parts = urlsplit(precinct_URL)
+        prefix_path = urlsplit(self.downloader.prefix).path
+        path = parts.path[len(prefix_path):].split('/')
+        cid_num = parse_qs(parts.query).get('cid', [None])[0]
+        if (not parts.path.startswith(prefix_path) or len(path) < 4
+                or cid_num is None):
+            return None, DownloadError(None, precinct_URL, 'url',
+                                       'not a md_data.html url of the site', 1)
+        return self._scrape_version(path[0], path[1], path[2], cid_num)
+
+    def _scrape_version(self, county_name, eid_num, version, cid_num):
+        stage = 'json'
+        url = self.json_url(county_name, eid_num, version)
+        try:
+            if self.use_json:
+                try:
+                    details = self._details(county_name, eid_num, version)
+                    return details_json_to_precinct_table(details, cid_num), None
+                except FetchError as error:
+                    # only a county without the JSON file is rendered
+                    if error.status != 404:
+                        raise
+                except MissingContest:
+                    pass
+            stage = 'render'
+            url = self.page_url(county_name, eid_num, version, cid_num)
+            html_page = self.pool.render(url)
+            stage = 'parse'
+            return html_to_precinct_table(html_page), None
+        except FetchError as error:
+            return None, DownloadError(county_name, error.url, stage,
+                                       error.message, error.attempts)
+        except Exception as error:
+            return None, DownloadError(county_name, url, stage, repr(error), 1)
+
+    def scrape_all(self, county_names, eid_nums, cid_nums, errors_path=None):
+        '''
+        scrape_all, the precinct tables of many counties, as many at a time
+        as there are browsers in the pool.
+
+        Arguments:
+        ----------
+        county_names: list of str instance
+            The counties.
+        eid_nums: list of str instance
+            The election id of each county.
+        cid_nums: list of str instance
+            The contest of each county.
+        errors_path: str instance
+            A file the errors are appended to, one JSON object per line.
+
+        RETURNS:
+        ----------
+        tables: list of pandas DataFrame instance
+            The tables of the counties that worked, in the order given.
+        errors: list of DownloadError instance
+            A record for each county that failed.
+        '''
+        jobs = list(zip(county_names, eid_nums, cid_nums))
+        threads = set()
+
+        def scrape(job):
+            threads.add(threading.get_ident())
+            return self.scrape(*job)
+
+        with ThreadPoolExecutor(max_workers=self.pool.size) as workers:
+            results = list(workers.map(scrape, jobs))
+        self.downloader.client.close_threads(threads)
+        tables = [table for (table, error) in results if error is None]
+        errors = [error for (table, error) in results if error is not None]
+        if errors_path is not None and len(errors) > 0:
+            write_errors(errors, errors_path)
+        return tables, errors
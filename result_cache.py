@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of enumerated partitions and built RRGs.
+
+Enumerating the partitions of a base graph and building their RRG is by far
+the slowest part of build_graphs.py, and the result only depends on the graph,
+k and the options of the build. So the result is saved as an rrg_store.py
+store in a folder named after a SHA-256 hash of
+    the vertices and edges of the base graph (in sorted order, so the hash
+    does not depend on the order the graph was built in),
+    k,
+    the options given to write_rrg_store,
+and the next run with the same input opens that store instead of building it
+again. The cache keeps at most max_bytes on disk and removes the entries that
+were used least recently when it is over. An entry can be removed by hand
+with invalidate, or all of them with clear.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from partitions import vertex_order
+from rrg_store import base_edges, open_rrg_store, write_rrg_store
+
+CACHE_VERSION = 1
+
+
+def _plain(value):
+    # options as plain JSON values, so equal options hash the same
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for (key, item) in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def graph_hash(G, k, **options):
+    '''
+    graph_hash, the key of the RRG of G with k parts and the given options.
+
+    Arguments:
+    ----------
+    G: networkx graph instance
+        The base graph.
+    k: int instance
+        The number of parts.
+    options: keyword arguments
+        Any further options of the build, e.g. size bounds.
+
+    RETURNS:
+    ----------
+    key: str instance
+        The hexadecimal SHA-256 hash.
+    '''
+    h = hashlib.sha256(('rrg-%d' % CACHE_VERSION).encode())
+    h.update(repr(vertex_order(G)).encode())
+    h.update(base_edges(G).tobytes())
+    # an option left at None is the same as not giving it
+    options = {key: value for (key, value) in options.items()
+               if value is not None}
+    h.update(json.dumps({'k': k, 'options': _plain(options)},
+                        sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _folder_size(path):
+    size = 0
+    for (folder, _, names) in os.walk(path):
+        for name in names:
+            size += os.path.getsize(os.path.join(folder, name))
+    return size
+
+
+class ResultCache(object):
+    '''
+    ResultCache, a folder of cached RRG stores, see the module docstring.
+
+    Arguments:
+    ----------
+    cache_dir: str instance
+        The folder of the cache, by default .rrg_cache in the current
+        folder.
+    max_bytes: int instance
+        The largest size of the cache on disk, 2 GB by default. None for no
+        bound.
+    '''
+
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024**3):
+        if cache_dir is None:
+            cache_dir = '.rrg_cache'
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, G, k, **options):
+        '''
+        get, the cached store of the RRG of G, or None if it is not cached.
+        '''
+        path = self._path(graph_hash(G, k, **options))
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        # the modification time of the folder is the time of the last use
+        os.utime(path)
+        return open_rrg_store(path)
+
+    def rrg(self, G, k, progress=False, parallel=False, processes=None,
+            shard_dir=None, **options):
+        '''
+        rrg, the store of the RRG of G with k parts, from the cache if it is
+        there, otherwise built with rrg_store.write_rrg_store and added.
+
+        Arguments:
+        ----------
+        G: networkx graph instance
+            The base graph.
+        k: int instance
+            The number of parts.
+        progress: bool instance
+            Print the progress of a build.
+        parallel, processes, shard_dir:
+            How a missing entry is built, see write_rrg_store. They do not
+            change the RRG, so they are not part of the key.
+        options: keyword arguments
+            Passed on to write_rrg_store; they are part of the key.
+
+        RETURNS:
+        ----------
+        store: RRGStore instance
+            The store.
+        '''
+        store = self.get(G, k, **options)
+        if store is not None:
+            return store
+        key = graph_hash(G, k, **options)
+        path = self._path(key)
+        # build under a temporary name, so an interrupted build or another
+        # process building the same entry never leaves a broken entry
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        if os.path.exists(temporary):
+            shutil.rmtree(temporary)
+        write_rrg_store(temporary, G, k, progress=progress,
+                        parallel=parallel, processes=processes,
+                        shard_dir=shard_dir, **options)
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # someone else added the same entry in the meantime
+            shutil.rmtree(temporary)
+        self.evict(keep=key)
+        os.utime(path)
+        return open_rrg_store(path)
+
+    def partitions(self, G, k, **options):
+        '''
+        partitions, the sorted list of encoded partitions of G into k
+        connected parts, as returned by create_all_subgraphs_from_graph,
+        through the cache.
+        '''
+        return list(self.rrg(G, k, **options).iter_partitions())
+
+    def entries(self):
+        '''
+        entries, the cached stores.
+
+        RETURNS:
+        ----------
+        entries: list of tuples instance
+            (key, size in bytes, time of last use) for every entry, the
+            least recently used first.
+        '''
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self._path(key)
+            if key.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            entries.append((key, _folder_size(path), os.path.getmtime(path)))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self, keep=None):
+        '''
+        evict, remove the least recently used entries until the cache is
+        at most max_bytes.
+
+        Arguments:
+        ----------
+        keep: str instance
+            The key of an entry that is never removed, e.g. the one just
+            added.
+
+        RETURNS:
+        ----------
+        removed: list of str instance
+            The keys of the removed entries.
+        '''
+        if self.max_bytes is None:
+            return []
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        removed = []
+        for (key, size, _) in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def invalidate(self, G, k, **options):
+        '''
+        invalidate, remove the entry of the RRG of G, if there is one.
+
+        RETURNS:
+        ----------
+        removed: bool instance
+            True if there was an entry.
+        '''
+        path = self._path(graph_hash(G, k, **options))
+        if not os.path.isdir(path):
+            return False
+        shutil.rmtree(path)
+        return True
+
+    def clear(self):
+        '''
+        clear, remove every entry of the cache.
+        '''
+        for (key, _, _) in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # python result_cache.py lists the entries of .rrg_cache
+    for (key, size, used) in ResultCache().entries():
+        print('%s %10d bytes, last used %s' % (key, size, time.ctime(used)))
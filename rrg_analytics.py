@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Analysis of a reconfiguration redistricting graph (RRG) as a sparse matrix.
+
+The edge list of the RRG (from rrg_store.py, create_rrg_from_graph or
+create_rrg_from_graph_parallel) is loaded into a SciPy CSR adjacency matrix
+once and everything else is computed on it without networkx:
+    the degree of every vertex and the degree histogram, and the stationary
+    distribution of the flip-walk, which is proportional to the degree,
+    the connected components,
+    breadth-first distances, the eccentricity of given vertices and lower and
+    upper bounds on the diameter by repeated double sweeps,
+    the spectral gap of the flip-walk, the simple random walk on the RRG
+    which moves to a uniformly random neighbouring plan at every step.
+The spectral gap 1 - lambda_2 of the transition matrix says how fast that walk
+mixes: the relaxation time is 1 / gap. It is computed from the symmetric
+matrix D^(-1/2) A D^(-1/2), which has the same eigenvalues as the transition
+matrix D^(-1) A, with a sparse eigensolver, so the RRG can have millions of
+vertices.
+
+Usage:
+    python rrg_analytics.py path/to/rrg_store
+"""
+
+import sys
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import eigsh
+
+
+def adjacency_matrix(edges, num_vertices=None):
+    '''
+    adjacency_matrix, the symmetric 0/1 adjacency matrix of the RRG.
+
+    Arguments:
+    ----------
+    edges: numpy array or list of tuples instance
+        The edges (vi, vj), in one or both directions; repeated edges count
+        once. An RRGStore can be given instead, its edges and number of
+        vertices are used.
+    num_vertices: int instance
+        The number of vertices of the RRG, by default one more than the
+        largest vertex in edges.
+
+    RETURNS:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+    '''
+    if hasattr(edges, 'edges') and hasattr(edges, 'num_partitions'):
+        num_vertices = edges.num_partitions
+        edges = edges.edges
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if num_vertices is None:
+        num_vertices = int(edges.max()) + 1 if len(edges) > 0 else 0
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    columns = np.concatenate([edges[:, 1], edges[:, 0]])
+    A = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns)),
+                          shape=(num_vertices, num_vertices))
+    A.sum_duplicates()
+    A.data[:] = 1
+    return A
+
+
+def degrees(A):
+    '''
+    degrees, the degree of every vertex and the degree histogram.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix, see adjacency_matrix.
+
+    RETURNS:
+    ----------
+    degree: numpy array instance
+        degree[v] is the degree of vertex v.
+    histogram: numpy array instance
+        histogram[d] is the number of vertices of degree d.
+    '''
+    degree = np.diff(A.indptr)
+    return degree, np.bincount(degree)
+
+
+def stationary_distribution(A):
+    '''
+    stationary_distribution, the stationary distribution of the flip-walk
+    on a connected RRG, which is proportional to the degree.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+
+    RETURNS:
+    ----------
+    pi: numpy array instance
+        pi[v] is the long run share of the steps the walk spends at v.
+    '''
+    degree = np.diff(A.indptr).astype(float)
+    return degree / degree.sum()
+
+
+def components(A):
+    '''
+    components, the connected components of the RRG.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+
+    RETURNS:
+    ----------
+    num_components: int instance
+        The number of components.
+    labels: numpy array instance
+        labels[v] is the component of vertex v.
+    sizes: numpy array instance
+        sizes[c] is the number of vertices in component c.
+    '''
+    (num_components, labels) = csgraph.connected_components(A, directed=False)
+    return num_components, labels, np.bincount(labels)
+
+
+def bfs_distances(A, source):
+    '''
+    bfs_distances, the distance from source to every vertex, by a breadth
+    first search that expands a whole level at a time.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+    source: int instance
+        The start vertex.
+
+    RETURNS:
+    ----------
+    distances: numpy array instance
+        distances[v] is the distance from source to v, -1 if v can not be
+        reached.
+    '''
+    (indptr, indices) = (A.indptr, A.indices)
+    distances = np.full(A.shape[0], -1, dtype=np.int64)
+    distances[source] = 0
+    frontier = np.array([source])
+    level = 0
+    while len(frontier) > 0:
+        level += 1
+        # the neighbors of all frontier vertices in one array
+        starts = indptr[frontier]
+        lengths = indptr[frontier + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        neighbors = indices[offsets + np.arange(lengths.sum())]
+        neighbors = np.unique(neighbors[distances[neighbors] < 0])
+        distances[neighbors] = level
+        frontier = neighbors
+    return distances
+
+
+def eccentricities(A, vertices):
+    '''
+    eccentricities, the largest distance from each of the given vertices to
+    a vertex of its component.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+    vertices: list of ints instance
+        The vertices.
+
+    RETURNS:
+    ----------
+    eccentricity: numpy array instance
+        The eccentricities, in the order of vertices.
+    '''
+    return np.array([bfs_distances(A, v).max() for v in vertices],
+                    dtype=np.int64)
+
+
+def diameter_bounds(A, num_sweeps=4, seed=0):
+    '''
+    diameter_bounds, bounds on the diameter of the largest component by
+    repeated double sweeps: a breadth first search from a vertex, then
+    another one from the farthest vertex found.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+    num_sweeps: int instance
+        The number of double sweeps, each from a random start vertex.
+    seed: int instance
+        The seed of the start vertices.
+
+    RETURNS:
+    ----------
+    lower: int instance
+        The largest eccentricity found, a lower bound on the diameter.
+    upper: int instance
+        Twice the smallest eccentricity found, an upper bound.
+    '''
+    if A.shape[0] == 0:
+        return 0, 0
+    (_, labels, sizes) = components(A)
+    inside = np.flatnonzero(labels == np.argmax(sizes))
+    rng = np.random.default_rng(seed)
+    lower = 0
+    upper = np.inf
+    for start in rng.choice(inside, size=num_sweeps):
+        distances = bfs_distances(A, start)
+        farthest = int(np.argmax(distances))
+        lower = max(lower, int(distances[farthest]))
+        upper = min(upper, 2 * int(distances[farthest]))
+        distances = bfs_distances(A, farthest)
+        lower = max(lower, int(distances.max()))
+        upper = min(upper, 2 * int(distances.max()))
+    return lower, int(upper)
+
+
+def spectral_gap(A, lazy=False, tol=1e-8):
+    '''
+    spectral_gap, the spectral gap of the flip-walk on the RRG, the simple
+    random walk with transition matrix P = D^(-1) A.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+    lazy: bool instance
+        Use the lazy walk (I + P) / 2, which stays put half of the time, as
+        is common for the chains in the other scripts that reject proposals.
+    tol: float instance
+        The tolerance of the eigensolver.
+
+    RETURNS:
+    ----------
+    gap: float instance
+        1 - lambda_2, where lambda_2 is the second largest eigenvalue of the
+        transition matrix. 0 if the RRG is not connected.
+    absolute_gap: float instance
+        1 - max(lambda_2, |lambda_min|), which also accounts for
+        periodicity; 0 for a bipartite RRG unless lazy.
+    '''
+    num_vertices = A.shape[0]
+    if num_vertices < 2:
+        return 1.0, 1.0
+    if components(A)[0] > 1:
+        return 0.0, 0.0
+    degree = np.diff(A.indptr).astype(float)
+    scale = sparse.diags(1.0 / np.sqrt(degree))
+    S = (scale @ A.astype(float) @ scale).tocsr()
+    if num_vertices <= 500:
+        eigenvalues = np.linalg.eigvalsh(S.toarray())
+        (second, smallest) = (eigenvalues[-2], eigenvalues[0])
+    else:
+        # the largest eigenvalue is 1 with eigenvector sqrt(degree)
+        second = eigsh(S, k=2, which='LA', tol=tol,
+                       return_eigenvectors=False).min()
+        smallest = eigsh(S, k=1, which='SA', tol=tol,
+                         return_eigenvectors=False)[0]
+    if lazy:
+        (second, smallest) = ((1 + second) / 2, (1 + smallest) / 2)
+    gap = 1 - second
+    return float(gap), float(1 - max(second, abs(smallest)))
+
+
+def rrg_summary(A, num_sweeps=4, lazy=False):
+    '''
+    rrg_summary, all of the above for one RRG.
+
+    Arguments:
+    ----------
+    A: scipy.sparse.csr_matrix instance
+        The adjacency matrix.
+    num_sweeps: int instance
+        See diameter_bounds.
+    lazy: bool instance
+        See spectral_gap.
+
+    RETURNS:
+    ----------
+    summary: dict instance
+        The number of vertices and edges, the minimum, mean and maximum
+        degree, the degree histogram, the number and largest size of the
+        components, the diameter bounds and the spectral gaps.
+    '''
+    (degree, histogram) = degrees(A)
+    (num_components, _, sizes) = components(A)
+    (lower, upper) = diameter_bounds(A, num_sweeps)
+    (gap, absolute_gap) = spectral_gap(A, lazy)
+    return {'num_vertices': A.shape[0],
+            'num_edges': int(A.nnz // 2),
+            'min_degree': int(degree.min()) if len(degree) else 0,
+            'mean_degree': float(degree.mean()) if len(degree) else 0.0,
+            'max_degree': int(degree.max()) if len(degree) else 0,
+            'degree_histogram': histogram.tolist(),
+            'num_components': int(num_components),
+            'largest_component': int(sizes.max()) if len(sizes) else 0,
+            'diameter_lower': lower,
+            'diameter_upper': upper,
+            'spectral_gap': gap,
+            'absolute_spectral_gap': absolute_gap}
+
+
+def print_rrg_summary(summary):
+    '''
+    print_rrg_summary, print the result of rrg_summary.
+    '''
+    print('Number of vertices:', summary['num_vertices'])
+    print('Number of edges:', summary['num_edges'])
+    print('Degree: min %d, mean %.2f, max %d' % (summary['min_degree'],
+                                                 summary['mean_degree'],
+                                                 summary['max_degree']))
+    print('Components: %d, the largest has %d vertices'
+          % (summary['num_components'], summary['largest_component']))
+    print('Diameter between %d and %d' % (summary['diameter_lower'],
+                                          summary['diameter_upper']))
+    print('Spectral gap of the flip-walk: %.6g (absolute %.6g)'
+          % (summary['spectral_gap'], summary['absolute_spectral_gap']))
+    if summary['spectral_gap'] > 0:
+        print('Relaxation time: %.1f steps' % (1 / summary['spectral_gap']))
+
+
+if __name__ == '__main__':
+    from rrg_store import open_rrg_store
+    store = open_rrg_store(sys.argv[1])
+    print_rrg_summary(rrg_summary(adjacency_matrix(store)))
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk store for a reconfiguration redistricting graph (RRG).
+
+The vertices of the RRG are the partitions of a base graph G into k connected
+parts and two of them are joined when they differ by moving a single vertex,
+see build_graphs.py. For large base graphs there are far too many of either
+to keep as Python objects, so the store keeps them as two flat binary files
+that are read back as memory maps:
+    the partition table, one row of part labels per partition in the encoding
+    of partitions.py, sorted by encoding, so row i is RRG vertex i and a
+    partition is found by binary search;
+    the edges, int32 rows (vi, vj) with vi < vj.
+
+iter_rrg_edges builds the edges from a partition table in batches of
+partitions: every move of a vertex to the part of a neighbor is made with
+array operations, renumbered to the canonical labels and looked up in the
+table. write_rrg_store streams the partitions of G and the edges of the RRG
+to a store, so neither is ever held as a list.
+
+A store is a directory with
+    meta.json        sizes, k, the bounds and the vertices of G
+    partitions.dat   uint8 rows of labels (uint16 if G has over 256 vertices)
+    edges.dat        int32 rows (vi, vj)
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from partitions import vertex_order, label_dtype
+
+
+def table_keys(table):
+    '''
+    table_keys, every row of a table of labels as one fixed width byte
+    string, so that rows compare in the same order as their encodings.
+    '''
+    table = np.ascontiguousarray(table)
+    width = table.shape[1] * table.dtype.itemsize
+    return table.view('S%d' % width).reshape(len(table))
+
+
+def canonical_rows(rows, k):
+    '''
+    canonical_rows, the restricted growth form of every row of a table of
+    labels 0,...,k-1: the parts are renumbered in the order of their first
+    vertex. A part that does not appear in a row gets the last number.
+    '''
+    (num_rows, num_vertices) = rows.shape
+    first = np.full((num_rows, k), num_vertices, dtype=np.int64)
+    for label in range(k):
+        inside = rows == label
+        present = inside.any(axis=1)
+        first[present, label] = inside[present].argmax(axis=1)
+    order = np.argsort(first, axis=1, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order,
+                      np.broadcast_to(np.arange(k), order.shape), axis=1)
+    return np.take_along_axis(rank, rows.astype(np.int64), axis=1)
+
+
+def base_edges(G):
+    '''
+    base_edges, the edges of G as rows (i, j), i < j, of positions in
+    partitions.vertex_order(G).
+    '''
+    position = {v: i for (i, v) in enumerate(vertex_order(G))}
+    edges = set((min(position[a], position[b]), max(position[a], position[b]))
+                for (a, b) in G.edges() if a != b)
+    return np.array(sorted(edges), dtype=np.int64).reshape(-1, 2)
+
+
+def single_vertex_moves(labels, edges, k):
+    '''
+    single_vertex_moves, every move of one vertex to the part of one of its
+    neighbors, for a table of partitions.
+
+    Arguments:
+    ----------
+    labels: numpy array instance
+        Rows of canonical labels 0,...,k-1.
+    edges: numpy array instance
+        The edges of the base graph, see base_edges.
+    k: int instance
+        The number of parts.
+
+    RETURNS:
+    ----------
+    rows: numpy array instance
+        rows[m] is the row of labels that move m starts from, in increasing
+        order.
+    moved: numpy array instance
+        moved[m] is the canonical labels after move m. When the vertex was
+        alone in its part the row only has k-1 parts.
+    '''
+    (u, v) = (edges[:, 0], edges[:, 1])
+    labels = np.asarray(labels, dtype=np.int64)
+    # every edge between two parts gives two moves, one for each end; a move
+    # is (row, vertex, new part) and is made only once
+    (rows, cut) = np.nonzero(labels[:, u] != labels[:, v])
+    moves = np.concatenate([
+        np.stack([rows, u[cut], labels[rows, v[cut]]], axis=1),
+        np.stack([rows, v[cut], labels[rows, u[cut]]], axis=1)])
+    moves = np.unique(moves, axis=0)
+    (rows, vertices, parts) = moves.T
+    moved = labels[rows]
+    moved[np.arange(len(moves)), vertices] = parts
+    return rows, canonical_rows(moved, k)
+
+
+def partition_table(partitions, num_vertices):
+    '''
+    partition_table, the partitions as a table of labels sorted by encoding,
+    as used by iter_rrg_edges.
+
+    Arguments:
+    ----------
+    partitions: list of bytes instance
+        Encoded partitions, e.g. from create_all_subgraphs_from_graph.
+    num_vertices: int instance
+        The number of vertices of the base graph.
+
+    RETURNS:
+    ----------
+    table: numpy array instance
+        Shape (number of partitions, num_vertices), row i holds the labels of
+        the i-th partition in sorted order.
+    '''
+    dtype = label_dtype(num_vertices)
+    table = np.frombuffer(b''.join(partitions), dtype=dtype)
+    table = table.reshape(-1, num_vertices)
+    return table[np.argsort(table_keys(table), kind='stable')]
+
+
+def iter_rrg_edges(table, G, batch_size=1024):
+    '''
+    iter_rrg_edges, the edges of the RRG whose vertices are the rows of a
+    partition table, generated a batch of partitions at a time.
+
+    Arguments:
+    ----------
+    table: numpy array instance
+        The sorted table of labels, see partition_table. A memory map works.
+    G: networkx graph instance
+        The base graph.
+    batch_size: int instance
+        The number of partitions handled at once.
+
+    RETURNS:
+    ----------
+    edges: iterator of numpy arrays instance
+        int32 arrays of rows (vi, vj) with vi < vj. Every edge appears once,
+        sorted by vi and then vj.
+    '''
+    if len(table) == 0:
+        return
+    edges_of_G = base_edges(G)
+    k = int(table[0].max()) + 1
+    keys = table_keys(table)
+    for start in range(0, len(table), batch_size):
+        (rows, moved) = single_vertex_moves(table[start:start + batch_size],
+                                            edges_of_G, k)
+        moved = moved.astype(table.dtype)
+        moved_keys = table_keys(moved)
+        found = np.searchsorted(keys, moved_keys)
+        found[found == len(keys)] = 0
+        hit = keys[found] == moved_keys
+        vi = rows[hit] + start
+        vj = found[hit]
+        keep = vi < vj
+        edges = np.stack([vi[keep], vj[keep]], axis=1).astype(np.int32)
+        # the moves are sorted by row, sort each row's edges by vj
+        edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+        if len(edges) > 0:
+            yield edges
+
+
+class RRGStore(object):
+    '''
+    RRGStore, an RRG saved by write_rrg_store. Use open_rrg_store rather than
+    calling the constructor.
+
+    len(store) is the number of vertices of the RRG, store.partitions and
+    store.edges are the memory-mapped partition table and edge list, and
+    store.partition(i) is the encoding of vertex i.
+    '''
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.k = meta['k']
+        self.min_size = meta.get('min_size')
+        self.max_size = meta.get('max_size')
+        self.num_vertices = meta['num_vertices']
+        self.num_partitions = meta['num_partitions']
+        self.num_edges = meta['num_edges']
+        self.nodes = [tuple(v) if isinstance(v, list) else v
+                      for v in meta['nodes']]
+        dtype = label_dtype(self.num_vertices)
+        if self.num_partitions > 0:
+            self.partitions = np.memmap(
+                os.path.join(path, 'partitions.dat'), dtype=dtype, mode='r',
+                shape=(self.num_partitions, self.num_vertices))
+        else:
+            self.partitions = np.zeros((0, self.num_vertices), dtype=dtype)
+        if self.num_edges > 0:
+            self.edges = np.memmap(os.path.join(path, 'edges.dat'),
+                                   dtype=np.int32, mode='r',
+                                   shape=(self.num_edges, 2))
+        else:
+            self.edges = np.zeros((0, 2), dtype=np.int32)
+        self._keys = None
+
+    def __len__(self):
+        return self.num_partitions
+
+    def partition(self, i):
+        '''
+        partition, the encoding of vertex i of the RRG.
+        '''
+        return self.partitions[i].tobytes()
+
+    def find(self, partition):
+        '''
+        find, the vertex of the RRG that is the encoded partition, or None if
+        it is not in the store.
+        '''
+        if self._keys is None:
+            self._keys = table_keys(self.partitions)
+        row = np.frombuffer(partition, dtype=self.partitions.dtype)
+        key = table_keys(row.reshape(1, -1))[0]
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return None
+
+    def iter_partitions(self):
+        '''
+        iter_partitions, the encodings of the vertices of the RRG in order.
+        '''
+        for i in range(len(self)):
+            yield self.partition(i)
+
+    def iter_edges(self, chunk_size=2**20):
+        '''
+        iter_edges, the edge list in arrays of at most chunk_size rows.
+        '''
+        for start in range(0, self.num_edges, chunk_size):
+            yield np.asarray(self.edges[start:start + chunk_size])
+
+    def to_networkx(self):
+        '''
+        to_networkx, the RRG as a networkx graph whose vertices are
+        0,...,len(store)-1. Only for small graphs.
+        '''
+        import networkx as nx
+        H = nx.Graph()
+        H.add_nodes_from(range(len(self)))
+        for edges in self.iter_edges():
+            H.add_edges_from(edges.tolist())
+        return H
+
+
+def write_rrg_store(path, G, k, partitions=None, batch_size=1024,
+                    progress=False, populations=None, min_size=None,
+                    max_size=None, parallel=False, processes=None,
+                    shard_dir=None):
+    '''
+    write_rrg_store, enumerate the partitions of G into k connected parts and
+    the edges of their RRG, and stream both to a store in the directory path.
+
+    Arguments:
+    ----------
+    path: str instance
+        The directory of the store. It is created if needed; an existing store
+        in it is overwritten.
+    G: networkx graph instance
+        The base graph.
+    k: int instance
+        The number of parts.
+    partitions: iterable of bytes instance
+        The encoded partitions, by default
+        frontier_search.iter_connected_partitions(G, k).
+    batch_size: int instance
+        The number of partitions handled at once by iter_rrg_edges.
+    progress: bool instance
+        Print a line after each stage.
+    populations, min_size, max_size:
+        Only keep the partitions whose parts have populations between
+        min_size and max_size, see frontier_search.PartitionDiagram. The
+        edges join the balanced partitions that differ by one vertex.
+    parallel: bool instance
+        Build the edges with build_graphs.create_rrg_from_graph_parallel
+        instead of iter_rrg_edges. The store is the same either way.
+    processes, shard_dir:
+        Passed on to create_rrg_from_graph_parallel when parallel is True.
+
+    RETURNS:
+    ----------
+    store: RRGStore instance
+        The new store.
+    '''
+    if partitions is None:
+        from frontier_search import iter_connected_partitions
+        partitions = iter_connected_partitions(G, k, populations, min_size,
+                                               max_size)
+    nodes = vertex_order(G)
+    num_vertices = len(nodes)
+    dtype = label_dtype(num_vertices)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    partitions_path = os.path.join(path, 'partitions.dat')
+    edges_path = os.path.join(path, 'edges.dat')
+    start_time = time.time()
+
+    # write the partitions as they come, then sort the table by encoding
+    num_partitions = 0
+    unsorted_path = partitions_path + '.unsorted'
+    with open(unsorted_path, 'wb') as f:
+        block = []
+        for partition in partitions:
+            block.append(partition)
+            if len(block) == 65536:
+                f.write(b''.join(block))
+                num_partitions += len(block)
+                block = []
+        f.write(b''.join(block))
+        num_partitions += len(block)
+    if num_partitions > 0:
+        table = np.memmap(unsorted_path, dtype=dtype, mode='r',
+                          shape=(num_partitions, num_vertices))
+        keys = np.sort(table_keys(table))
+        del table
+        keys.tofile(partitions_path)
+        del keys
+    else:
+        open(partitions_path, 'wb').close()
+    os.remove(unsorted_path)
+    if progress:
+        print('%d partitions (%.1f s)' % (num_partitions,
+                                          time.time() - start_time))
+
+    num_edges = 0
+    with open(edges_path, 'wb') as f:
+        if num_partitions > 0:
+            table = np.memmap(partitions_path, dtype=dtype, mode='r',
+                              shape=(num_partitions, num_vertices))
+            if parallel:
+                from build_graphs import create_rrg_from_graph_parallel
+                # the rows of the sorted table are the encodings, so the
+                # positions in the list are the vertices of the store
+                edges = create_rrg_from_graph_parallel(
+                    [row.tobytes() for row in table], G, k, processes,
+                    shard_dir=shard_dir, progress=progress)
+                edges.astype(np.int32).tofile(f)
+                num_edges = len(edges)
+            else:
+                for edges in iter_rrg_edges(table, G, batch_size):
+                    edges.tofile(f)
+                    num_edges += len(edges)
+            del table
+    if progress:
+        print('%d edges (%.1f s)' % (num_edges, time.time() - start_time))
+
+    meta = {'k': k,
+            'min_size': min_size,
+            'max_size': max_size,
+            'num_vertices': num_vertices,
+            'num_partitions': num_partitions,
+            'num_edges': num_edges,
+            'nodes': nodes}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return open_rrg_store(path)
+
+
+def open_rrg_store(path):
+    '''
+    open_rrg_store, open a store made by write_rrg_store.
+
+    Arguments:
+    ----------
+    path: str instance
+        The directory of the store.
+
+    RETURNS:
+    ----------
+    store: RRGStore instance
+        The store.
+    '''
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return RRGStore(path, meta)
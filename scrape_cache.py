@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the files fetched by the election scraper.
+
+The results of a county on a Clarity site live under a version number, the
+first line of current_ver.txt, and the files of one version never change. So
+    the version of a county (key (county, eid)) is kept with the ETag and
+    Last-Modified headers it came with; it is looked up at most once per run,
+    it is trusted without asking the site while it is younger than max_age,
+    and after that it is checked with a conditional request, which costs a
+    304 response without a body when the version did not change;
+    a downloaded file of a version (key (county, eid, version)) is kept and
+    never fetched again; when a newer version is stored, the files of the
+    older versions of that county are removed.
+After the results are certified the versions stop changing, and a re-run
+with max_age=None (trust the cached versions forever) does no network I/O at
+all for the counties that are cached.
+
+The layout is cache_dir/<county>/<eid>/version.json for the versions and
+cache_dir/<county>/<eid>/<version>/<file name> for the files. Every file is
+written under a temporary name and then renamed, so the threads of
+county_downloader.py can share a cache.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+from county_downloader import FetchError
+
+
+class ScrapeCache(object):
+    '''
+    ScrapeCache, a folder of cached versions and files, see the module
+    docstring.
+
+    Arguments:
+    ----------
+    cache_dir: str instance
+        The folder of the cache, by default .scrape_cache in the current
+        folder.
+    max_age: float instance
+        The number of seconds a cached version is used without asking the
+        site. 0 asks once per run, None never asks again.
+    '''
+
+    def __init__(self, cache_dir=None, max_age=0):
+        if cache_dir is None:
+            cache_dir = '.scrape_cache'
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.stats = {'version_cached': 0, 'version_not_modified': 0,
+                      'version_fetched': 0, 'file_cached': 0,
+                      'file_fetched': 0}
+        self._session = {}
+        self._lock = threading.Lock()
+
+    def _folder(self, key):
+        return os.path.join(self.cache_dir, *[str(part) for part in key])
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    def _read_record(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def version(self, client, url, county_name, eid_num):
+        '''
+        version, the body of current_ver.txt of a county, from the cache
+        when it is fresh, otherwise with a conditional request.
+
+        Arguments:
+        ----------
+        client: county_downloader.HTTPClient instance
+            The client used for the requests.
+        url: str instance
+            The url of current_ver.txt.
+        county_name: str instance
+            The county, the first part of the key.
+        eid_num: str instance
+            The election id, the second part of the key.
+
+        RETURNS:
+        ----------
+        body: str instance
+            The text of current_ver.txt.
+        '''
+        key = (county_name, eid_num)
+        with self._lock:
+            if key in self._session:
+                self.stats['version_cached'] += 1
+                return self._session[key]
+        path = os.path.join(self._folder(key), 'version.json')
+        record = self._read_record(path)
+        now = time.time()
+        if record is not None and (self.max_age is None or
+                                   now - record['checked'] <= self.max_age):
+            self._count('version_cached')
+        else:
+            headers = {}
+            if record is not None and record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record is not None and record.get('last_modified'):
+                headers['If-Modified-Since'] = record['last_modified']
+            response = client.get(url, headers)
+            if response.status == 304 and record is None:
+                # nothing to fall back on, e.g. a proxy answered 304: fetch
+                # the version again without the conditional headers
+                response = client.get(url)
+                if response.status == 304:
+                    raise FetchError(url, 304, 1,
+                                     'HTTP status 304 without a cached version')
+            if response.status == 304 and record is not None:
+                self._count('version_not_modified')
+            else:
+                self._count('version_fetched')
+                record = {'body': response.body.decode('UTF-8'),
+                          'etag': response.headers.get('etag'),
+                          'last_modified': response.headers.get('last-modified')}
+            record['checked'] = now
+            self._write(path, json.dumps(record).encode())
+        with self._lock:
+            self._session[key] = record['body']
+        return record['body']
+
+    def file(self, client, url, county_name, eid_num, version):
+        '''
+        file, a file of one version of the results of a county, downloaded
+        only if it is not in the cache.
+
+        Arguments:
+        ----------
+        client: county_downloader.HTTPClient instance
+            The client used for the request.
+        url: str instance
+            The url of the file; its last part is the name of the file.
+        county_name: str instance
+            The county.
+        eid_num: str instance
+            The election id.
+        version: str instance
+            The version of the results.
+
+        RETURNS:
+        ----------
+        data: bytes instance
+            The contents of the file.
+        '''
+        folder = self._folder((county_name, eid_num, version))
+        path = os.path.join(folder, url.rstrip('/').split('/')[-1])
+        if os.path.exists(path):
+            self._count('file_cached')
+            with open(path, 'rb') as f:
+                return f.read()
+        data = client.get(url).body
+        self._count('file_fetched')
+        self._write(path, data)
+        # the files of older versions of the county are of no further use
+        parent = os.path.dirname(folder)
+        for other in os.listdir(parent):
+            if other != str(version) and os.path.isdir(os.path.join(parent, other)):
+                shutil.rmtree(os.path.join(parent, other), ignore_errors=True)
+        return data
+
+    def invalidate(self, county_name, eid_num):
+        '''
+        invalidate, forget the cached version and files of a county.
+        '''
+        with self._lock:
+            self._session.pop((county_name, eid_num), None)
+        shutil.rmtree(self._folder((county_name, eid_num)), ignore_errors=True)
+
+    def clear(self):
+        '''
+        clear, remove everything from the cache.
+        '''
+        with self._lock:
+            self._session.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized election tallies for whole ensembles of districting plans.
+
+A plan is an array whose entry v is the district of vertex v. A stack of p
+plans is tallied with a single numpy.bincount: district d of plan j gets the
+bin j*num_districts + d, so every vote of every plan lands in its own
+(plan, district) bin in one pass. Ensembles are processed chunk by chunk, so
+memory stays bounded by the chunk size.
+
+Many vote scenarios are scored against the same ensemble with a sparse
+plan-incidence matrix instead: row j*num_districts + d of the matrix has a 1
+for every vertex of district d of plan j, so its product with a matrix whose
+columns are the scenarios gives the votes of every district of every plan
+under every scenario in one multiplication.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+TIE_RULES = ('yellow', 'green', 'half')
+
+
+def tally_district_votes(plans, party_assignment, num_districts,
+                         populations=None):
+    '''
+    tally_district_votes, count the Yellow votes and the total votes in every
+    district of every plan in a stack of plans.
+
+    Arguments:
+    ----------
+    plans: (p,|V|) numpy array instance
+        Each row is a districting plan.
+    party_assignment: numpy array instance
+        The Yellow vote of each vertex (1 for Yellow, 0 for Green in the
+        chain scripts; any non-negative number of votes works).
+    num_districts: int instance
+        The number of districts.
+    populations: numpy array instance
+        The total number of votes of each vertex, by default 1 per vertex.
+
+    RETURNS:
+    ----------
+    yellow_votes: (p,num_districts) numpy array instance
+        The Yellow votes in each district of each plan.
+    total_votes: (p,num_districts) numpy array instance
+        The total votes in each district of each plan.
+    '''
+    plans = np.atleast_2d(plans)
+    p, num_vertices = plans.shape
+    bins = (plans + num_districts * np.arange(p)[:, None]).ravel()
+    size = p * num_districts
+    yellow_votes = np.bincount(bins, weights=np.tile(party_assignment, p),
+                               minlength=size).reshape(p, num_districts)
+    if np.asarray(party_assignment).dtype.kind in 'iub':
+        yellow_votes = yellow_votes.astype(np.int64)
+    if populations is None:
+        total_votes = np.bincount(bins, minlength=size)
+    else:
+        total_votes = np.bincount(bins, weights=np.tile(populations, p),
+                                  minlength=size)
+    return yellow_votes, total_votes.reshape(p, num_districts)
+
+
+def count_seats(yellow_votes, total_votes, ties='yellow'):
+    '''
+    count_seats, count the districts won by Yellow. A district is won when
+    Yellow has more than half of its votes.
+
+    Arguments:
+    ----------
+    yellow_votes: (...,num_districts) numpy array instance
+        The Yellow votes in each district.
+    total_votes: (...,num_districts) numpy array instance
+        The total votes in each district.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green', or 'half' for half a
+        seat to each party.
+
+    RETURNS:
+    ----------
+    seats: numpy array instance
+        The number of seats won by Yellow, an int array unless ties='half'.
+    '''
+    if ties not in TIE_RULES:
+        raise ValueError('ties must be one of %s' % (TIE_RULES,))
+    doubled = 2 * np.asarray(yellow_votes)
+    seats = np.sum(doubled > total_votes, axis=-1)
+    tied = np.sum(doubled == total_votes, axis=-1)
+    if ties == 'yellow':
+        return seats + tied
+    if ties == 'half':
+        return seats + 0.5 * tied
+    return seats
+
+
+def district_seat(yellow_votes, total_votes, ties='yellow'):
+    '''
+    district_seat, the share of one district won by Yellow under the same
+    rule as count_seats: 1 if Yellow has more than half of the votes, 0 if
+    less, and 1, 0 or 0.5 for a tie depending on ties.
+
+    Arguments:
+    ----------
+    yellow_votes: number instance
+        The Yellow votes in the district.
+    total_votes: number instance
+        The total votes in the district.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green' or 'half'.
+
+    RETURNS:
+    ----------
+    seat: int or float instance
+        The seat share of Yellow.
+    '''
+    if 2 * yellow_votes > total_votes:
+        return 1
+    if 2 * yellow_votes < total_votes:
+        return 0
+    if ties == 'half':
+        return 0.5
+    return 1 if ties == 'yellow' else 0
+
+
+def _iter_plan_chunks(ensemble, chunk_size):
+    if hasattr(ensemble, 'iter_chunks'):
+        for chunk in ensemble.iter_chunks(chunk_size):
+            yield chunk
+    else:
+        for start in range(0, len(ensemble), chunk_size):
+            yield np.asarray(ensemble[start:start + chunk_size])
+
+
+def tally_ensemble(ensemble, party_assignment, num_districts, ties='yellow',
+                   populations=None, chunk_size=10000):
+    '''
+    tally_ensemble, count the Yellow votes in every district and the Yellow
+    seats of every plan of an ensemble, chunk_size plans at a time.
+
+    Arguments:
+    ----------
+    ensemble: EnsembleStore, (P,|V|) numpy array or list of plans instance
+        The plans to score.
+    party_assignment: numpy array instance
+        The Yellow vote of each vertex.
+    num_districts: int instance
+        The number of districts.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green' or 'half'.
+    populations: numpy array instance
+        The total number of votes of each vertex, by default 1 per vertex.
+    chunk_size: int instance
+        The number of plans tallied at once.
+
+    RETURNS:
+    ----------
+    party_counts: (P,num_districts) numpy array instance
+        The Yellow votes in each district of each plan.
+    num_yellow_seats: (P,) numpy array instance
+        The number of seats won by Yellow in each plan.
+    '''
+    party_counts = []
+    num_yellow_seats = []
+    for plans in _iter_plan_chunks(ensemble, chunk_size):
+        yellow_votes, total_votes = tally_district_votes(
+            plans, party_assignment, num_districts, populations)
+        party_counts.append(yellow_votes)
+        num_yellow_seats.append(count_seats(yellow_votes, total_votes, ties))
+    if len(party_counts) == 0:
+        return np.zeros((0, num_districts)), np.zeros(0, dtype=int)
+    return np.concatenate(party_counts), np.concatenate(num_yellow_seats)
+
+
+def exact_seat_distribution(ensemble, party_assignment, num_districts,
+                            weights=None, ties='yellow', populations=None,
+                            chunk_size=100000):
+    '''
+    exact_seat_distribution, the distribution of the Yellow seats over all
+    the plans of an ensemble, e.g. every partition enumerated by
+    build_graphs.py, instead of the plans visited by a walk.
+
+    Arguments:
+    ----------
+    ensemble: EnsembleStore, (P,|V|) numpy array or list of plans instance
+        The plans, e.g. the partitions table of an rrg_store.py store
+        (store.partitions), whose rows are labels in the vertex order of
+        partitions.vertex_order.
+    party_assignment: numpy array instance
+        The Yellow vote of each vertex, in the same vertex order.
+    num_districts: int instance
+        The number of districts.
+    weights: numpy array instance
+        The weight of each plan, by default 1 for every plan. Use
+        rrg_analytics.stationary_distribution for the plans weighted as the
+        flip-walk on the RRG visits them in the long run.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green' or 'half'.
+    populations: numpy array instance
+        The total number of votes of each vertex, by default 1 per vertex.
+    chunk_size: int instance
+        The number of plans tallied at once.
+
+    RETURNS:
+    ----------
+    seat_distribution: (2*num_districts+1,) numpy array instance
+        seat_distribution[s] is the share of the (weighted) plans in which
+        Yellow wins s/2 seats, in half seats as in streaming_stats.py.
+    '''
+    total = np.zeros(2 * num_districts + 1)
+    start = 0
+    for plans in _iter_plan_chunks(ensemble, chunk_size):
+        plans = np.atleast_2d(plans)
+        yellow_votes, total_votes = tally_district_votes(
+            plans, party_assignment, num_districts, populations)
+        half_seats = np.rint(
+            2 * count_seats(yellow_votes, total_votes, ties)).astype(np.int64)
+        chunk_weights = None
+        if weights is not None:
+            chunk_weights = np.asarray(weights[start:start + len(plans)],
+                                       dtype=float)
+        total += np.bincount(half_seats, weights=chunk_weights,
+                             minlength=len(total))
+        start += len(plans)
+    if total.sum() > 0:
+        total /= total.sum()
+    return total
+
+
+def plan_incidence(plans, num_districts):
+    '''
+    plan_incidence, the sparse incidence matrix of a stack of plans.
+
+    Arguments:
+    ----------
+    plans: (p,|V|) numpy array instance
+        Each row is a districting plan.
+    num_districts: int instance
+        The number of districts.
+
+    RETURNS:
+    ----------
+    incidence: (p*num_districts,|V|) scipy.sparse.csr_matrix instance
+        Entry (j*num_districts + d, v) is 1 if vertex v is in district d of
+        plan j.
+    '''
+    plans = np.atleast_2d(plans)
+    p, num_vertices = plans.shape
+    rows = (plans + num_districts * np.arange(p)[:, None]).ravel()
+    # every row of plans puts each vertex in exactly one district, so the
+    # matrix has one entry per vertex and plan, in vertex order
+    columns = np.tile(np.arange(num_vertices), p)
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                             shape=(p * num_districts, num_vertices))
+
+
+def uniform_swing_scenarios(party_assignment, swings, populations=None):
+    '''
+    uniform_swing_scenarios, vote scenarios in which the Yellow share of
+    every vertex moves by the same amount.
+
+    Arguments:
+    ----------
+    party_assignment: numpy array instance
+        The Yellow vote of each vertex.
+    swings: list of floats instance
+        The changes of the Yellow share, e.g. 0.05 for 5 points more.
+    populations: numpy array instance
+        The total number of votes of each vertex, by default 1 per vertex.
+
+    RETURNS:
+    ----------
+    scenarios: (len(swings),|V|) numpy array instance
+        The Yellow votes of each vertex in each scenario, kept between 0 and
+        the population of the vertex.
+    '''
+    party_assignment = np.asarray(party_assignment, dtype=float)
+    if populations is None:
+        populations = np.ones(len(party_assignment))
+    populations = np.asarray(populations, dtype=float)
+    swings = np.asarray(swings, dtype=float)[:, None]
+    return np.clip(party_assignment + swings * populations, 0, populations)
+
+
+def tally_scenarios(ensemble, scenarios, num_districts, ties='yellow',
+                    populations=None, chunk_size=10000):
+    '''
+    tally_scenarios, the Yellow seats of every plan of an ensemble under
+    every one of many vote scenarios, chunk_size plans at a time.
+
+    Arguments:
+    ----------
+    ensemble: EnsembleStore, (P,|V|) numpy array or list of plans instance
+        The plans to score.
+    scenarios: (S,|V|) numpy array instance
+        Each row is the Yellow vote of each vertex in one scenario, e.g.
+        uniform swings, other elections or random assignments.
+    num_districts: int instance
+        The number of districts.
+    ties: str instance
+        Who gets a tied district: 'yellow', 'green' or 'half'.
+    populations: numpy array instance
+        The total number of votes of each vertex, by default 1 per vertex.
+        A (S,|V|) array gives every scenario its own totals.
+    chunk_size: int instance
+        The number of plans tallied at once.
+
+    RETURNS:
+    ----------
+    seats: (P,S) numpy array instance
+        The number of seats won by Yellow in each plan under each scenario.
+    '''
+    scenarios = np.atleast_2d(np.asarray(scenarios))
+    num_scenarios, num_vertices = scenarios.shape
+    if populations is None:
+        populations = np.ones(num_vertices)
+    populations = np.asarray(populations, dtype=float)
+    if populations.ndim == 1:
+        populations = populations[None, :]
+    # the vertices as rows, one column per scenario
+    votes = np.ascontiguousarray(scenarios.T, dtype=float)
+    totals = np.ascontiguousarray(populations.T)
+    seats = []
+    for plans in _iter_plan_chunks(ensemble, chunk_size):
+        incidence = plan_incidence(plans, num_districts)
+        p = incidence.shape[0] // num_districts
+        # (p*num_districts,S) products, with the districts moved last
+        yellow_votes = (incidence @ votes).reshape(p, num_districts, -1)
+        total_votes = (incidence @ totals).reshape(p, num_districts, -1)
+        seats.append(count_seats(yellow_votes.transpose(0, 2, 1),
+                                 total_votes.transpose(0, 2, 1), ties))
+    if len(seats) == 0:
+        return np.zeros((0, num_scenarios), dtype=int)
+    return np.concatenate(seats)
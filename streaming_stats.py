@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Summary statistics that are updated one plan at a time.
+
+With these the walk only has to keep its current plan: the seat histogram,
+the running mean and variance of the seats and of the number of conflicted
+edges are updated after every accepted step, so the memory use does not
+depend on the number of steps.
+"""
+
+import math
+
+import numpy as np
+
+
+class RunningStats(object):
+    '''
+    RunningStats, the count, mean, variance, minimum and maximum of a stream
+    of numbers, updated with Welford's method.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, x, weight=1):
+        '''
+        update, add the number x to the stream weight times.
+        '''
+        if weight <= 0:
+            return
+        self.count += weight
+        delta = x - self.mean
+        self.mean += weight * delta / self.count
+        self.m2 += weight * delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def merge(self, other):
+        '''
+        merge, add the numbers summarized by other to this stream.
+        '''
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        '''the sample variance of the stream'''
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class WalkSummary(object):
+    '''
+    WalkSummary, the statistics of the plans visited by a walk: the number
+    of plans, the histogram of the Yellow seats (in half seats, so ties can
+    count as half a seat), and running statistics of the Yellow seats and of
+    the number of conflicted edges.
+
+    Arguments:
+    ----------
+    num_districts: int instance
+        The number of districts.
+    '''
+
+    def __init__(self, num_districts):
+        self.num_districts = num_districts
+        self.num_plans = 0
+        self.seat_histogram = np.zeros(2 * num_districts + 1, dtype=np.int64)
+        self.seats = RunningStats()
+        self.cut_edges = RunningStats()
+
+    def update(self, state):
+        '''
+        update, add the current plan of a ChainState (with vote tallies) to
+        the summary.
+
+        Arguments:
+        ----------
+        state: ChainState instance
+            The state of the walk.
+
+        RETURNS:
+        ----------
+        None
+        '''
+        self.num_plans += 1
+        self.seat_histogram[int(round(2 * state.yellow_seats))] += 1
+        self.seats.update(state.yellow_seats)
+        self.cut_edges.update(len(state.cut_edges))
+
+    def merge(self, other):
+        '''
+        merge, add the plans summarized by other, e.g. from another chain.
+        '''
+        self.num_plans += other.num_plans
+        self.seat_histogram += other.seat_histogram
+        self.seats.merge(other.seats)
+        self.cut_edges.merge(other.cut_edges)
+
+    def seat_values(self):
+        '''
+        seat_values, the seat counts that were seen and how often.
+
+        RETURNS:
+        ----------
+        values: numpy array instance
+            The numbers of Yellow seats (multiples of 1/2).
+        counts: numpy array instance
+            counts[i] is the number of plans with values[i] Yellow seats.
+        '''
+        seen = np.flatnonzero(self.seat_histogram)
+        return seen / 2.0, self.seat_histogram[seen]
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of county_downloader.py against a local stand-in of a Clarity site.
+
+The server serves fixture files by path. A path can be given a list of
+responses, which are sent one after the other (the last one repeats), so a
+county can fail a few times before it works. A response with an ETag header
+is answered with 304 when the request has a matching If-None-Match.
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from county_downloader import CountyDownloader, HostRateLimiter
+
+
+def detail_zip(data):
+    '''
+    detail_zip, the bytes of a detailxls.zip holding detail.xls.
+    '''
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('detail.xls', data)
+    return archive.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            responses = server.files.get(self.path, [(404, {}, b'')])
+            (status, headers, body) = responses[0]
+            if len(responses) > 1:
+                server.files[self.path] = responses[1:]
+        if (status == 200 and 'ETag' in headers and
+                self.headers.get('If-None-Match') == headers['ETag']):
+            (status, body) = (304, b'')
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SiteTestCase(unittest.TestCase):
+    '''
+    SiteTestCase, starts the server before every test; self.files maps a
+    path to its list of (status, headers, body) responses.
+    '''
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.files = self.files = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.prefix = 'http://127.0.0.1:%d/GA/' % self.server.server_port
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.out_dir)
+
+    def serve(self, path, *responses):
+        self.files['/GA/' + path] = [response if isinstance(response, tuple)
+                                     else (200, {}, response)
+                                     for response in responses]
+
+    def requests(self, path):
+        return [headers for (requested, headers) in self.server.requests
+                if requested == '/GA/' + path]
+
+
+class CountyDownloaderTest(SiteTestCase):
+
+    def downloader(self, **options):
+        return CountyDownloader(self.out_dir, prefix=self.prefix,
+                                requests_per_second=None, backoff=0.01,
+                                **options)
+
+    def test_download_counties(self):
+        self.serve('Good/1/current_ver.txt', b'5\n')
+        self.serve('Good/1/5/reports/detailxls.zip', detail_zip(b'good'))
+        # a 503 that is retried, then the county works
+        self.serve('Flaky/2/current_ver.txt', (503, {}, b''), b'7')
+        self.serve('Flaky/2/7/reports/detailxls.zip', detail_zip(b'flaky'))
+        errors_path = os.path.join(self.out_dir, 'errors.jsonl')
+        downloader = self.downloader()
+        (paths, errors) = downloader.download_counties(
+            ['Good', 'Flaky', 'Missing'], ['1', '2', '3'], errors_path)
+
+        self.assertEqual(sorted(paths), ['Flaky', 'Good'])
+        for (county, data) in [('Good', b'good'), ('Flaky', b'flaky')]:
+            with open(paths[county], 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertEqual(len(self.requests('Flaky/2/current_ver.txt')), 2)
+
+        # the 404 is not retried and becomes a line of the errors file
+        self.assertEqual(len(self.requests('Missing/3/current_ver.txt')), 1)
+        self.assertEqual([error.county for error in errors], ['Missing'])
+        with open(errors_path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['county'], 'Missing')
+        self.assertEqual(records[0]['stage'], 'version')
+        self.assertEqual(records[0]['attempts'], 1)
+        self.assertIn('404', records[0]['error'])
+
+        # the keep-alive connections of the worker threads are closed
+        self.assertEqual(downloader.client._threads, {})
+
+    def test_retry_after(self):
+        self.serve('Busy/1/current_ver.txt', (429, {'Retry-After': '1'}, b''),
+                   b'3')
+        start = time.monotonic()
+        version = self.downloader().current_version('Busy', '1')
+        self.assertEqual(version, '3')
+        self.assertGreaterEqual(time.monotonic() - start, 1.0)
+
+    def test_retries_run_out(self):
+        self.serve('Down/1/current_ver.txt', (503, {}, b''))
+        (path, error) = self.downloader(retries=2).download_county('Down', '1')
+        self.assertIsNone(path)
+        self.assertEqual(error.attempts, 3)
+        self.assertEqual(len(self.requests('Down/1/current_ver.txt')), 3)
+
+
+class HostRateLimiterTest(unittest.TestCase):
+
+    def test_requests_are_spaced(self):
+        limiter = HostRateLimiter(requests_per_second=20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait('a')
+        # the first request starts at once, the other four 0.05 s apart
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        start = time.monotonic()
+        limiter.wait('b')
+        self.assertLess(time.monotonic() - start, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
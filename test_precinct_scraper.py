@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of precinct_scraper.py against a local page server.
+
+The server stands in for a Clarity site: it serves current_ver.txt, the
+json/details.json of some counties and the md_data.html page of every
+county, and the browsers of the pool are stand-ins that fetch the page as it
+is (the page has no Javascript to run).
+"""
+
+import importlib.util
+import json
+import threading
+import unittest
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from county_downloader import CountyDownloader
+from precinct_scraper import (BrowserPool, PrecinctScraper,
+                              details_json_to_precinct_table,
+                              html_to_precinct_table)
+
+HAS_HTML_PARSER = any(importlib.util.find_spec(name) is not None
+                      for name in ('lxml', 'bs4'))
+
+DETAILS = {'Contests': [
+    {'K': '3', 'P': ['North', 'South', 'East'], 'CH': ['A', 'B'],
+     'V': [[10, 20], [5, 7], [1234, 0]]},
+    {'K': '9', 'P': ['North'], 'CH': ['C'], 'V': [[1]]}]}
+
+PAGE = '''<html><body>
+<table><tr><td>menu</td></tr></table>
+<table>
+<tr><td></td><td>Precinct</td><td>A</td><td>B</td><td>Total</td></tr>
+<tr><td>1</td><td>North</td><td>10</td><td>20</td><td>30</td></tr>
+<tr><td>2</td><td>Precinct</td><td>A</td><td>B</td><td>Total</td></tr>
+<tr><td>3</td><td>South</td><td>5</td><td>7</td><td>12</td></tr>
+<tr><td>4</td><td>East</td><td>1,234</td><td>0</td><td>1,234</td></tr>
+<tr><td>5</td><td>Total:</td><td>1,249</td><td>27</td><td>1,276</td></tr>
+</table></body></html>'''
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # the counties with a details.json, and what it holds
+    details = {'WithJSON': json.dumps(DETAILS).encode(),
+               'BadJSON': b'{"Contests": [{"K": "3"}]}'}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        county = self.path.split('/')[2]
+        self.server.requests.append(self.path)
+        if self.path.endswith('current_ver.txt'):
+            self._send(200, b'77')
+        elif self.path.endswith('json/details.json'):
+            if county in self.details:
+                self._send(200, self.details[county])
+            else:
+                self._send(404)
+        elif 'md_data.html' in self.path:
+            self._send(200, PAGE.encode())
+        else:
+            self._send(404)
+
+
+class _Browser(object):
+    def get(self, url):
+        self.page_source = urllib.request.urlopen(url).read().decode()
+
+    def quit(self):
+        pass
+
+
+@unittest.skipUnless(HAS_HTML_PARSER, 'pandas.read_html needs lxml or bs4')
+class PrecinctScraperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        prefix = 'http://127.0.0.1:%d/GA/' % self.server.server_port
+        self.downloader = CountyDownloader(None, prefix=prefix,
+                                           requests_per_second=None)
+        self.pool = BrowserPool(2, _Browser)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parsers_give_the_same_table(self):
+        from_json = details_json_to_precinct_table(DETAILS, '3')
+        from_html = html_to_precinct_table(PAGE)
+        pd.testing.assert_frame_equal(from_json, from_html)
+        self.assertEqual(list(from_json.columns), [1, 2, 3, 4])
+
+    def test_json_and_rendered_page_give_equal_frames(self):
+        with_json = PrecinctScraper(self.downloader, self.pool, use_json=True)
+        rendered = PrecinctScraper(self.downloader, self.pool, use_json=False)
+        (table, error) = with_json.scrape('WithJSON', '1', '3')
+        self.assertIsNone(error)
+        self.assertFalse(any('md_data' in path
+                             for path in self.server.requests))
+        (page_table, error) = rendered.scrape('WithJSON', '1', '3')
+        self.assertIsNone(error)
+        pd.testing.assert_frame_equal(table, page_table)
+
+    def test_render_without_json_or_contest(self):
+        scraper = PrecinctScraper(self.downloader, self.pool)
+        expected = details_json_to_precinct_table(DETAILS, '3')
+        # no details.json (404), and a details.json without contest 4
+        for (county, cid) in [('NoJSON', '3'), ('WithJSON', '4')]:
+            (table, error) = scraper.scrape(county, '1', cid)
+            self.assertIsNone(error)
+            pd.testing.assert_frame_equal(table, expected)
+
+    def test_broken_json_is_an_error(self):
+        scraper = PrecinctScraper(self.downloader, self.pool)
+        (table, error) = scraper.scrape('BadJSON', '1', '3')
+        self.assertIsNone(table)
+        self.assertEqual(error.stage, 'json')
+        self.assertFalse(any('md_data' in path
+                             for path in self.server.requests))
+
+    def test_scrape_url(self):
+        scraper = PrecinctScraper(self.downloader, self.pool)
+        url = scraper.page_url('WithJSON', '1', '77', '3')
+        (table, error) = scraper.scrape_url(url)
+        self.assertIsNone(error)
+        pd.testing.assert_frame_equal(
+            table, details_json_to_precinct_table(DETAILS, '3'))
+        (table, error) = scraper.scrape_url('http://elsewhere/x.html')
+        self.assertEqual(error.stage, 'url')
+
+
+if __name__ == '__main__':
+    unittest.main()
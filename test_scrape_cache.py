@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of scrape_cache.py with county_downloader.py against the local site of
+test_county_downloader.py.
+"""
+
+import os
+import unittest
+
+from county_downloader import CountyDownloader
+from scrape_cache import ScrapeCache
+from test_county_downloader import SiteTestCase, detail_zip
+
+
+class ScrapeCacheTest(SiteTestCase):
+
+    def downloader(self, cache):
+        return CountyDownloader(self.out_dir, prefix=self.prefix, cache=cache,
+                                requests_per_second=None, backoff=0.01)
+
+    def cache(self):
+        return ScrapeCache(os.path.join(self.out_dir, 'cache'), max_age=0)
+
+    def test_second_run_revalidates(self):
+        self.serve('Good/1/current_ver.txt', (200, {'ETag': '"v5"'}, b'5'))
+        self.serve('Good/1/5/reports/detailxls.zip', detail_zip(b'good'))
+        first = self.cache()
+        (path, error) = self.downloader(first).download_county('Good', '1')
+        self.assertIsNone(error)
+        self.assertEqual(first.stats['version_fetched'], 1)
+        self.assertEqual(first.stats['file_fetched'], 1)
+
+        # a new run: the version is checked with If-None-Match, the site
+        # answers 304 and the archive comes from the cache
+        second = self.cache()
+        (path, error) = self.downloader(second).download_county('Good', '1')
+        self.assertIsNone(error)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'good')
+        versions = self.requests('Good/1/current_ver.txt')
+        self.assertEqual(len(versions), 2)
+        self.assertNotIn('If-None-Match', versions[0])
+        self.assertEqual(versions[1].get('If-None-Match'), '"v5"')
+        self.assertEqual(second.stats['version_not_modified'], 1)
+        self.assertEqual(second.stats['file_cached'], 1)
+        self.assertEqual(len(self.requests('Good/1/5/reports/detailxls.zip')),
+                         1)
+
+        # within a run the version is only looked up once
+        self.downloader(second).download_county('Good', '1')
+        self.assertEqual(len(self.requests('Good/1/current_ver.txt')), 2)
+
+    def test_304_without_cached_version(self):
+        self.serve('Odd/1/current_ver.txt', (304, {}, b''), b'8')
+        cache = self.cache()
+        self.assertEqual(self.downloader(cache).current_version('Odd', '1'),
+                         '8')
+        versions = self.requests('Odd/1/current_ver.txt')
+        self.assertEqual(len(versions), 2)
+        self.assertNotIn('If-None-Match', versions[1])
+        self.assertEqual(cache.stats['version_fetched'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()